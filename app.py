@@ -3,18 +3,29 @@ import streamlit as st
 from streamlit_chat import message
 
 import pandas as pd
+import os
+import time
+import zipfile
 # from pandasai import PandasAI
 from src.pandasai_custom import CustomPandasAI
 from src.prompts import *
 from src.sqlite import * 
+from src.cache import CodeCache
+from src.semantic_cache import SemanticCache
+from src.result_cache import ResultCache
+from src.export import EXPORT_FORMATS, Exports
+from src.dataset_registry import Dataset, DatasetRegistry
+from src.dataset_store import DatasetStore, content_key
+from src.ingestion import (IngestionReport, MemoryBudgetExceededError, format_bytes, ingest_csv, list_excel_sheets,
+                           read_excel_compact)
+from src.profile import DatasetProfile
+from src.spans import UI_RENDER
+from src.llm import StreamingOpenAI
+from src.worker_pool import WorkerPool
 
 from pandasai.llm.openai import OpenAI
-from pandasai.middlewares.streamlit import StreamlitMiddleware
 
-
-from pandasai.exceptions import NoCodeFoundError
 from dotenv import load_dotenv
-import sqlite3
 import config
 
 load_dotenv()
@@ -29,19 +40,45 @@ if hasattr(config, 'USE_CODE_SUMMARY'):
 else:
     USE_CODE_SUMMARY = True
 
-conn = sqlite3.connect('prompt_log.db')
-cursor = conn.cursor()
+if hasattr(config, 'USE_CODE_CACHE'):
+    USE_CODE_CACHE = config.USE_CODE_CACHE
+else:
+    USE_CODE_CACHE = True
+
+if hasattr(config, 'USE_SEMANTIC_CACHE'):
+    USE_SEMANTIC_CACHE = config.USE_SEMANTIC_CACHE
+else:
+    USE_SEMANTIC_CACHE = True
+
+if hasattr(config, 'USE_RESULT_CACHE'):
+    USE_RESULT_CACHE = config.USE_RESULT_CACHE
+else:
+    USE_RESULT_CACHE = True
+
+if hasattr(config, 'OPTIMIZE_CODE'):
+    OPTIMIZE_CODE = config.OPTIMIZE_CODE
+else:
+    OPTIMIZE_CODE = True
+
+if hasattr(config, 'EXECUTION_BACKEND'):
+    EXECUTION_BACKEND = config.EXECUTION_BACKEND
+else:
+    EXECUTION_BACKEND = 'pandas'
+
+if hasattr(config, 'STREAM_RESPONSES'):
+    STREAM_RESPONSES = config.STREAM_RESPONSES
+else:
+    STREAM_RESPONSES = True
+
+if hasattr(config, 'INGESTION_ENGINE'):
+    INGESTION_ENGINE = config.INGESTION_ENGINE
+else:
+    INGESTION_ENGINE = 'pandas'
 
-cursor.execute('''CREATE TABLE IF NOT EXISTS prompt_log (
-                    id INTEGER PRIMARY KEY AUTOINCREMENT,
-                    prompt TEXT,
-                    full_prompt TEXT,
-                    answer TEXT,
-                    code_executed TEXT,
-                    code_generated TEXT,
-                    error TEXT
-                )''')
-conn.commit()
+if hasattr(config, 'INGESTION_MEMORY_BUDGET_MB') and config.INGESTION_MEMORY_BUDGET_MB:
+    INGESTION_MEMORY_BUDGET = config.INGESTION_MEMORY_BUDGET_MB * 1024 ** 2
+else:
+    INGESTION_MEMORY_BUDGET = None
 
 st.set_page_config(layout="wide")
 #Creating the chatbot interface
@@ -61,6 +98,19 @@ if 'code_executed' not in st.session_state:
 if 'code_generated' not in st.session_state:
     st.session_state['code_generated'] = []
 
+if 'last_execution' not in st.session_state:
+    st.session_state['last_execution'] = None
+
+if 'code_summary' not in st.session_state:
+    st.session_state['code_summary'] = None
+
+if 'semantic_match' not in st.session_state:
+    st.session_state['semantic_match'] = None
+
+# File id of every upload -> (digest, seconds hashing it took)
+if 'upload_digests' not in st.session_state:
+    st.session_state['upload_digests'] = {}
+
 # Define a function to clear the input text
 def clear_input_text():
     global input_text
@@ -73,14 +123,171 @@ def get_text():
     return input_text
 
 
-@st.cache_data
+# One code cache for the whole server, shared by every session
+@st.cache_resource
+def get_code_cache():
+    return CodeCache(
+        path=getattr(config, 'CODE_CACHE_PATH', 'cache/code_cache.db'),
+        max_entries=getattr(config, 'CODE_CACHE_MAX_ENTRIES', 1000),
+        ttl=getattr(config, 'CODE_CACHE_TTL', None),
+    )
+
+# Code of past questions reused for paraphrases, stored next to the code cache
+@st.cache_resource
+def get_semantic_cache():
+    return SemanticCache(
+        path=getattr(config, 'CODE_CACHE_PATH', 'cache/code_cache.db'),
+        threshold=getattr(config, 'SEMANTIC_CACHE_THRESHOLD', 0.6),
+        max_entries=getattr(config, 'CODE_CACHE_MAX_ENTRIES', 1000),
+        ttl=getattr(config, 'CODE_CACHE_TTL', None),
+    )
+
+def forget_semantic_match(id):
+    get_semantic_cache().delete(id)
+    st.session_state.semantic_match = None
+
+# Results of executed code for the whole server, keyed on the code and the datasets
+@st.cache_resource
+def get_result_cache():
+    return ResultCache(
+        memory_limit_mb=getattr(config, 'RESULT_CACHE_MEMORY_MB', 256),
+        spill_dir=getattr(config, 'RESULT_CACHE_SPILL_DIR', 'cache/results'),
+        spill_limit_mb=getattr(config, 'RESULT_CACHE_SPILL_LIMIT_MB', 2048),
+    )
+
+# One prompt logger for the whole server, writing from its own thread
+@st.cache_resource
+def get_prompt_logger():
+    return PromptLogger(
+        batch_size=getattr(config, 'PROMPT_LOG_BATCH_SIZE', 100),
+        flush_interval=getattr(config, 'PROMPT_LOG_FLUSH_INTERVAL', 0.5),
+    )
+
+# One pool of worker processes for the whole server, None executes the code in the server
+@st.cache_resource
+def get_worker_pool():
+    if not getattr(config, 'EXECUTION_WORKERS', 0):
+        return None
+    return WorkerPool(
+        processes=config.EXECUTION_WORKERS,
+        timeout=getattr(config, 'EXECUTION_TIMEOUT', 30),
+        memory_limit_mb=getattr(config, 'EXECUTION_MEMORY_LIMIT_MB', None),
+        store=get_dataset_store(),
+    )
+
+# One dataset store for the whole server, None parses every upload
+@st.cache_resource
+def get_dataset_store():
+    directory = getattr(config, 'DATASET_STORE_DIR', os.path.expanduser('~/.cache/pandasai_chat/datasets'))
+    return DatasetStore(directory, size_limit_mb=getattr(config, 'DATASET_STORE_LIMIT_MB', None)) if directory else None
+
+def csv_options():
+    # Compact dtypes with the configured engine, see src/ingestion.py
+    if INGESTION_ENGINE == 'pyarrow':
+        return dict(
+            engine='pyarrow',
+            arrow_backed=getattr(config, 'ARROW_BACKED_DTYPES', False),
+            max_category_ratio=getattr(config, 'INGESTION_MAX_CATEGORY_RATIO', 0.5),
+        )
+    return dict(
+        engine='pandas',
+        chunk_rows=getattr(config, 'INGESTION_CHUNK_ROWS', 100_000),
+        max_category_ratio=getattr(config, 'INGESTION_MAX_CATEGORY_RATIO', 0.5),
+    )
+
+# The dataset registry and store cache the parsed uploads, parsing is not cached here:
+# st.cache_data would hash the whole upload on every call and keep a pickled copy
 def parse_csv(file):
-    return pd.read_csv(file)
-
-# Define a function to parse a PDF file and extract its text content
-@st.cache_data
-def parse_xlsx(file) -> pd.DataFrame:
-    return pd.read_excel(file)
+    return ingest_csv(file, name=file.name, memory_budget=INGESTION_MEMORY_BUDGET, **csv_options())
+
+# Only the sheet asked for is parsed, None for the first one
+def parse_xlsx(file, sheet=None):
+    name = file.name if sheet is None else f"{file.name} [{sheet}]"
+    return read_excel_compact(file, sheet=sheet, name=name, memory_budget=INGESTION_MEMORY_BUDGET,
+                              max_category_ratio=getattr(config, 'INGESTION_MAX_CATEGORY_RATIO', 0.5))
+
+# One dataset registry for the whole server, sessions only keep handles to its datasets
+@st.cache_resource
+def get_dataset_registry():
+    return DatasetRegistry(memory_limit_mb=getattr(config, 'DATASET_MEMORY_LIMIT_MB', None))
+
+# Uploads are parsed once, then memory-mapped from the dataset store by every session,
+# the worker processes and the server after a restart. Every sheet of a workbook is
+# its own dataset
+def load_dataset(file, extension: str, key: str, sheet=None) -> Dataset:
+    store = get_dataset_store()
+    start = time.perf_counter()
+    stored = store.get(key) if store is not None else None
+
+    report = None
+    if stored is not None:
+        dataframe, metadata = stored
+        if 'report' in metadata:
+            name = file.name if sheet is None else f"{file.name} [{sheet}]"
+            report = IngestionReport(**{**metadata['report'], 'name': name})
+        parse_seconds = metadata.get('parse_seconds', 0.0)
+    else:
+        if extension == 'xlsx':
+            dataframe, report = parse_xlsx(file, sheet)
+        else:
+            dataframe, report = parse_csv(file)
+        parse_seconds = time.perf_counter() - start
+        if store is not None:
+            metadata = {'parse_seconds': parse_seconds}
+            if report:
+                metadata['report'] = vars(report)
+            dataframe = store.put(key, dataframe, metadata)
+    load_seconds = time.perf_counter() - start
+
+    # Everything the prompts need is computed once per dataset, not per session
+    df_head = generate_df_head(dataframe, add_nulls=True)
+    profile = DatasetProfile.from_dataframe(dataframe, head=df_head)
+    return Dataset(key, dataframe, profile=profile, report=report, parse_seconds=parse_seconds,
+                   load_seconds=load_seconds)
+
+# Uploads are hashed once per session, in chunks. Reruns and other sheets of the same
+# workbook reuse the digest
+def upload_digest(uploaded_file) -> str:
+    digests = st.session_state.upload_digests
+    if uploaded_file.id not in digests:
+        start = time.perf_counter()
+        digests[uploaded_file.id] = (content_key(uploaded_file), time.perf_counter() - start)
+    return digests[uploaded_file.id][0]
+
+def open_datasets(uploaded_files, extension: str, sheets=None) -> list:
+    registry = get_dataset_registry()
+    handles = []
+    for uploaded_file in uploaded_files:
+        digest = upload_digest(uploaded_file).encode()
+        if extension == 'csv':
+            keys = [(None, content_key(digest, reader=extension, **csv_options()))]
+        else:
+            keys = [(sheet, content_key(digest, reader=extension, sheet=sheet,
+                                        max_category_ratio=getattr(config, 'INGESTION_MAX_CATEGORY_RATIO', 0.5)))
+                    for sheet in sheets[uploaded_file.name]]
+
+        for sheet, key in keys:
+            handles.append(registry.acquire(key, lambda: load_dataset(uploaded_file, extension, key, sheet)))
+            # The upload is already keyed on its content, don't hash the dataframe again
+            if USE_RESULT_CACHE:
+                get_result_cache().register(handles[-1].dataset.dataframe, key)
+    return handles
+
+# Sheets are listed from the workbook index, only the ones selected are parsed
+def select_sheets(uploaded_files) -> dict:
+    sheets = {}
+    for uploaded_file in uploaded_files:
+        try:
+            names = list_excel_sheets(uploaded_file)
+        except (zipfile.BadZipFile, KeyError):
+            st.error(f"{uploaded_file.name} is not a valid XLSX workbook.")
+            st.stop()
+        if len(names) > 1:
+            sheets[uploaded_file.name] = st.multiselect(f"Sheets of {uploaded_file.name}", names,
+                                                        default=names[:1], key=f"sheets_{uploaded_file.name}")
+        else:
+            sheets[uploaded_file.name] = names
+    return sheets
 
 def convert_document_to_dict(document):
     return {
@@ -88,15 +295,18 @@ def convert_document_to_dict(document):
         'metadata': document.metadata,  # assuming this is already a dictionary
     }
 
-@st.cache_data
-def df_to_csv(df_name, df):
-    # base_path = "saved_dataframes_csv"
-    # filename = f'{base_path}/{df_name}.csv'
-    
-    return df.to_csv(index=False).encode('utf-8')
+# Result dataframes are written to files for download, once per dataframe and format
+@st.cache_resource
+def get_exports():
+    return Exports(
+        directory=getattr(config, 'EXPORT_DIR', None),
+        chunk_rows=getattr(config, 'EXPORT_CHUNK_ROWS', 100_000),
+    )
     
 
 def main():
+    render_span = None
+
     with st.container():
         col1, col2, _ = st.columns((25,50,25))
 
@@ -113,30 +323,35 @@ def main():
                     raw_response_button = st.button("Raw Response")
             uploaded_files = st.file_uploader("**Upload Your CSV/XLSX File**", type=['xlsx', 'csv'], accept_multiple_files=True)
 
-    df = []
+            sheets = None
+            if uploaded_files and uploaded_files[0].name.split(".")[-1].lower() == 'xlsx':
+                sheets = select_sheets(uploaded_files)
 
     if uploaded_files:
-        if "df" not in st.session_state:
+        # Selecting other sheets opens them in place of the current datasets
+        if "datasets" in st.session_state and st.session_state.get('sheets') != sheets:
+            del st.session_state.datasets
+
+        if "datasets" not in st.session_state:
             file_extension = uploaded_files[0].name.split(".")[-1].lower()
-            if file_extension == 'xlsx':
-                for uploaded_file in uploaded_files:
-                    df.append(parse_xlsx(uploaded_file))
-            elif file_extension == 'csv':
-                for uploaded_file in uploaded_files:
-                    df.append(parse_csv(uploaded_file))
-            else:
+            if file_extension not in ('xlsx', 'csv'):
                 st.error("Unsupported file type. Please upload a CSV or XLSX file.")
-
-            st.session_state.df = df
-            # random_df = randomize_df(copy_dfs(df), add_nulls=False)
-            random_df = df
-            st.session_state.random_df = random_df
-
-            # OLD 
-            df_head = old_generate_df_head(copy_dfs(df), add_nulls=True)
-            st.session_state.df_head = df_head
-
-            llm = OpenAI(temperature=0)
+                st.stop()
+            if sheets is not None and not all(sheets.values()):
+                st.warning("Select at least one sheet of every workbook.")
+                st.stop()
+
+            # The session keeps handles, the dataframes are shared by every session
+            # that uploaded the same files
+            try:
+                st.session_state.datasets = open_datasets(uploaded_files, file_extension, sheets)
+                st.session_state.sheets = sheets
+            except MemoryBudgetExceededError as e:
+                st.error(str(e))
+                st.stop()
+
+            llm = StreamingOpenAI(temperature=0) if STREAM_RESPONSES else OpenAI(temperature=0)
+            st.session_state.llm = llm
             custom_prompts = {
                 "generate_python_code": config.PYTHON_CODE_PROMPT,
                 "generate_response": CustomGenerateResponsePrompt,
@@ -144,21 +359,69 @@ def main():
             }
 
             custom_whitelist = ['random', 'matplotlib', 'seaborn', 'pandas']
+            code_cache = get_code_cache() if USE_CODE_CACHE else None
+            semantic_cache = get_semantic_cache() if USE_SEMANTIC_CACHE else None
+            result_cache = get_result_cache() if USE_RESULT_CACHE else None
             st.session_state.pai = CustomPandasAI(llm=llm, conversational=True, enable_cache=False,
                                                   non_default_prompts=custom_prompts,
-                                                  custom_whitelisted_dependencies=custom_whitelist)
+                                                  custom_whitelisted_dependencies=custom_whitelist,
+                                                  code_cache=code_cache,
+                                                  semantic_cache=semantic_cache,
+                                                  result_cache=result_cache,
+                                                  execution_backend=EXECUTION_BACKEND,
+                                                  duckdb_spill_dir=getattr(config, 'DUCKDB_SPILL_DIR', None),
+                                                  speculative_candidates=getattr(config, 'SPECULATIVE_CANDIDATES', 1),
+                                                  speculative_temperature=getattr(config, 'SPECULATIVE_TEMPERATURE', 0.7),
+                                                  worker_pool=get_worker_pool(),
+                                                  optimize_code=OPTIMIZE_CODE,
+                                                  code_warning_seconds=getattr(config, 'CODE_WARNING_SECONDS', 1.0))
         else:
+            datasets = [handle.dataset for handle in st.session_state.datasets]
+            # random_df = randomize_df(copy_dfs(df), add_nulls=False)
+            random_df = [dataset.dataframe for dataset in datasets]
+            df_profile = [dataset.profile for dataset in datasets]
+
             if button:
                 pai = st.session_state.pai
-                random_df = st.session_state.random_df
-                df_head = st.session_state.df_head
 
-                # Use DF randomization to generate better df.head() for context
-                
-                # st.dataframe(random_df.head(5))
-                # Generate answer by call to PandasAI
-                answer = run_prompt(user_input, pai, random_df, df_head)
-                
+                # Partial responses are shown here while they stream, the chat and code
+                # panels below render the final ones
+                code_placeholder = st.empty()
+                answer_placeholder = st.empty()
+                summary_placeholder = st.empty()
+                # Expensive code is reported before it runs, and stays until the next question
+                issues_placeholder = st.empty()
+
+                def show_code_issues(issues):
+                    issues_placeholder.warning("This code may take a while to run:\n\n" +
+                                               "\n".join(f"- {issue}" for issue in issues))
+
+                pai.on_code_issues = show_code_issues
+                if STREAM_RESPONSES:
+                    st.session_state.llm.on_token = code_placeholder.code
+                try:
+                    # Generate answer by call to PandasAI
+                    answer = run_prompt(user_input, pai, random_df, df_profile=df_profile,
+                                        is_conversational_answer=False)
+                finally:
+                    pai.on_code_issues = None
+                    if STREAM_RESPONSES:
+                        st.session_state.llm.on_token = None
+                code_placeholder.empty()
+
+                # The conversational answer and the code summary are independent calls,
+                # run them concurrently. Failed runs keep their error message as answer.
+                st.session_state.code_summary = None
+                if pai.last_execution is not None:
+                    answer, st.session_state.code_summary = follow_up(
+                        user_input, pai, answer, len(random_df),
+                        code_summary=USE_CODE_SUMMARY,
+                        on_answer_token=answer_placeholder.markdown if STREAM_RESPONSES else None,
+                        on_summary_token=summary_placeholder.info if STREAM_RESPONSES else None,
+                    )
+                answer_placeholder.empty()
+                summary_placeholder.empty()
+
                 # Store the output in session history
                 st.session_state.past.append(user_input)
                 st.session_state.generated.append(answer)
@@ -174,26 +437,71 @@ def main():
                     st.session_state.code_generated.append(pai.last_code_generated)
                 else:
                     st.session_state.code_generated.append("# No code generated")
+
+                # Keep the captured output of the single execution for display
+                st.session_state.last_execution = pai.last_execution
+                st.session_state.semantic_match = pai.last_semantic_match
                 
-                full_prompt = get_prompt(user_input, random_df)
-                log_prompt(conn, cursor, user_input, full_prompt, answer, pai.last_code_executed, 
-                        pai.last_code_generated, pai.last_error)
+                full_prompt = get_prompt(user_input, random_df, df_profile=df_profile)
+                # Queued, the background writer commits it off the request path
+                get_prompt_logger().log(user_input, full_prompt, answer, pai.last_code_executed,
+                        pai.last_code_generated, pai.last_error, backend=pai.last_backend,
+                        latency=pai.last_latency, execution_latency=pai.last_execution_latency,
+                        candidate=pai.last_candidate, prompt_id=pai.last_prompt_id(),
+                        spans=pai.last_trace.spans)
+
+                # The answer is rendered below, its span is logged once it is
+                render_span = pai.last_trace.start(UI_RENDER)
             elif DEBUG and raw_response_button:
                 pai = st.session_state.pai
-                random_df = st.session_state.random_df
 
-                response = pai.get_raw_response(user_input, random_df)
+                response = pai.get_raw_response(user_input, random_df, df_profile=df_profile)
 
                 st.markdown("### Raw Response")
                 st.code(response)
 
+            if DEBUG and USE_CODE_CACHE:
+                code_cache = get_code_cache()
+                st.caption(f"Code cache: {code_cache.hits} hits, {code_cache.misses} misses "
+                           f"({code_cache.hit_rate:.0%} hit rate, {len(code_cache)} entries)")
+
+            if DEBUG and USE_SEMANTIC_CACHE:
+                semantic_cache = get_semantic_cache()
+                st.caption(f"Semantic cache: {semantic_cache.hits} hits, {semantic_cache.misses} misses "
+                           f"({semantic_cache.hit_rate:.0%} hit rate, {len(semantic_cache)} questions)")
+                st.button("Clear semantic cache", on_click=semantic_cache.invalidate)
+
+            if DEBUG and USE_RESULT_CACHE:
+                result_cache = get_result_cache()
+                st.caption(f"Result cache: {result_cache.hits} hits, {result_cache.misses} misses "
+                           f"({result_cache.hit_rate:.0%} hit rate, {len(result_cache)} results, "
+                           f"{result_cache.nbytes / 1024 ** 2:.0f} MB in memory, {result_cache.spills} spills)")
+
+            if DEBUG:
+                registry = get_dataset_registry()
+                st.caption(f"Datasets: {len(registry)} loaded ({registry.in_use} in use, "
+                           f"{registry.nbytes / 1024 ** 2:.0f} MB), {registry.loads} loads, "
+                           f"{registry.reuses} reuses, {registry.evictions} evictions, "
+                           f"{registry.seconds_saved:.1f}s of parsing saved")
+                # What this rerun would spend hashing and parsing the uploads again
+                hash_seconds = sum(seconds for _, seconds in st.session_state.upload_digests.values())
+                parse_seconds = sum(handle.dataset.parse_seconds for handle in st.session_state.datasets)
+                st.caption(f"This rerun reused {len(st.session_state.datasets)} datasets, skipping "
+                           f"{hash_seconds:.2f}s of hashing and {parse_seconds:.2f}s of parsing")
+
         with st.container():
             col1, col2, _ = st.columns((25,50,25))
             with col2:
-                if "df" in st.session_state:
+                if "datasets" in st.session_state:
+                    datasets = [handle.dataset for handle in st.session_state.datasets]
                     # Display the centered DataFrame
-                    for item in st.session_state.df:
-                        st.dataframe(item, height=1)
+                    for dataset in datasets:
+                        st.dataframe(dataset.dataframe, height=1)
+
+                    # Memory footprint before/after dtype compaction
+                    for dataset in datasets:
+                        if dataset.report is not None:
+                            st.caption(str(dataset.report))
 
         with st.container():
             col1, col2 = st.columns(2)
@@ -220,61 +528,81 @@ def main():
                 # Grab last code generated
                 code_executed = st.session_state.code_executed[-1]
                 code_generated = st.session_state.code_generated[-1]
-                st.code(code_executed, language='python')
-            
-                df = copy_dfs(st.session_state.random_df)
-                pai = st.session_state.pai
-                try:
-                    # Replace any plots with streamlit plots for display
-                    rerun_code = StreamlitMiddleware()(code_generated)
-
-                    # Not the most rigorous implementation of checking for charts, but it works
-                    has_chart = rerun_code != "import streamlit as st\n" + code_generated
-
-                    # if has_chart and DEBUG:
-                    #     second_code = pai.cleanup_graph_code(rerun_code)
-                    #     st.markdown('## Second Run Code')
-                    #     st.code(second_code, language='python')
-
-                    # if has_chart:
-                    #     rerun_code = pai.cleanup_graph_code(rerun_code)
-                    output, result, environment = pai.get_code_output(rerun_code, df, use_error_correction_framework=False, has_chart=has_chart)
-
-                    if not has_chart:
-                        if output:
-                            st.code(output)
-                        if result:
-                            st.code(result)
+
+                # The answer was computed once on Submit; reuse it instead of re-running the code
+                execution = st.session_state.last_execution
+
+                language = execution.language if execution is not None else 'python'
+                st.code(code_executed, language=language)
+
+                # The code was written for a similar question, let users reject the match
+                semantic_match = st.session_state.semantic_match
+                if semantic_match is not None:
+                    id, similar_prompt, _, similarity = semantic_match
+                    st.caption(f"Reused the code of a similar question: \"{similar_prompt}\" "
+                               f"(similarity {similarity:.2f})")
+                    st.button("Not the same question", on_click=forget_semantic_match, args=(id,))
+
+                if execution is not None:
+                    # Charts were captured while the code ran, render them directly
+                    for figure in execution.figures:
+                        st.pyplot(figure)
+
+                    if not execution.has_chart:
+                        if execution.output:
+                            st.code(execution.output)
+                        if execution.display_result:
+                            st.code(execution.display_result)
                     
-                    # If there is code, generate a code summary to explain what the code does
-                    if USE_CODE_SUMMARY and code_generated:
-                        last_prompt = st.session_state.past[-1]
-                        code_summary = generate_code_summary(pai, len(df), last_prompt, code_executed)
-                        st.info(code_summary)
+                    # Summary of what the code does, generated along with the answer
+                    if USE_CODE_SUMMARY and code_generated and st.session_state.code_summary:
+                        st.info(st.session_state.code_summary)
+
+                    # Dataframes the code created or modified, so users can download them
+                    environment = execution.environment
+                    frames = {frame.name: frame for frame in execution.frames if frame.is_dataframe}
 
-                    # Extract variables in the environment that are dataframes so users can download them
-                    dfs_in_env = extract_dfs(environment)
+                    if frames:
+                        def describe_frame(name):
+                            if not name:
+                                return name
+                            rows, columns = frames[name].shape
+                            return f"{name} ({rows:,} x {columns}, {format_bytes(frames[name].nbytes)})"
 
-                    if dfs_in_env:
                         option = st.selectbox(
                             'Select dataframe to download',
-                            [''] + dfs_in_env)
+                            [''] + list(frames), format_func=describe_frame)
                         
                         if option:
                             save_df = environment[option]
-                            csv_file = df_to_csv(option, save_df)
-                            
-                            st.download_button(
-                                label="Download CSV",
-                                data=csv_file,
-                                file_name=f'{option}.csv'
-                            )
-
-                except NoCodeFoundError:
-                    print("No code")
+                            export_format = st.radio("Format", list(EXPORT_FORMATS), horizontal=True)
+                            extension, mimetype = EXPORT_FORMATS[export_format]
+
+                            # Small results are exported right away, large ones once asked for
+                            exports = get_exports()
+                            path = exports.get(save_df, export_format)
+                            if path is None and (len(save_df) <= getattr(config, 'EXPORT_EAGER_ROWS', 100_000)
+                                                 or st.button(f"Prepare {len(save_df):,} rows as {export_format}")):
+                                with st.spinner("Exporting..."):
+                                    try:
+                                        path = exports.path(save_df, export_format)
+                                    except ValueError as e:
+                                        st.error(str(e))
+
+                            if path is not None:
+                                with open(path, 'rb') as file:
+                                    st.download_button(
+                                        label=f"Download {export_format}",
+                                        data=file,
+                                        file_name=f'{option}{extension}',
+                                        mime=mimetype,
+                                    )
+
+    # Rendering the answer is the last stage of the prompt
+    if render_span is not None:
+        pai = st.session_state.pai
+        get_prompt_logger().log_spans(pai.last_prompt_id(), [pai.last_trace.end(render_span)])
 
 # Run the app
 if __name__ == "__main__":
     main()
-
-conn.close()
\ No newline at end of file
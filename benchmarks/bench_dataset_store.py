@@ -0,0 +1,69 @@
+"""
+Benchmark reopening an upload from the dataset store against parsing it again.
+
+For each ingestion engine the scaled demo CSV is parsed once into a store. Every case
+then runs in a fresh process, as after a server restart: "parse" ingests the CSV,
+"store" memory-maps the stored file. The peak RSS shows how much of the dataframe is a
+private copy rather than pages shared through the page cache.
+
+Usage:
+    python benchmarks/bench_dataset_store.py --rows 10000000
+"""
+import argparse
+import os
+import tempfile
+import time
+
+from utils import peak_rss_mb, run_isolated, write_demo_csv
+
+ENGINES = ("pandas", "pyarrow")
+
+
+def populate(engine: str, path: str, directory: str) -> str:
+    from src.dataset_store import DatasetStore, content_key
+    from src.ingestion import ingest_csv
+
+    store = DatasetStore(directory)
+    with open(path, "rb") as file:
+        key = content_key(file.read(), reader="csv", engine=engine)
+    if store.get(key) is None:
+        df, report = ingest_csv(path, engine=engine)
+        store.put(key, df, {"report": vars(report)})
+    return key
+
+
+def run_case(mode: str, engine: str, path: str, directory: str, key: str):
+    from src.dataset_store import DatasetStore
+    from src.ingestion import ingest_csv
+
+    baseline = peak_rss_mb()
+    start = time.perf_counter()
+    if mode == "parse":
+        ingest_csv(path, engine=engine)
+    else:
+        DatasetStore(directory).get(key)
+    return time.perf_counter() - start, peak_rss_mb() - baseline
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--rows", type=int, default=10_000_000)
+    parser.add_argument("--csv", help="Where to write the scaled CSV. Default to a temporary file")
+    parser.add_argument("--store", help="Directory of the dataset store. Default to a temporary directory")
+    args = parser.parse_args()
+
+    path = args.csv or os.path.join(tempfile.gettempdir(), f"ds_salaries_{args.rows}.csv")
+    write_demo_csv(args.rows, path)
+    directory = args.store or tempfile.mkdtemp(prefix="datasets_")
+    print(f"{path}: {os.path.getsize(path) / 1024 ** 2:.0f} MB")
+
+    print(f"{'engine':<10} {'mode':<8} {'wall time (s)':>14} {'peak RSS +MB':>13}")
+    for engine in ENGINES:
+        key = run_isolated(populate, engine, path, directory)
+        for mode in ("parse", "store"):
+            elapsed, rss = run_isolated(run_case, mode, engine, path, directory, key)
+            print(f"{engine:<10} {mode:<8} {elapsed:>14.2f} {rss:>13.0f}")
+
+
+if __name__ == "__main__":
+    main()
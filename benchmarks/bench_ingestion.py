@@ -0,0 +1,56 @@
+"""
+Benchmark the CSV ingestion engines on the demo dataset scaled up.
+
+Compares the current default `pd.read_csv` path with the chunked pandas engine and the
+pyarrow engine (Arrow-backed and converted to numpy). Every engine runs in a fresh
+process; the scaled CSV is written once and reused between runs.
+
+Usage:
+    python benchmarks/bench_ingestion.py --rows 10000000
+"""
+import argparse
+import os
+import tempfile
+import time
+
+from utils import peak_rss_mb, run_isolated, write_demo_csv
+
+ENGINES = ("read_csv", "pandas", "pyarrow", "pyarrow-numpy")
+
+
+def run_engine(engine: str, path: str):
+    import pandas as pd
+
+    from src.ingestion import ingest_csv
+
+    baseline = peak_rss_mb()
+    start = time.perf_counter()
+    if engine == "read_csv":
+        df = pd.read_csv(path)
+    elif engine == "pyarrow-numpy":
+        df, _ = ingest_csv(path, engine="pyarrow", arrow_backed=False)
+    else:
+        df, _ = ingest_csv(path, engine=engine)
+    elapsed = time.perf_counter() - start
+
+    return elapsed, peak_rss_mb() - baseline, df.memory_usage(deep=True).sum() / 1024 ** 2
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--rows", type=int, default=10_000_000)
+    parser.add_argument("--csv", help="Where to write the scaled CSV. Default to a temporary file")
+    args = parser.parse_args()
+
+    path = args.csv or os.path.join(tempfile.gettempdir(), f"ds_salaries_{args.rows}.csv")
+    write_demo_csv(args.rows, path)
+    print(f"{path}: {os.path.getsize(path) / 1024 ** 2:.0f} MB")
+
+    print(f"{'engine':<14} {'wall time (s)':>14} {'peak RSS +MB':>13} {'frame MB':>9}")
+    for engine in ENGINES:
+        elapsed, rss, size = run_isolated(run_engine, engine, path)
+        print(f"{engine:<14} {elapsed:>14.2f} {rss:>13.0f} {size:>9.0f}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,326 @@
+"""
+Benchmark the question-answering pipeline without calling OpenAI.
+
+`CannedLLM` answers every question of `QUESTIONS` with fixed code, one of them with code
+that fails and the correction the error correction framework asks for, so the whole
+pipeline runs deterministically. Every case runs for every size of the demo dataset in
+a fresh process and reports latency percentiles over its repetitions (and over the
+questions for the pipeline cases) and the peak RSS on top of the loaded dataset:
+
+    run                   CustomPandasAI.run, prompt to answer, with the canned LLM
+    run_ingested          CustomPandasAI.run on the dataframe src.ingestion reads from the
+                          scaled CSV (categoricals, nullable integers), as the app does.
+                          Fails if an answer differs from the one on `pd.read_csv`
+    run_code              CustomPandasAI.run_code on the canned code
+    get_code_output       CustomPandasAI.get_code_output on the canned code
+    old_generate_df_head  chat.old_generate_df_head
+    copy_dfs              chat.copy_dfs, deep copy
+    parse_csv             app.parse_csv on the scaled CSV
+    parse_xlsx            app.parse_xlsx on the scaled workbook, at most --xlsx-rows rows
+
+With --save-baseline the results are written to the baseline file, with the machine
+they were measured on. Otherwise they are compared with it and the script exits with
+status 1 if p50, p95 or the peak RSS got worse by more than the tolerance; p99 is only
+reported. Without a baseline it exits with status 2. Baselines are only comparable on
+the machine they were measured on: benchmarks/baseline.json is the reference for the
+default --rows 1000 100000, measured on the machine it records. On another machine, save
+a baseline from the target branch first, then compare the change against it:
+
+    git checkout main && python benchmarks/bench_pipeline.py --save-baseline --baseline /tmp/baseline.json
+    git checkout my-branch && python benchmarks/bench_pipeline.py --baseline /tmp/baseline.json
+
+Like the app, it needs a config.py.
+
+Usage:
+    python benchmarks/bench_pipeline.py
+    python benchmarks/bench_pipeline.py --rows 1000 1000000 10000000
+"""
+import argparse
+import json
+import os
+import platform
+import sys
+import tempfile
+import time
+
+from utils import ROOT_DIR, load_demo, peak_rss_mb, reset_peak_rss, run_isolated, write_demo_csv
+
+CASES = ("run", "run_ingested", "run_code", "get_code_output", "old_generate_df_head", "copy_dfs", "parse_csv",
+         "parse_xlsx")
+PIPELINE_CASES = ("run", "run_ingested", "run_code", "get_code_output")
+
+# Question -> code the LLM answers with, then the corrections it answers with when
+# the code fails
+QUESTIONS = {
+    "What is the average salary in USD?": [
+        "df['salary_in_usd'].mean()",
+    ],
+    "Which 5 job titles have the highest median salary?": [
+        "df.groupby('job_title')['salary_in_usd'].median().nlargest(5)",
+    ],
+    "How many employees work fully remotely every year?": [
+        "df[df['remote_ratio'] == 100].groupby('work_year').size()",
+    ],
+    "What is the average salary by experience level and company size?": [
+        "df.pivot_table(index='experience_level', columns='company_size', values='salary_in_usd', aggfunc='mean')",
+    ],
+    "What are the 10 company locations with the highest salary in thousands?": [
+        "df['salary_k'] = df['salary_in_usd'] / 1000\n"
+        "df.groupby('company_location')['salary_k'].mean().nlargest(10)",
+    ],
+    "What is the highest remote ratio in per mille?": [
+        "(df['remote_ratio'] * 10).max()",
+    ],
+    "Which job title and company size pairs are the most common?": [
+        "df.apply(lambda row: row['job_title'] + ' (' + row['company_size'] + ')', axis=1).value_counts().head(5)",
+    ],
+    "Plot the average salary per experience level": [
+        "import matplotlib.pyplot as plt\n"
+        "df.groupby('experience_level')['salary_in_usd'].mean().plot(kind='bar')\nplt.show()",
+    ],
+    "What is the median salary of data scientists?": [
+        "df[df['job'] == 'Data Scientist']['salary_in_usd'].median()",
+        "df[df['job_title'] == 'Data Scientist']['salary_in_usd'].median()",
+    ],
+}
+
+PERCENTILES = (50, 95, 99)
+# Too few repetitions fall in the tail to compare p99 between runs
+COMPARED = ("p50", "p95", "peak_rss_mb")
+# Excel sheets can't hold more than 1,048,576 rows and reading them is slow
+XLSX_ROWS = 100_000
+BASELINE = os.path.join(ROOT_DIR, "benchmarks", "baseline.json")
+# Key of the baseline file describing the machine it was measured on
+MACHINE = "machine"
+
+
+def canned_llm():
+    from pandasai.llm.fake import FakeLLM
+
+    class CannedLLM(FakeLLM):
+        """Answers with the code of the question found in the prompt, the corrections
+        when the prompt asks to correct an error"""
+
+        def call(self, instruction, value, suffix=""):
+            self.last_prompt = str(instruction) + str(value) + suffix
+            question = next(question for question in QUESTIONS if question in self.last_prompt)
+            # Code generation prompts are sent with the question as value, corrections without
+            return QUESTIONS[question][0 if value else -1]
+
+    return CannedLLM()
+
+
+def run_case(case: str, rows: int, repeat: int, csv_path: str, xlsx_path: str):
+    import matplotlib
+    import streamlit.logger
+
+    # Importing the app outside `streamlit run` warns about the missing runtime
+    streamlit.logger.set_log_level("error")
+
+    matplotlib.use("Agg")
+    import matplotlib.pyplot as plt
+
+    df = load_demo(rows) if case not in ("parse_csv", "parse_xlsx") else None
+
+    if case in PIPELINE_CASES:
+        from src.pandasai_custom import CustomPandasAI
+        from src.profile import DatasetProfile
+
+        pai = CustomPandasAI(llm=canned_llm(), enable_cache=False)
+        if case == "run_ingested":
+            from src.ingestion import ingest_csv
+
+            ingested, _ = ingest_csv(csv_path)
+            check_answers(pai, df, ingested)
+            df = ingested
+        profile = DatasetProfile.from_dataframe(df)
+        pai.run(df, next(iter(QUESTIONS)), is_conversational_answer=False, df_profile=profile)
+
+        def calls():
+            for question, codes in QUESTIONS.items():
+                if case in ("run", "run_ingested"):
+                    yield lambda: pai.run(df, question, is_conversational_answer=False, df_profile=profile)
+                elif case == "run_code":
+                    yield lambda: pai.run_code(codes[0], df)
+                else:
+                    yield lambda: pai.get_code_output(codes[0], df, has_chart="plot" in codes[0])
+    else:
+        if case in ("old_generate_df_head", "copy_dfs"):
+            from chat import copy_dfs, old_generate_df_head
+
+            function = {"old_generate_df_head": lambda: old_generate_df_head(df, add_nulls=True),
+                        "copy_dfs": lambda: copy_dfs([df])}[case]
+        else:
+            import app
+
+            parse = getattr(app, case)
+            path = csv_path if case == "parse_csv" else xlsx_path
+
+            def function():
+                with open(path, "rb") as file:
+                    parse(file)
+
+        def calls():
+            yield function
+
+    reset_peak_rss()
+    baseline = peak_rss_mb()
+    timings = []
+    for _ in range(repeat):
+        for call in calls():
+            start = time.perf_counter()
+            call()
+            timings.append(time.perf_counter() - start)
+            plt.close("all")
+
+    return timings, peak_rss_mb() - baseline
+
+
+def same_answer(expected, actual) -> bool:
+    """Whether two results are equal, ignoring the dtypes that ingestion changes"""
+    import pandas as pd
+
+    if not isinstance(expected, (pd.Series, pd.DataFrame)):
+        return expected == actual or pd.isna(expected) and pd.isna(actual)
+    if type(expected) is not type(actual):
+        return False
+
+    def normalize(result):
+        # Categoricals group and pivot on every category, in the order of the categories
+        result = result.astype(object)
+        result.index = result.index.astype(object)
+        if isinstance(result, pd.DataFrame):
+            result.columns = result.columns.astype(object)
+        return result.dropna(how="all")
+
+    expected, actual = normalize(expected), normalize(actual)
+    if isinstance(expected, pd.DataFrame):
+        actual = actual.reindex(index=expected.index, columns=expected.columns)
+        assert_equal = pd.testing.assert_frame_equal
+    else:
+        actual = actual.reindex(expected.index)
+        assert_equal = pd.testing.assert_series_equal
+    try:
+        assert_equal(expected, actual, check_dtype=False, check_names=False)
+    except AssertionError:
+        return False
+    return True
+
+
+def check_answers(pai, plain, ingested):
+    """Raise if the canned code answers differently on the ingested dataframe"""
+    for question, codes in QUESTIONS.items():
+        expected = pai.run_code(codes[-1], plain)
+        actual = pai.run_code(codes[-1], ingested)
+        if not same_answer(expected, actual):
+            raise AssertionError(f"{question} {codes[-1]!r} answers {actual!r} on the ingested dataframe, "
+                                 f"{expected!r} on pd.read_csv")
+
+
+def machine() -> dict:
+    """The machine the results are measured on"""
+    import pandas as pd
+
+    return {
+        "platform": platform.platform(),
+        "processor": platform.processor() or platform.machine(),
+        "cpus": os.cpu_count(),
+        "python": platform.python_version(),
+        "pandas": pd.__version__,
+    }
+
+
+def write_demo_xlsx(rows: int, path: str) -> str:
+    """Write the demo dataset scaled to `rows` rows as a workbook, reusing an existing file"""
+    if not os.path.exists(path):
+        load_demo(rows).to_excel(path, index=False)
+    return path
+
+
+def percentile(timings, q):
+    import numpy as np
+
+    return float(np.percentile(timings, q))
+
+
+def compare(results: dict, baseline: dict, tolerance: float, min_delta: float, min_rss_delta: float):
+    """Return the regressions of the results against the baseline, as messages"""
+    regressions = []
+    for key, result in results.items():
+        if key not in baseline:
+            print(f"{key} is not in the baseline")
+            continue
+        for metric in COMPARED:
+            value, before = result[metric], baseline[key].get(metric)
+            if before is None:
+                continue
+            floor = min_rss_delta if metric == "peak_rss_mb" else min_delta
+            if value > before * (1 + tolerance) and value - before > floor:
+                regressions.append(f"{key} {metric}: {before:.4f} -> {value:.4f}")
+    return regressions
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--rows", type=int, nargs="+", default=[1_000, 100_000])
+    parser.add_argument("--cases", nargs="+", choices=CASES, default=list(CASES))
+    parser.add_argument("--repeat", type=int, default=5)
+    parser.add_argument("--xlsx-rows", type=int, default=XLSX_ROWS, help="Rows of the workbook at most")
+    parser.add_argument("--baseline", default=BASELINE)
+    parser.add_argument("--save-baseline", action="store_true", help="Write the results as the baseline")
+    parser.add_argument("--tolerance", type=float, default=0.25, help="Slowdown allowed, as a ratio")
+    parser.add_argument("--min-delta", type=float, default=0.05, help="Slowdown ignored, in seconds")
+    parser.add_argument("--min-rss-delta", type=float, default=20, help="Peak RSS increase ignored, in MB")
+    args = parser.parse_args()
+
+    print(f"{'case':<22} {'rows':>10} " + " ".join(f"{f'p{q} (s)':>10}" for q in PERCENTILES) + f" {'peak RSS +MB':>13}")
+    results = {}
+    for rows in args.rows:
+        csv_path = write_demo_csv(rows, os.path.join(tempfile.gettempdir(), f"ds_salaries_{rows}.csv"))
+        xlsx_rows = min(rows, args.xlsx_rows)
+        xlsx_path = os.path.join(tempfile.gettempdir(), f"ds_salaries_{xlsx_rows}.xlsx")
+        if "parse_xlsx" in args.cases:
+            write_demo_xlsx(xlsx_rows, xlsx_path)
+
+        for case in args.cases:
+            key = f"{case}/{xlsx_rows if case == 'parse_xlsx' else rows}"
+            if key in results:
+                continue
+            timings, rss = run_isolated(run_case, case, rows, args.repeat, csv_path, xlsx_path)
+            results[key] = {f"p{q}": percentile(timings, q) for q in PERCENTILES}
+            results[key]["peak_rss_mb"] = rss
+            print(f"{case:<22} {key.split('/')[1]:>10} "
+                  + " ".join(f"{results[key][f'p{q}']:>10.4f}" for q in PERCENTILES) + f" {rss:>13.1f}")
+
+    if args.save_baseline:
+        baseline = {}
+        if os.path.exists(args.baseline):
+            with open(args.baseline) as file:
+                baseline = json.load(file)
+        baseline.update(results)
+        baseline[MACHINE] = machine()
+        with open(args.baseline, "w") as file:
+            json.dump(baseline, file, indent=2, sort_keys=True)
+        print(f"Baseline written to {args.baseline}")
+        return
+
+    if not os.path.exists(args.baseline):
+        print(f"No baseline at {args.baseline}, run with --save-baseline to store one")
+        sys.exit(2)
+
+    with open(args.baseline) as file:
+        baseline = json.load(file)
+    measured_on = baseline.pop(MACHINE, None)
+    if measured_on != machine():
+        print(f"The baseline was measured on another machine, {measured_on}, the comparison may not hold")
+    regressions = compare(results, baseline, args.tolerance, args.min_delta, args.min_rss_delta)
+    if regressions:
+        print("Regressions against the baseline:")
+        for regression in regressions:
+            print(f"  {regression}")
+        sys.exit(1)
+    print("No regression against the baseline")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,74 @@
+"""
+Benchmark the column profiler on a wide synthetic dataframe.
+
+The dataframe mixes low-cardinality integers, floats with missing values and
+categoricals. "legacy" is what the old head builder did per column (a full, sorted
+value_counts), "full" profiles without sampling and "sampled" is the default profile.
+Every case runs in a fresh process.
+
+Usage:
+    python benchmarks/bench_profile.py --rows 10000000 --columns 100
+"""
+import argparse
+import time
+
+from utils import run_isolated
+
+
+def make_frame(rows: int, columns: int):
+    import numpy as np
+    import pandas as pd
+
+    rng = np.random.default_rng(0)
+    data = {}
+    for i in range(columns):
+        kind = i % 3
+        if kind == 0:
+            data[f"int_{i}"] = rng.integers(0, 1000, rows, dtype=np.int32)
+        elif kind == 1:
+            values = rng.random(rows, dtype=np.float32)
+            values[rng.random(rows) < 0.1] = np.nan
+            data[f"float_{i}"] = values
+        else:
+            data[f"category_{i}"] = pd.Categorical.from_codes(
+                rng.integers(0, 50, rows, dtype=np.int8), [f"value {j}" for j in range(50)]
+            )
+    return pd.DataFrame(data)
+
+
+def run_case(mode: str, rows: int, columns: int, repeat: int):
+    from src.profile import profile_columns
+
+    df = make_frame(rows, columns)
+
+    timings = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        if mode == "legacy":
+            for column in df.columns:
+                df[column].value_counts().head(5)
+        elif mode == "full":
+            profile_columns(df, sample_size=None)
+        else:
+            profile_columns(df)
+        timings.append(time.perf_counter() - start)
+
+    return min(timings)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--rows", type=int, default=10_000_000)
+    parser.add_argument("--columns", type=int, default=100)
+    parser.add_argument("--repeat", type=int, default=3)
+    args = parser.parse_args()
+
+    print(f"{args.rows:,} rows x {args.columns} columns")
+    print(f"{'mode':<10} {'latency (s)':>12}")
+    for mode in ("legacy", "full", "sampled"):
+        latency = run_isolated(run_case, mode, args.rows, args.columns, args.repeat)
+        print(f"{mode:<10} {latency:>12.3f}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,92 @@
+"""
+Benchmark the Prompt Database page queries on a large prompt log.
+
+A database with the requested number of synthetic entries is written once and reused.
+About 1% of the entries have an error and they span a year. Every query the page can
+issue is timed: the first and a deep page, the error filters, a date range and text
+searches for a common and a rare word.
+
+Usage:
+    python benchmarks/bench_prompt_log.py --rows 1000000
+"""
+import argparse
+import os
+import random
+import tempfile
+import time
+
+import utils  # noqa: F401  (puts the repository root on the path)
+from src.sqlite import INSERT_PROMPT_LOG, connect, create_prompt_log_table, retrieve_prompt_log
+
+WORDS = ["salary", "average", "country", "remote", "experience", "title", "company", "year", "plot", "median"]
+YEAR = 365 * 24 * 60 * 60
+
+
+def populate(path: str, rows: int):
+    rng = random.Random(0)
+    conn = connect(path)
+    create_prompt_log_table(conn)
+    existing = conn.execute("SELECT count(*) FROM prompt_log").fetchone()[0]
+    start = time.time() - YEAR
+    batch = []
+    for i in range(existing, rows):
+        words = " ".join(rng.choices(WORDS, k=6))
+        rare = " zanzibar" if i % 100_000 == 0 else ""
+        error = "KeyError: 'salary'" if rng.random() < 0.01 else None
+        batch.append((
+            f"What is the {words}?{rare}", "full prompt " * 50, f"The {words} is {i}",
+            f"df.groupby('{words.split()[0]}').mean()", f"df.groupby('{words.split()[0]}').mean()",
+            error, "pandas", 1.0, 0.01, None, start + YEAR * i / rows, None,
+        ))
+        if len(batch) == 10_000:
+            with conn:
+                conn.executemany(INSERT_PROMPT_LOG, batch)
+            batch = []
+    if batch:
+        with conn:
+            conn.executemany(INSERT_PROMPT_LOG, batch)
+    conn.close()
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--rows", type=int, default=1_000_000)
+    parser.add_argument("--db", help="Where to write the database. Default to a temporary file")
+    parser.add_argument("--repeat", type=int, default=5)
+    args = parser.parse_args()
+
+    path = args.db or os.path.join(tempfile.gettempdir(), f"prompt_log_{args.rows}.db")
+    populate(path, args.rows)
+
+    conn = connect(path)
+    start = time.perf_counter()
+    create_prompt_log_table(conn)
+    print(f"{path}: {args.rows:,} entries, migration check {(time.perf_counter() - start) * 1000:.1f} ms")
+
+    cursor = conn.cursor()
+    middle = time.time() - YEAR / 2
+    deep = args.rows // 2
+    cases = {
+        "first page": {},
+        "deep page": {"before_id": deep},
+        "with error": {"has_error": True},
+        "with error, deep": {"has_error": True, "before_id": deep},
+        "without error": {"has_error": False},
+        "one day": {"since": middle, "until": middle + 24 * 60 * 60},
+        "search common": {"search": "salary median"},
+        "search rare": {"search": "zanzibar"},
+        "search + error": {"search": "remote", "has_error": True},
+    }
+
+    print(f"{'query':<20} {'rows':>5} {'latency (ms)':>13}")
+    for name, filters in cases.items():
+        timings = []
+        for _ in range(args.repeat):
+            start = time.perf_counter()
+            rows = retrieve_prompt_log(cursor, limit=20, **filters)
+            timings.append(time.perf_counter() - start)
+        print(f"{name:<20} {len(rows):>5} {min(timings) * 1000:>13.1f}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,88 @@
+"""
+Helpers shared by the benchmark scripts.
+"""
+import multiprocessing
+import os
+import queue as queue_module
+import resource
+import sys
+
+ROOT_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+DEMO_CSV = os.path.join(ROOT_DIR, "demo", "ds_salaries.csv")
+
+if ROOT_DIR not in sys.path:
+    sys.path.insert(0, ROOT_DIR)
+
+
+def load_demo(rows: int):
+    """Return the demo dataset repeated until it has `rows` rows"""
+    import pandas as pd
+
+    df = pd.read_csv(DEMO_CSV)
+    repeats = -(-rows // len(df))
+    return pd.concat([df] * repeats, ignore_index=True).head(rows)
+
+
+def write_demo_csv(rows: int, path: str) -> str:
+    """Write the demo dataset scaled to `rows` rows to `path`, reusing an existing file"""
+    import pyarrow as pa
+    import pyarrow.csv as pa_csv
+
+    if not os.path.exists(path):
+        table = pa_csv.read_csv(DEMO_CSV)
+        repeats = -(-rows // table.num_rows)
+        scaled = pa.concat_tables([table] * repeats).slice(0, rows)
+        pa_csv.write_csv(scaled, path)
+    return path
+
+
+def peak_rss_mb() -> float:
+    """Peak resident set size of the current process in MB, since `reset_peak_rss`"""
+    # VmHWM can be reset, ru_maxrss can't
+    try:
+        with open("/proc/self/status") as status:
+            for line in status:
+                if line.startswith("VmHWM:"):
+                    return int(line.split()[1]) / 1024
+    except OSError:
+        pass
+    # ru_maxrss is in kilobytes on Linux and bytes on macOS
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return peak / 1024 ** 2 if sys.platform == "darwin" else peak / 1024
+
+
+def reset_peak_rss():
+    """
+    Reset the peak resident set size to the current one on Linux, so loading the data
+    doesn't hide the peak of what is measured after it. No-op elsewhere
+    """
+    import gc
+
+    gc.collect()
+    try:
+        with open("/proc/self/clear_refs", "w") as clear_refs:
+            clear_refs.write("5")
+    except OSError:
+        pass
+
+
+def _run(target, args, queue):
+    queue.put(target(*args))
+
+
+def run_isolated(target, *args):
+    """Run `target(*args)` in a fresh process and return its result"""
+    context = multiprocessing.get_context("spawn")
+    queue = context.Queue()
+    process = context.Process(target=_run, args=(target, args, queue))
+    process.start()
+    # Don't wait forever on a process killed before it could answer (e.g. out of memory)
+    while True:
+        try:
+            result = queue.get(timeout=1)
+            break
+        except queue_module.Empty:
+            if not process.is_alive():
+                raise RuntimeError(f"The benchmark process died with exit code {process.exitcode}")
+    process.join()
+    return result
@@ -1,9 +1,12 @@
 
+import asyncio
 import config
 import logging
 # from typing import List
 import pandas  as pd
 from src.pandasai_custom import CustomPandasAI
+from src.profile import profile_columns
+from src.prompts import CustomMultipleDataframesPrompt
 # from pandasai.prompts.generate_python_code import GeneratePythonCodePrompt
 # from pandasai.prompts.multiple_dataframes import MultipleDataframesPrompt
 # from typing import List
@@ -23,12 +26,14 @@ logging.basicConfig(
 LOGGER = logging.getLogger(__name__)
 
 # Define answer generation function
-def run_prompt(prompt: str, pai: CustomPandasAI, df: pd.DataFrame, df_head=None):
+def run_prompt(prompt: str, pai: CustomPandasAI, df: pd.DataFrame, df_head=None, df_profile=None,
+               is_conversational_answer=None):
 
     # Log a message indicating that the function has started
     LOGGER.info(f"Start answering based on prompt: {prompt}.")
 
-    answer = pai.custom_run(df, prompt=prompt, df_head=df_head)
+    answer = pai.custom_run(df, prompt=prompt, df_head=df_head, df_profile=df_profile,
+                            is_conversational_answer=is_conversational_answer)
 
     # Log a message indicating the answer that was generated
     LOGGER.info(f"The returned answer is: {answer}")
@@ -38,8 +43,41 @@ def run_prompt(prompt: str, pai: CustomPandasAI, df: pd.DataFrame, df_head=None)
     return answer
 
 
-def get_prompt(prompt: str, data_frame: pd.DataFrame, suffix: str=""):
-    if isinstance(data_frame, list):
+# Rewrite the answer and summarize the code concurrently, streaming both
+def follow_up(prompt: str, pai: CustomPandasAI, answer, number_dataframes: int, code_summary: bool = True,
+              on_answer_token=None, on_summary_token=None):
+    code = pai.last_code_executed if code_summary else None
+    answer, summary = asyncio.run(pai.afollow_up(
+        prompt,
+        answer,
+        code=code,
+        number_dataframes=number_dataframes,
+        on_answer_token=on_answer_token,
+        on_summary_token=on_summary_token,
+    ))
+
+    LOGGER.info(f"The conversational answer is: {answer}")
+    return answer, summary
+
+
+def get_prompt(prompt: str, data_frame: pd.DataFrame, suffix: str="", df_profile=None):
+    if df_profile is not None:
+        # Render from the profiles computed at upload, as CustomPandasAI does
+        profiles = df_profile if isinstance(df_profile, list) else [df_profile]
+        if isinstance(data_frame, list):
+            if issubclass(config.MULTIPLE_PYTHON_CODE_PROMPT, CustomMultipleDataframesPrompt):
+                instruction = config.MULTIPLE_PYTHON_CODE_PROMPT(profiles=profiles)
+            else:
+                instruction = config.MULTIPLE_PYTHON_CODE_PROMPT([profile.head for profile in profiles])
+        else:
+            instruction = config.PYTHON_CODE_PROMPT(
+                prompt=prompt,
+                df_head=profiles[0].head,
+                num_rows=profiles[0].num_rows,
+                num_columns=profiles[0].num_columns,
+                column_profile=profiles[0].column_profile,
+            )
+    elif isinstance(data_frame, list):
         heads = [
             df.head()
             for df in data_frame
@@ -88,50 +126,43 @@ def extract_dfs(env: dict):
             dfs.append(key)
     return dfs
 
-def copy_dfs(dfs):
+def copy_dfs(dfs, deep: bool = True):
+    """
+    Copy the uploaded dataframes. Shallow copies share the underlying data and are
+    enough when the caller only adds columns or builds new frames from them.
+    """
+    if not deep:
+        if isinstance(dfs, list):
+            return [df.copy(deep=False) for df in dfs]
+        return dfs.copy(deep=False)
     return deepcopy(dfs)
 
-@st.cache_data
-def generate_code_summary(_pai: CustomPandasAI, df_len: int, prompt: str, code: str):
-    return _pai.generate_code_summary(df_len, prompt, code)
-
-
-# Iterate through columns of existing dataframe
-# to generate new column with NaN followed by most common values
-def generate_new_head(df_in, n=5, append_nulls=False):    
-    # Get the n most common values in a given column
-    # If not enough non-NULL values to reach n, then append the least common non-NaN value repeatedly to reach N
-    def get_common_values(s, n):
-        desc_order = s.value_counts()    
-        most_common_values = pd.Series(desc_order.head(n-1).index.to_list())
-        
-        current_length = len(most_common_values)
-        
-        if(current_length < n-1):
-            for num in range(0, n-1-current_length):
-                most_common_values = pd.concat([most_common_values, pd.Series(most_common_values[current_length - 1])], axis = 0)
-                most_common_values = most_common_values.reset_index(drop=True)
-            
-        return most_common_values
-
-    # Append a NaN at the start of an existing series
-    def append_null(s):
-        return pd.concat([pd.Series([np.nan]), s])
-    
-    def new_head(df_in):
-        df_out = pd.DataFrame(df_in.head(n))
-        
-        for column_name, series in df_in.items():
-            new_values = get_common_values(df_in[column_name], n)
+# Build a head with the most common values of every column, optionally preceded by a
+# row of NaN
+def generate_new_head(df_in, n=5, append_nulls=False):
+    """
+    Every column gets its most common values, computed by `profile_columns`. Columns
+    with fewer distinct values than needed repeat their least common value.
+    """
+    rows = n - 1 if append_nulls else n
 
+    def new_head(df_in):
+        profile = profile_columns(df_in, k=rows)
+        columns = {}
+        for column_name, values in profile["top"].items():
+            if values:
+                values = values + [values[-1]] * (rows - len(values))
+            else:
+                values = [np.nan] * rows
             if append_nulls:
-                new_values = append_null(new_values)
+                values = [np.nan] + values
+            columns[column_name] = values
 
-            new_values = new_values.reset_index(drop=True)
-            df_out[column_name] = new_values.values
+        df_out = pd.DataFrame(columns, columns=df_in.columns)
+        return df_out.astype(df_in.dtypes.to_dict(), errors="ignore")
     if isinstance(df_in, list):
         return list(map(new_head, df_in))
-    
+
     return new_head(df_in)
 
 def old_generate_df_head(df: pd.DataFrame, add_nulls: bool = False, n=5):
@@ -158,4 +189,43 @@ def old_generate_df_head(df: pd.DataFrame, add_nulls: bool = False, n=5):
     if isinstance(df, list):
         return list(map(_helper_randomizer, df))
     
-    return _helper_randomizer(df)
\ No newline at end of file
+    return _helper_randomizer(df)
+
+
+def generate_df_head(df, add_nulls: bool = False, n=5, sample_size: int = 10_000, random_state: int = 0):
+    """
+    Build the df.head() sent to the LLM from the rows with the fewest missing values.
+
+    Same output as `old_generate_df_head`, but the rows are picked from a bounded random
+    sample with a partial selection instead of sorting the whole dataframe, and the
+    uploaded dataframe is never copied or modified.
+    """
+    def _helper_head(df):
+        # Fixed seed so the same upload always gets the same head (and cache key)
+        if len(df) > sample_size:
+            rng = np.random.default_rng(random_state)
+            positions = np.sort(rng.choice(len(df), size=sample_size, replace=False))
+            sample = df.take(positions)
+        else:
+            sample = df
+
+        k = min(n - 1 if add_nulls else n, len(sample))
+        # Fewest nulls first, ties broken by row order
+        order_key = sample.isnull().sum(axis=1).to_numpy() * len(sample) + np.arange(len(sample))
+        if 0 < k < len(sample):
+            positions = np.argpartition(order_key, k - 1)[:k]
+        else:
+            positions = np.arange(k)
+        positions = positions[np.argsort(order_key[positions])]
+        df_final = sample.take(positions)
+
+        if add_nulls:
+            # add a row of null values to top of the dataframe
+            new_row = pd.Series([None] * len(df_final.columns), index=df_final.columns)
+            df_final = pd.concat([pd.DataFrame([new_row]), df_final])
+
+        return df_final
+    if isinstance(df, list):
+        return list(map(_helper_head, df))
+
+    return _helper_head(df)
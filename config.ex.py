@@ -1,3 +1,5 @@
+import os
+
 from src.prompts import CustomGeneratePythonCodePrompt, CustomMultipleDataframesPrompt
 # from pandasai.prompts.multiple_dataframes import MultipleDataframesPrompt
 
@@ -6,4 +8,81 @@ MULTIPLE_PYTHON_CODE_PROMPT = CustomMultipleDataframesPrompt
 
 LOGS_FILE = "logs/log.log" 
 
-DEBUG = False
\ No newline at end of file
+DEBUG = False
+
+# The prompt log is written by a background thread, in batches of up to this many
+# entries committed at most this many seconds after the first one was queued
+PROMPT_LOG_BATCH_SIZE = 100
+PROMPT_LOG_FLUSH_INTERVAL = 0.5
+
+# Stream the LLM responses into the page as they are written
+STREAM_RESPONSES = True
+
+# Persistent cache of generated code, keyed on prompt + dataset fingerprint
+USE_CODE_CACHE = True
+CODE_CACHE_PATH = "cache/code_cache.db"
+CODE_CACHE_MAX_ENTRIES = 1000
+CODE_CACHE_TTL = 7 * 24 * 60 * 60  # seconds, None to never expire
+
+# Reuse the code of a question asked on the same dataset in other words. Questions must
+# ask for the same aggregations and numbers, and their TF-IDF vectors have at least
+# this cosine similarity. Stored in the code cache file
+USE_SEMANTIC_CACHE = True
+SEMANTIC_CACHE_THRESHOLD = 0.6
+
+# Results of executed code, keyed on the code and the content of the datasets. Past
+# the memory limit, the least recently used are pickled to the spill directory, itself
+# bounded. None as directory drops them instead
+USE_RESULT_CACHE = True
+RESULT_CACHE_MEMORY_MB = 256
+RESULT_CACHE_SPILL_DIR = "cache/results"
+RESULT_CACHE_SPILL_LIMIT_MB = 2048
+
+# The row-by-row patterns of the generated code (iterrows loops, apply with axis=1,
+# concat in a loop, ...) are vectorized before it runs when they can be. The expensive
+# ones left are shown before the code runs when estimated to take CODE_WARNING_SECONDS or more
+OPTIMIZE_CODE = True
+CODE_WARNING_SECONDS = 1.0
+
+# Result dataframes are downloaded from files written a chunk of rows at a time, in a
+# temporary directory if None. Results over EXPORT_EAGER_ROWS rows are only written
+# once asked for
+EXPORT_DIR = None
+EXPORT_CHUNK_ROWS = 100_000
+EXPORT_EAGER_ROWS = 100_000
+
+# CSV ingestion: "pandas" reads in chunks with compact dtypes, "pyarrow" uses the
+# multithreaded Arrow reader
+INGESTION_ENGINE = "pandas"
+ARROW_BACKED_DTYPES = False  # pyarrow engine only, True keeps the strings in Arrow memory
+INGESTION_CHUNK_ROWS = 100_000
+INGESTION_MAX_CATEGORY_RATIO = 0.5  # distinct/non-null ratio below which strings become categoricals
+INGESTION_MEMORY_BUDGET_MB = None  # per file, None for no limit
+# Excel workbooks are read one selected sheet at a time, with python-calamine if it is
+# installed (pip install python-calamine, several times faster), openpyxl otherwise
+
+# Uploads are parsed once and kept here as memory-mapped Arrow files, keyed on their
+# content, outside of the checkout. None parses every upload
+DATASET_STORE_DIR = os.path.expanduser("~/.cache/pandasai_chat/datasets")
+# Past this many MB of files, the least recently used datasets no session has loaded
+# are removed from the store. None for no limit
+DATASET_STORE_LIMIT_MB = 10240
+# Datasets are shared by every session. Past this many MB, the ones no session uses
+# anymore are evicted, least recently used first. None for no limit
+DATASET_MEMORY_LIMIT_MB = 4096
+
+# "pandas" answers with generated python code, "duckdb" first tries a single SQL
+# query run by DuckDB and falls back to pandas
+EXECUTION_BACKEND = "pandas"
+DUCKDB_SPILL_DIR = None  # directory to spill dataframes to as Parquet, None queries them in memory
+
+# When the generated code fails, ask for this many corrections at the same time and
+# keep the first one that runs. 1 corrects the code one attempt at a time
+SPECULATIVE_CANDIDATES = 1
+SPECULATIVE_TEMPERATURE = 0.7  # temperature of every candidate but the first
+
+# Execute the generated code in this many worker processes, killed past the timeout or
+# the memory limit. 0 executes it in the server process
+EXECUTION_WORKERS = 0
+EXECUTION_TIMEOUT = 30  # seconds, None for no limit
+EXECUTION_MEMORY_LIMIT_MB = 2048  # per run, on top of the datasets it runs on, None for no limit
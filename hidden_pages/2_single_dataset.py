@@ -10,6 +10,8 @@ import pandas as pd
 from src.pandasai_custom import CustomPandasAI
 from src.prompts import *
 from src.sqlite import * 
+from src.result_cache import ResultCache
+from src.ingestion import read_csv_compact
 
 from pandasai.llm.openai import OpenAI
 from pandasai.middlewares.streamlit import StreamlitMiddleware
@@ -24,16 +26,7 @@ load_dotenv()
 conn = sqlite3.connect('prompt_log.db')
 cursor = conn.cursor()
 
-cursor.execute('''CREATE TABLE IF NOT EXISTS prompt_log (
-                    id INTEGER PRIMARY KEY AUTOINCREMENT,
-                    prompt TEXT,
-                    full_prompt TEXT,
-                    answer TEXT,
-                    code_executed TEXT,
-                    code_generated TEXT,
-                    error TEXT
-                )''')
-conn.commit()
+create_prompt_log_table(conn)
 
 st.set_page_config(layout="wide", page_icon="1️⃣", page_title="Data Analytics: Single Dataset")
 #Creating the chatbot interface
@@ -68,7 +61,8 @@ def get_text():
 
 @st.cache_data
 def parse_csv(file):
-    return pd.read_csv(file)
+    df, _ = read_csv_compact(file, name=file.name)
+    return df
 
 # Define a function to parse a PDF file and extract its text content
 @st.cache_data
@@ -109,7 +103,8 @@ def main():
                 "generate_response": CustomGenerateResponsePrompt,
             }
             st.session_state.pai = CustomPandasAI(llm=llm, conversational=True, enable_cache=False,
-                                                  non_default_prompts=custom_prompts)
+                                                  non_default_prompts=custom_prompts,
+                                                  result_cache=ResultCache())
         else:
             pai = st.session_state.pai
             df = st.session_state.df
@@ -174,7 +169,8 @@ def main():
                 code_generated = st.session_state.generated_code[-1]
                 st.code(code_generated, language='python')
 
-                df = st.session_state.df.copy()
+                # Not copied, the executed code only gets copies of the dataframes it mutates
+                df = st.session_state.df
                 pai = st.session_state.pai
                 try:
                     # Replace any plots with streamlit plots for display
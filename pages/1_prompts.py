@@ -1,15 +1,99 @@
+import datetime
+
+import pandas as pd
 import streamlit as st
-from src.sqlite import retrieve_prompt_log
-import sqlite3
+from src.spans import STAGES
+from src.sqlite import (connect, create_prompt_log_table, retrieve_full_prompt, retrieve_prompt_log,
+                        retrieve_span_durations, retrieve_spans)
+
+PAGE_SIZE = 20
+# Latest spans the latency percentiles are computed over
+SPAN_LIMIT = 100_000
+PERCENTILES = {"p50": 0.5, "p90": 0.9, "p95": 0.95, "p99": 0.99}
 
 st.set_page_config(layout="wide", page_title="Data Analytics: Prompt DB", page_icon="📝")
 
 st.markdown("# Prompt Database")
 # st.sidebar.header("")
 
-conn = sqlite3.connect('prompt_log.db')
+conn = connect()
+create_prompt_log_table(conn)
 cursor = conn.cursor()
 
+filter1, filter2, filter3 = st.columns((30, 10, 15))
+with filter1:
+    search = st.text_input("Search prompts, answers and code")
+with filter2:
+    errors = st.selectbox("Errors", ["All", "With error", "Without error"])
+with filter3:
+    dates = st.date_input("Logged between", value=())
+
+has_error = {"All": None, "With error": True, "Without error": False}[errors]
+since = until = None
+if len(dates) > 0:
+    since = datetime.datetime.combine(dates[0], datetime.time()).timestamp()
+if len(dates) > 1:
+    until = datetime.datetime.combine(dates[1] + datetime.timedelta(days=1), datetime.time()).timestamp()
+
+with st.expander("Latency by stage"):
+    spans = pd.DataFrame(
+        retrieve_span_durations(cursor, since=since, until=until, limit=SPAN_LIMIT),
+        columns=["prompt_id", "stage", "duration", "prompt_tokens", "completion_tokens", "latency"],
+    )
+    if spans.empty:
+        st.info("No stage timings logged yet.")
+    else:
+        # A stage can run several times for a prompt, the percentiles are over the
+        # time each prompt spent in it
+        per_prompt = spans.groupby(["stage", "prompt_id"]).agg(
+            duration=("duration", "sum"),
+            prompt_tokens=("prompt_tokens", "sum"),
+            completion_tokens=("completion_tokens", "sum"),
+            latency=("latency", "first"),
+        )
+        stages = per_prompt.groupby(level="stage")
+        percentiles = stages["duration"].quantile(list(PERCENTILES.values())).unstack()
+        percentiles.columns = list(PERCENTILES)
+        percentiles["prompts"] = stages.size()
+        percentiles["prompt tokens"] = stages["prompt_tokens"].mean().round()
+        percentiles["completion tokens"] = stages["completion_tokens"].mean().round()
+        percentiles = percentiles.reindex([stage for stage in STAGES if stage in percentiles.index])
+
+        percentile = st.radio("Percentile", list(PERCENTILES), index=2, horizontal=True)
+        chart1, chart2 = st.columns(2)
+        with chart1:
+            st.markdown(f"**{percentile} per stage (s)**")
+            st.bar_chart(percentiles[percentile])
+        with chart2:
+            # Where the time of the prompts slower than the percentile goes
+            latencies = per_prompt["latency"].groupby(level="prompt_id").first().dropna()
+            if not latencies.empty:
+                threshold = latencies.quantile(PERCENTILES[percentile])
+                slow = latencies.index[latencies >= threshold]
+                durations = per_prompt["duration"]
+                slow_durations = durations[durations.index.get_level_values("prompt_id").isin(slow)]
+                st.markdown(f"**Mean time per stage of the prompts over {percentile} ({threshold:.2f}s)**")
+                st.bar_chart(slow_durations.groupby(level="stage").sum() / len(slow))
+        st.dataframe(percentiles, use_container_width=True)
+        st.caption(f"Over the latest {len(spans):,} stage timings")
+
+# Pages are keyed on the last id of the previous page, the ids the pages start before
+# are kept to go back. Changing a filter goes back to the first page
+filters = (search, has_error, since, until)
+if st.session_state.get("prompt_log_filters") != filters:
+    st.session_state.prompt_log_filters = filters
+    st.session_state.prompt_log_pages = [None]
+pages = st.session_state.prompt_log_pages
+
+logs = retrieve_prompt_log(cursor, before_id=pages[-1], limit=PAGE_SIZE + 1, search=search,
+                           has_error=has_error, since=since, until=until)
+has_older = len(logs) > PAGE_SIZE
+logs = logs[:PAGE_SIZE]
+
+spans_by_prompt = {}
+for prompt_id, *span in retrieve_spans(cursor, [log[-1] for log in logs]):
+    spans_by_prompt.setdefault(prompt_id, []).append(span)
+
 col1, col2, col3, col4, col5 = st.columns((3, 10, 10, 30, 8))
 with col1:
     st.markdown("**ID**")
@@ -24,14 +108,20 @@ with col5:
 
 st.markdown("---")
 
-for log in retrieve_prompt_log(cursor):
-    id, prompt, full_prompt, answer, code_executed, code_generated, error = log
+if not logs:
+    st.info("No prompt log entries found.")
+
+for log in logs:
+    (id, prompt, answer, code_executed, code_generated, error, backend, latency, execution_latency, candidate,
+     created_at, prompt_id) = log
 
     col1, col2, col3, col4, col5 = st.columns((3, 15, 15, 30, 8))
 
     with col1:
         st.markdown(f"### {id}")
-    with col2: 
+        if created_at is not None:
+            st.caption(datetime.datetime.fromtimestamp(created_at).strftime("%Y-%m-%d %H:%M"))
+    with col2:
         st.info(prompt)
     with col3:
         st.success(answer)
@@ -45,15 +135,44 @@ for log in retrieve_prompt_log(cursor):
     with col5:
         st.code(error, language="python")
 
-    with st.expander("See full prompt"):
-        st.code(full_prompt)
+        if backend:
+            st.caption(f"Backend: {backend}")
+        if latency is not None:
+            st.caption(f"Total: {latency:.2f}s")
+        if execution_latency is not None:
+            st.caption(f"Execution: {execution_latency:.3f}s")
+        if candidate is not None:
+            st.caption(f"Won by speculative candidate {candidate}")
+
+        for stage, attempt, duration, prompt_tokens, completion_tokens, bytes_sent in spans_by_prompt.get(prompt_id, []):
+            label = stage if attempt is None else f"{stage} #{attempt}"
+            tokens = f", {prompt_tokens} → {completion_tokens} tokens" if prompt_tokens is not None else ""
+            st.caption(f"{label}: {duration:.3f}s{tokens}")
+
+    # The full prompt is only read from the database once asked for
+    if st.checkbox("See full prompt", key=f"full_prompt_{id}"):
+        st.code(retrieve_full_prompt(cursor, id))
 
     st.markdown("---")
 
+def show_newer():
+    st.session_state.prompt_log_pages.pop()
+
+def show_older(before_id):
+    st.session_state.prompt_log_pages.append(before_id)
+
+newer, page, older = st.columns((10, 30, 10))
+with newer:
+    st.button("Newer", disabled=len(pages) == 1, on_click=show_newer)
+with page:
+    st.caption(f"Page {len(pages)}")
+with older:
+    st.button("Older", disabled=not has_older, on_click=show_older, args=(logs[-1][0] if logs else None,))
+
 # if log_data:
 #     st.header("Prompt Log")
 #     st.table(log_data)
 # else:
 #     st.info("No prompt log entries found.")
 
-conn.close()
\ No newline at end of file
+conn.close()
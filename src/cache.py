@@ -0,0 +1,149 @@
+"""
+This module contains the persistent cache for the code generated by the LLM.
+
+Entries are content-addressed: the key is a hash of the normalized prompt and a
+fingerprint of everything about the dataframes that is sent to the LLM (column names,
+dtypes, row/column counts and the head). The same question on a different dataset
+therefore never returns code written for another schema. When the dataframes come
+with a precomputed dataset profile, its hash is the fingerprint.
+"""
+import hashlib
+import os
+import re
+import sqlite3
+import threading
+import time
+from typing import List, Optional, Union
+
+import pandas as pd
+
+
+def normalize_prompt(prompt: str) -> str:
+    """Lowercase the prompt and collapse whitespace and trailing punctuation"""
+    prompt = re.sub(r"\s+", " ", prompt.strip().lower())
+    return prompt.rstrip(" ?.!")
+
+
+def fingerprint_dataframes(data_frame: Union[pd.DataFrame, List[pd.DataFrame]], df_head=None) -> str:
+    """
+    Fingerprint the metadata of the dataframes that is sent to the LLM.
+
+    Args:
+        data_frame (Union[pd.DataFrame, List[pd.DataFrame]]): The uploaded dataframes
+        df_head (Union[pd.DataFrame, List[pd.DataFrame]]): The heads sent in the prompt.
+        Defaults to the first rows of each dataframe
+
+    Returns (str): A hex digest identifying the schema and the metadata
+    """
+
+    dataframes = data_frame if isinstance(data_frame, list) else [data_frame]
+    heads = df_head if isinstance(df_head, list) else [df_head] * len(dataframes)
+
+    digest = hashlib.sha256()
+    for dataframe, head in zip(dataframes, heads):
+        digest.update(repr(dataframe.shape).encode())
+        for column, dtype in dataframe.dtypes.items():
+            digest.update(f"{column}\x1f{dtype}\x1e".encode())
+        if head is None:
+            head = dataframe.head()
+        digest.update(head.to_csv(index=False).encode())
+        digest.update(b"\x1d")
+
+    return digest.hexdigest()
+
+
+def fingerprint_profiles(profiles: list) -> str:
+    """Combine the hashes of the dataset profiles of the uploaded dataframes"""
+    return hashlib.sha256("\x1d".join(profile.hash for profile in profiles).encode()).hexdigest()
+
+
+class CodeCache:
+    """
+    On-disk cache of generated code with LRU and TTL eviction.
+
+    Args:
+        path (str): SQLite file to store the cache in
+        max_entries (int): Number of entries kept before the least recently used are
+        evicted
+        ttl (float): Seconds an entry stays valid. None keeps entries forever
+    """
+
+    def __init__(self, path: str = "cache/code_cache.db", max_entries: int = 1000, ttl: Optional[float] = None):
+        if os.path.dirname(path):
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self.hits = 0
+        self.misses = 0
+
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(path, check_same_thread=False)
+        self._conn.execute('''CREATE TABLE IF NOT EXISTS code_cache (
+                                key TEXT PRIMARY KEY,
+                                code TEXT,
+                                created_at REAL,
+                                accessed_at REAL,
+                                hits INTEGER DEFAULT 0
+                            )''')
+        self._conn.execute('''CREATE INDEX IF NOT EXISTS code_cache_accessed_at ON code_cache (accessed_at)''')
+        self._conn.commit()
+
+    @staticmethod
+    def key(prompt: str, fingerprint: str) -> str:
+        """Build the cache key of a prompt asked on a dataset with the given fingerprint"""
+        return hashlib.sha256(f"{normalize_prompt(prompt)}\x00{fingerprint}".encode()).hexdigest()
+
+    def get(self, key: str) -> Optional[str]:
+        """Return the cached code for the key, or None if missing or expired"""
+        now = time.time()
+        with self._lock:
+            row = self._conn.execute("SELECT code, created_at FROM code_cache WHERE key = ?", (key,)).fetchone()
+
+            if row is not None and self.ttl is not None and now - row[1] > self.ttl:
+                self._conn.execute("DELETE FROM code_cache WHERE key = ?", (key,))
+                self._conn.commit()
+                row = None
+
+            if row is None:
+                self.misses += 1
+                return None
+
+            self._conn.execute("UPDATE code_cache SET accessed_at = ?, hits = hits + 1 WHERE key = ?", (now, key))
+            self._conn.commit()
+            self.hits += 1
+            return row[0]
+
+    def set(self, key: str, code: str) -> None:
+        """Store the code for the key and evict the least recently used entries"""
+        now = time.time()
+        with self._lock:
+            self._conn.execute('''INSERT OR REPLACE INTO code_cache (key, code, created_at, accessed_at)
+                                  VALUES (?, ?, ?, ?)''', (key, code, now, now))
+            self._conn.execute('''DELETE FROM code_cache WHERE key NOT IN (
+                                    SELECT key FROM code_cache ORDER BY accessed_at DESC LIMIT ?
+                                  )''', (self.max_entries,))
+            if self.ttl is not None:
+                self._conn.execute("DELETE FROM code_cache WHERE created_at < ?", (now - self.ttl,))
+            self._conn.commit()
+
+    def delete(self, key: str) -> None:
+        with self._lock:
+            self._conn.execute("DELETE FROM code_cache WHERE key = ?", (key,))
+            self._conn.commit()
+
+    def clear(self) -> None:
+        with self._lock:
+            self._conn.execute("DELETE FROM code_cache")
+            self._conn.commit()
+            self.hits = 0
+            self.misses = 0
+
+    def __len__(self) -> int:
+        with self._lock:
+            return self._conn.execute("SELECT COUNT(*) FROM code_cache").fetchone()[0]
+
+    @property
+    def hit_rate(self) -> float:
+        total = self.hits + self.misses
+        return self.hits / total if total else 0.0
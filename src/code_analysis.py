@@ -0,0 +1,769 @@
+"""
+This module contains the static analysis of the generated code, run before it executes.
+
+The LLM often answers with row-by-row python: `iterrows()` loops, `apply(..., axis=1)`,
+element-wise `apply(lambda ...)` and loops growing a dataframe with `pd.concat`. On
+millions of rows these take minutes where the vectorized equivalent takes a fraction of
+a second. The patterns whose vectorized form gives the same values are rewritten:
+
+- `df.apply(lambda row: ..., axis=1)` and `df['col'].apply/map(lambda x: ...)` built from
+  arithmetic, comparisons, conditional expressions and string methods become column
+  expressions (`Series.where`, `.str` accessors, `isin`). Categorical columns, which
+  don't support concatenation, ordering or arithmetic, are converted to object first
+  unless only compared for equality or used through `.str`. `apply` and `map` on a
+  categorical column already call the function once per category and are left as is
+- `iterrows()` loops summing into a variable become `.sum()`, and loops summing into a
+  dict keyed on a column become `groupby().sum()`
+- `result = pd.concat([result, part])` in a loop collects the parts and concatenates
+  them once after the loop
+
+Everything else (other loops over rows, unbounded or many-to-many merges, ...) is left
+as is and reported with an estimate of its cost from the dataset profiles.
+"""
+import ast
+import copy
+from typing import Dict, List, Optional
+
+import pandas as pd
+
+from .profile import DatasetProfile
+
+
+# Seconds per row, measured with pandas 1.5
+ITERROWS_SECONDS = 60e-6
+ITERTUPLES_SECONDS = 1e-6
+APPLY_ROWS_SECONDS = 10e-6
+APPLY_VALUES_SECONDS = 0.5e-6
+# Seconds per iteration of a loop concatenating to a growing dataframe
+CONCAT_SECONDS = 0.2e-3
+# Seconds per row of the result of a merge
+MERGE_SECONDS = 0.3e-6
+# A merge is reported when its result may have this many times the rows of its inputs
+MERGE_GROWTH = 10
+
+# String methods with the same behaviour under the `.str` accessor
+STR_METHODS = {"lower", "upper", "strip", "lstrip", "rstrip", "title", "capitalize", "swapcase", "zfill"}
+# Elementwise casts and builtins -> Series method
+CONVERSIONS = {"str": ("astype", "str"), "float": ("astype", "float"), "abs": ("abs", None)}
+# Methods returning a dataframe when called on a dataframe
+FRAME_METHODS = {"copy", "head", "tail", "dropna", "fillna", "sort_values", "sort_index", "drop_duplicates",
+                 "query", "sample", "assign", "reset_index"}
+_ARITHMETIC = (ast.Add, ast.Sub, ast.Mult, ast.Div, ast.FloorDiv, ast.Mod, ast.Pow)
+_COMPARISONS = (ast.Eq, ast.NotEq, ast.Lt, ast.LtE, ast.Gt, ast.GtE)
+
+
+class CodeIssue:
+    """
+    An expensive pattern left in the code.
+
+    Args:
+        kind (str): "iterrows", "itertuples", "apply", "concat" or "merge"
+        line (int): Line of the code
+        message (str): What was found
+        seconds (float): Estimated run time on the dataframes. Default to None, unknown
+    """
+
+    def __init__(self, kind: str, line: int, message: str, seconds: Optional[float] = None):
+        self.kind = kind
+        self.line = line
+        self.message = message
+        self.seconds = seconds
+
+    def __str__(self) -> str:
+        estimate = f", about {self.seconds:,.0f}s on this data" if self.seconds is not None else ""
+        return f"Line {self.line}: {self.message}{estimate}"
+
+
+class CodeAnalysis:
+    """The code to execute, with the rewrites made and the issues left"""
+
+    def __init__(self, code: str, rewrites: List[str], issues: List[CodeIssue]):
+        self.code = code
+        self.rewrites = rewrites
+        self.issues = issues
+
+
+def _names(node: ast.AST) -> set:
+    return {child.id for child in ast.walk(node) if isinstance(child, ast.Name)}
+
+
+def _column(frame: ast.expr, column: str) -> ast.expr:
+    return ast.Subscript(value=copy.deepcopy(frame), slice=ast.Constant(column), ctx=ast.Load())
+
+
+def _method(value: ast.expr, name: str, args=(), **keywords) -> ast.expr:
+    return ast.Call(
+        func=ast.Attribute(value=value, attr=name, ctx=ast.Load()),
+        args=list(args),
+        keywords=[ast.keyword(arg=key, value=ast.Constant(item)) for key, item in keywords.items()],
+    )
+
+
+def _is_scalar(node: ast.expr) -> bool:
+    """Values evaluated once instead of once per row without changing the result"""
+    if isinstance(node, (ast.Constant, ast.Name)):
+        return True
+    if isinstance(node, ast.Attribute):
+        return _is_scalar(node.value)
+    if isinstance(node, ast.UnaryOp) and isinstance(node.op, (ast.USub, ast.UAdd)):
+        return _is_scalar(node.operand)
+    if isinstance(node, (ast.List, ast.Tuple, ast.Set)):
+        return all(_is_scalar(element) for element in node.elts)
+    return False
+
+
+class _Vectorizer:
+    """
+    Turns an expression on one row or one value into the same expression on columns.
+
+    Args:
+        frame (ast.expr): The dataframe or series the expression is applied to
+        variable (str): The name of the row or value in the expression
+        rows (bool): Whether the variable is a row, accessed by column, or a value
+        bound (set): Other names that vary per row, which can't be vectorized
+        categorical (set): Names of the categorical columns
+    """
+
+    def __init__(self, frame: ast.expr, variable: str, rows: bool, bound: set = frozenset(),
+                 categorical: set = frozenset()):
+        self.frame = frame
+        self.variable = variable
+        self.rows = rows
+        self.bound = set(bound) | {variable}
+        self.categorical = categorical
+
+    def __call__(self, node: ast.expr):
+        """
+        Returns (tuple): The vectorized expression, whether it is a series and whether
+        it is a boolean series. None if the expression can't be vectorized
+        """
+        try:
+            return self._visit(node)
+        except _NotVectorizable:
+            return None
+
+    def _visit(self, node: ast.expr, categorical: bool = False):
+        """`categorical` keeps categorical columns as is, where they behave like strings"""
+        access = self._access(node)
+        if access is not None:
+            if not categorical and _column_name(access) in self.categorical:
+                access = _method(access, "astype", [ast.Constant("object")])
+            return access, True, False
+
+        if not _names(node) & self.bound:
+            if _is_scalar(node):
+                return node, False, False
+            raise _NotVectorizable
+
+        if isinstance(node, ast.BinOp) and isinstance(node.op, _ARITHMETIC):
+            left, left_vector, _ = self._visit(node.left)
+            right, right_vector, _ = self._visit(node.right)
+            return ast.BinOp(left=left, op=node.op, right=right), left_vector or right_vector, False
+
+        if isinstance(node, ast.UnaryOp):
+            operand, vector, boolean = self._visit(node.operand)
+            if isinstance(node.op, ast.Not):
+                if not boolean:
+                    raise _NotVectorizable
+                return ast.UnaryOp(op=ast.Invert(), operand=operand), True, True
+            if isinstance(node.op, (ast.USub, ast.UAdd)):
+                return ast.UnaryOp(op=node.op, operand=operand), vector, False
+            raise _NotVectorizable
+
+        if isinstance(node, ast.BoolOp):
+            # `and`/`or` return one of their operands, only boolean operands are safe
+            values = [self._visit(value) for value in node.values]
+            if not all(boolean for _, _, boolean in values):
+                raise _NotVectorizable
+            op = ast.BitAnd() if isinstance(node.op, ast.And) else ast.BitOr()
+            result = values[0][0]
+            for value, _, _ in values[1:]:
+                result = ast.BinOp(left=result, op=op, right=value)
+            return result, True, True
+
+        if isinstance(node, ast.Compare):
+            return self._compare(node)
+
+        if isinstance(node, ast.IfExp):
+            test, _, boolean = self._visit(node.test)
+            body, body_vector, _ = self._visit(node.body)
+            orelse, _, _ = self._visit(node.orelse)
+            if not boolean:
+                raise _NotVectorizable
+            if not body_vector:
+                body = ast.Call(
+                    func=ast.Attribute(value=ast.Name(id="pd", ctx=ast.Load()), attr="Series", ctx=ast.Load()),
+                    args=[body],
+                    keywords=[ast.keyword(arg="index", value=ast.Attribute(
+                        value=copy.deepcopy(self.frame), attr="index", ctx=ast.Load()))],
+                )
+            return _method(body, "where", [test, orelse]), True, False
+
+        if isinstance(node, ast.Call):
+            return self._call(node)
+
+        raise _NotVectorizable
+
+    def _access(self, node: ast.expr) -> Optional[ast.expr]:
+        """The column a row or value access stands for"""
+        if not self.rows:
+            if isinstance(node, ast.Name) and node.id == self.variable:
+                return copy.deepcopy(self.frame)
+            return None
+        if not isinstance(node, (ast.Subscript, ast.Attribute)):
+            return None
+        if not isinstance(node.value, ast.Name) or node.value.id != self.variable:
+            return None
+        if isinstance(node, ast.Subscript):
+            if isinstance(node.slice, ast.Constant) and isinstance(node.slice.value, str):
+                return _column(self.frame, node.slice.value)
+            raise _NotVectorizable
+        # `row.name`, `row.index`, ... are attributes of the row, not columns
+        if hasattr(pd.Series, node.attr):
+            raise _NotVectorizable
+        return _column(self.frame, node.attr)
+
+    def _compare(self, node: ast.Compare):
+        operands = [node.left] + node.comparators
+        results = []
+        for left_node, op, right_node in zip(operands, node.ops, operands[1:]):
+            left, left_vector, _ = self._visit(left_node, categorical=True)
+            right, right_vector, _ = self._visit(right_node, categorical=True)
+            # Categoricals are only compared for equality with a value, or tested for
+            # membership, as they are
+            if not isinstance(op, (ast.Eq, ast.NotEq, ast.In, ast.NotIn)) \
+                    or isinstance(op, (ast.Eq, ast.NotEq)) and left_vector and right_vector:
+                left, left_vector, _ = self._visit(left_node)
+                right, right_vector, _ = self._visit(right_node)
+            if isinstance(op, _COMPARISONS):
+                if isinstance(left_node, ast.Constant) and left_node.value is None \
+                        or isinstance(right_node, ast.Constant) and right_node.value is None:
+                    raise _NotVectorizable
+                result = ast.Compare(left=left, ops=[op], comparators=[right])
+            elif isinstance(op, (ast.In, ast.NotIn)) and left_vector and not right_vector \
+                    and isinstance(right_node, (ast.List, ast.Tuple, ast.Set)):
+                result = _method(left, "isin", [ast.List(elts=list(right.elts), ctx=ast.Load())])
+            elif isinstance(op, (ast.In, ast.NotIn)) and right_vector and not left_vector \
+                    and isinstance(left_node, ast.Constant) and isinstance(left_node.value, str):
+                result = _method(ast.Attribute(value=right, attr="str", ctx=ast.Load()), "contains", [left],
+                                 regex=False, na=False)
+            else:
+                raise _NotVectorizable
+            if isinstance(op, ast.NotIn):
+                result = ast.UnaryOp(op=ast.Invert(), operand=result)
+            if not (left_vector or right_vector):
+                raise _NotVectorizable
+            results.append(result)
+
+        result = results[0]
+        for other in results[1:]:
+            result = ast.BinOp(left=result, op=ast.BitAnd(), right=other)
+        return result, True, True
+
+    def _call(self, node: ast.Call):
+        if node.keywords:
+            raise _NotVectorizable
+
+        if isinstance(node.func, ast.Name) and len(node.args) == 1:
+            value, vector, _ = self._visit(node.args[0])
+            if not vector:
+                raise _NotVectorizable
+            if node.func.id == "len":
+                return _method(ast.Attribute(value=value, attr="str", ctx=ast.Load()), "len"), True, False
+            if node.func.id in CONVERSIONS:
+                method, argument = CONVERSIONS[node.func.id]
+                arguments = [ast.Name(id=argument, ctx=ast.Load())] if argument else []
+                return _method(value, method, arguments), True, False
+            raise _NotVectorizable
+
+        if isinstance(node.func, ast.Name) and node.func.id == "round" and len(node.args) == 2 \
+                and isinstance(node.args[1], ast.Constant) and isinstance(node.args[1].value, int):
+            value, vector, _ = self._visit(node.args[0])
+            if not vector:
+                raise _NotVectorizable
+            return _method(value, "round", [node.args[1]]), True, False
+
+        if not isinstance(node.func, ast.Attribute):
+            raise _NotVectorizable
+        # Only string methods are vectorized, through the .str accessor of categoricals too
+        value, vector, _ = self._visit(node.func.value, categorical=True)
+        if not vector or not all(_is_scalar(arg) and not _names(arg) & self.bound for arg in node.args):
+            raise _NotVectorizable
+        accessor = ast.Attribute(value=value, attr="str", ctx=ast.Load())
+        method = node.func.attr
+        if method in STR_METHODS:
+            return _method(accessor, method, node.args), True, False
+        if method == "replace" and len(node.args) == 2:
+            return _method(accessor, "replace", node.args, regex=False), True, False
+        if method in ("startswith", "endswith") and len(node.args) == 1 \
+                and isinstance(node.args[0], ast.Constant) and isinstance(node.args[0].value, str):
+            return _method(accessor, method, node.args, na=False), True, True
+        raise _NotVectorizable
+
+
+class _NotVectorizable(Exception):
+    pass
+
+
+def _column_name(node: ast.expr) -> Optional[str]:
+    """The column a `frame['col']` expression selects"""
+    if isinstance(node, ast.Subscript) and isinstance(node.slice, ast.Constant) and isinstance(node.slice.value, str):
+        return node.slice.value
+    return None
+
+
+def _lambda_body(node: ast.expr) -> Optional[tuple]:
+    """The parameter and body of a one-parameter lambda"""
+    if not isinstance(node, ast.Lambda):
+        return None
+    arguments = node.args
+    if len(arguments.args) != 1 or arguments.vararg or arguments.kwarg or arguments.kwonlyargs \
+            or arguments.defaults or arguments.posonlyargs:
+        return None
+    return arguments.args[0].arg, node.body
+
+
+def _is_axis_columns(call: ast.Call) -> bool:
+    return len(call.keywords) == 1 and call.keywords[0].arg == "axis" \
+        and isinstance(call.keywords[0].value, ast.Constant) and call.keywords[0].value.value in (1, "columns")
+
+
+def _is_concat(node: ast.expr) -> bool:
+    return isinstance(node, ast.Call) and isinstance(node.func, ast.Attribute) and node.func.attr == "concat" \
+        and isinstance(node.func.value, ast.Name) and node.func.value.id == "pd"
+
+
+def _is_frame(node: ast.expr, frames: set) -> bool:
+    """Whether the expression is a dataframe, given the names known to be dataframes"""
+    if isinstance(node, ast.Name):
+        return node.id in frames
+    if isinstance(node, ast.Call):
+        return isinstance(node.func, ast.Attribute) and node.func.attr in FRAME_METHODS \
+            and not any(keyword.arg == "inplace" for keyword in node.keywords) and _is_frame(node.func.value, frames)
+    if isinstance(node, ast.Subscript) and _is_frame(node.value, frames):
+        key = node.slice
+        # A boolean mask or a list of columns
+        if isinstance(key, (ast.Compare, ast.BoolOp)) \
+                or isinstance(key, ast.UnaryOp) and isinstance(key.op, ast.Invert) \
+                or isinstance(key, ast.BinOp) and isinstance(key.op, (ast.BitAnd, ast.BitOr)):
+            return True
+        return isinstance(key, ast.List) and all(isinstance(element, ast.Constant) for element in key.elts)
+    return False
+
+
+def frame_names(tree: ast.AST, inputs) -> set:
+    """
+    Find the names that are always dataframes in the code: the input dataframes and
+    the names only ever assigned from a dataframe, like `x = df[df['a'] > 1]`.
+
+    Args:
+        tree (ast.AST): The parsed code
+        inputs (Iterable[str]): Names of the dataframes the code runs on
+
+    Returns (set): The names bound to a dataframe wherever they are used
+    """
+
+    # Every value assigned to a name, None for the bindings other than `name = value`
+    # (for targets, augmented assignments, unpacking, arguments, imports, ...)
+    plain = {
+        id(target): node.value for node in ast.walk(tree) if isinstance(node, ast.Assign)
+        for target in node.targets if isinstance(target, ast.Name)
+    }
+    bindings = {}
+    for node in ast.walk(tree):
+        if isinstance(node, ast.Name) and isinstance(node.ctx, (ast.Store, ast.Del)):
+            bindings.setdefault(node.id, []).append(plain.get(id(node)))
+        elif isinstance(node, ast.arg):
+            bindings.setdefault(node.arg, []).append(None)
+        elif isinstance(node, (ast.FunctionDef, ast.AsyncFunctionDef, ast.ClassDef)):
+            bindings.setdefault(node.name, []).append(None)
+        elif isinstance(node, (ast.Import, ast.ImportFrom)):
+            for alias in node.names:
+                bindings.setdefault(alias.asname or alias.name.split(".")[0], []).append(None)
+
+    inputs = set(inputs)
+    frames = set()
+    changed = True
+    while changed:
+        changed = False
+        for name in (inputs | bindings.keys()) - frames:
+            values = bindings.get(name, [])
+            if (name in inputs or values) and all(value is not None and _is_frame(value, frames) for value in values):
+                frames.add(name)
+                changed = True
+    return frames
+
+
+class _Rewriter(ast.NodeTransformer):
+    """
+    Rewrites the row-by-row patterns that have a vectorized equivalent.
+
+    Args:
+        tree (ast.Module): The parsed code
+        frames (set): Names always bound to a dataframe, see `frame_names`. Only
+        columns of these are rewritten, `.apply` and `.map` behave differently on
+        other objects like groupbys
+        categorical (set): Names of the categorical columns of the dataframes
+    """
+
+    def __init__(self, tree: ast.Module, frames: set, categorical: set = frozenset()):
+        self.tree = tree
+        self.frames = frames
+        self.categorical = categorical
+        self.rewrites = []
+
+    def visit_Call(self, node: ast.Call):
+        self.generic_visit(node)
+        if not isinstance(node.func, ast.Attribute) or node.func.attr not in ("apply", "map") or len(node.args) != 1:
+            return node
+        function = _lambda_body(node.args[0])
+        if function is None:
+            return node
+        variable, body = function
+        target = node.func.value
+
+        # df.apply(lambda row: ..., axis=1)
+        if node.func.attr == "apply" and isinstance(target, ast.Name) and target.id in self.frames \
+                and _is_axis_columns(node):
+            vectorized = _Vectorizer(target, variable, rows=True, categorical=self.categorical)(body)
+            description = f"{target.id}.apply(..., axis=1)"
+        # df['col'].apply(lambda x: ...) and df['col'].map(lambda x: ...)
+        # Left as is on categoricals, which call the function once per category
+        elif not node.keywords and isinstance(target, ast.Subscript) and isinstance(target.value, ast.Name) \
+                and target.value.id in self.frames and _column_name(target) is not None \
+                and _column_name(target) not in self.categorical:
+            vectorized = _Vectorizer(target, variable, rows=False)(body)
+            description = f"{ast.unparse(target)}.{node.func.attr}(lambda ...)"
+        else:
+            return node
+
+        if vectorized is None or not vectorized[1]:
+            return node
+        self.rewrites.append(f"Line {node.lineno}: {description} vectorized")
+        return ast.copy_location(vectorized[0], node)
+
+    def visit_For(self, node: ast.For):
+        self.generic_visit(node)
+        rewritten = self._iterrows_sum(node)
+        if rewritten is not None:
+            return rewritten
+        return self._concat_in_loop(node)
+
+    def _used_elsewhere(self, names: set, node: ast.AST) -> bool:
+        """Whether the names are used outside of the node"""
+        inside = {id(child) for child in ast.walk(node)}
+        return any(
+            isinstance(child, ast.Name) and child.id in names and id(child) not in inside
+            for child in ast.walk(self.tree)
+        )
+
+    def _iterrows_sum(self, node: ast.For):
+        # for index, row in df.iterrows(): with a single accumulation in its body
+        if node.orelse or len(node.body) != 1:
+            return None
+        iterator = node.iter
+        if not (isinstance(iterator, ast.Call) and isinstance(iterator.func, ast.Attribute)
+                and iterator.func.attr == "iterrows" and not iterator.args and not iterator.keywords
+                and isinstance(iterator.func.value, ast.Name) and iterator.func.value.id in self.frames):
+            return None
+        if not (isinstance(node.target, ast.Tuple) and len(node.target.elts) == 2
+                and all(isinstance(element, ast.Name) for element in node.target.elts)):
+            return None
+        frame = iterator.func.value
+        index, row = (element.id for element in node.target.elts)
+        if self._used_elsewhere({index, row}, node):
+            return None
+        vectorize = _Vectorizer(frame, row, rows=True, bound={index}, categorical=self.categorical)
+
+        statement, condition = node.body[0], None
+        if isinstance(statement, ast.If) and not statement.orelse and len(statement.body) == 1:
+            condition = vectorize(statement.test)
+            if condition is None or not condition[2]:
+                return None
+            condition = condition[0]
+            statement = statement.body[0]
+
+        # total += row['col']
+        if isinstance(statement, ast.AugAssign) and isinstance(statement.op, ast.Add) \
+                and isinstance(statement.target, ast.Name) and statement.target.id not in _names(node.iter):
+            total = statement.target.id
+            if total in _names(statement.value) or condition is not None and total in _names(node.body[0].test):
+                return None
+            value = vectorize(statement.value)
+            if value is None:
+                return None
+            if value[1]:
+                values = ast.Subscript(value=value[0], slice=condition, ctx=ast.Load()) if condition else value[0]
+                amount = _method(values, "sum", skipna=False)
+            elif isinstance(statement.value, ast.Constant):
+                count = _method(condition, "sum") if condition else ast.Call(
+                    func=ast.Name(id="len", ctx=ast.Load()), args=[copy.deepcopy(frame)], keywords=[])
+                amount = ast.Call(func=ast.Name(id="int", ctx=ast.Load()), args=[count], keywords=[])
+                if statement.value.value != 1:
+                    amount = ast.BinOp(left=statement.value, op=ast.Mult(), right=amount)
+            else:
+                return None
+            self.rewrites.append(f"Line {node.lineno}: {frame.id}.iterrows() loop summing into {total} vectorized")
+            return ast.copy_location(
+                ast.AugAssign(target=ast.Name(id=total, ctx=ast.Store()), op=ast.Add(), value=amount), node)
+
+        # totals[row['key']] = totals.get(row['key'], 0) + row['col']
+        if condition is None and isinstance(statement, ast.Assign) and len(statement.targets) == 1:
+            return self._iterrows_group_sum(node, statement, frame, vectorize)
+        return None
+
+    def _iterrows_group_sum(self, node: ast.For, statement: ast.Assign, frame: ast.Name, vectorize: _Vectorizer):
+        target = statement.targets[0]
+        if not (isinstance(target, ast.Subscript) and isinstance(target.value, ast.Name)):
+            return None
+        totals = target.value.id
+        value = statement.value
+        if not (isinstance(value, ast.BinOp) and isinstance(value.op, ast.Add)):
+            return None
+        for lookup, amount in ((value.left, value.right), (value.right, value.left)):
+            if isinstance(lookup, ast.Call) and isinstance(lookup.func, ast.Attribute) \
+                    and lookup.func.attr == "get" and isinstance(lookup.func.value, ast.Name) \
+                    and lookup.func.value.id == totals and len(lookup.args) == 2 and not lookup.keywords \
+                    and isinstance(lookup.args[1], ast.Constant) and lookup.args[1].value == 0 \
+                    and ast.dump(lookup.args[0]) == ast.dump(target.slice):
+                break
+        else:
+            return None
+        if totals in _names(amount) or totals in _names(target.slice):
+            return None
+
+        key = vectorize(target.slice)
+        amount = vectorize(amount)
+        if key is None or amount is None or not key[1]:
+            return None
+
+        def grouped(values):
+            return _method(values, "groupby", [copy.deepcopy(key[0])], sort=False, dropna=False)
+
+        if amount[1]:
+            # groupby().sum() skips missing values where the loop gives NaN
+            sums = _method(grouped(amount[0]), "sum")
+            missing = _method(grouped(_method(copy.deepcopy(amount[0]), "isna")), "any")
+            sums = _method(sums, "mask", [missing])
+        elif isinstance(amount[0], ast.Constant) and amount[0].value == 1:
+            sums = _method(grouped(copy.deepcopy(key[0])), "size")
+        else:
+            return None
+
+        loop = ast.parse(
+            f"for __key, __value in __sums.items():\n"
+            f"    {totals}[__key] = {totals}.get(__key, 0) + __value"
+        ).body[0]
+        loop.iter = _method(sums, "items")
+        self.rewrites.append(f"Line {node.lineno}: {frame.id}.iterrows() loop summing into {totals} "
+                             f"replaced with groupby().sum()")
+        return ast.copy_location(loop, node)
+
+    def _concat_in_loop(self, node: ast.For):
+        # result = pd.concat([result, part]) anywhere in the body of the loop
+        statements = [
+            child for child in ast.walk(node)
+            if isinstance(child, ast.Assign) and len(child.targets) == 1 and isinstance(child.targets[0], ast.Name)
+            and _is_concat(child.value) and len(child.value.args) == 1
+            and isinstance(child.value.args[0], ast.List) and len(child.value.args[0].elts) == 2
+            and isinstance(child.value.args[0].elts[0], ast.Name)
+            and child.value.args[0].elts[0].id == child.targets[0].id
+            and all(keyword.arg == "ignore_index" for keyword in child.value.keywords)
+        ]
+        if len(statements) != 1 or node.orelse:
+            return node
+        statement = statements[0]
+        result = statement.targets[0].id
+        part = statement.value.args[0].elts[1]
+        # The loop must not read the result while it grows
+        uses = [child for child in ast.walk(node) if isinstance(child, ast.Name) and child.id == result]
+        if len(uses) != 2 or result in _names(part) or result in _names(node.iter) or result in _names(node.target):
+            return node
+
+        parts = f"__{result}_parts"
+        append = ast.Expr(value=_method(ast.Name(id=parts, ctx=ast.Load()), "append", [part]))
+        _replace_statement(node, statement, ast.copy_location(append, statement))
+        before = ast.parse(f"{parts} = [{result}]").body[0]
+        # A loop that didn't run leaves the result as it was, its index included
+        after = ast.parse(f"{result} = pd.concat({parts}) if len({parts}) > 1 else {result}").body[0]
+        after.value.body.keywords = statement.value.keywords
+        self.rewrites.append(f"Line {node.lineno}: pd.concat into {result} moved after the loop")
+        return [ast.copy_location(before, node), node, ast.copy_location(after, node)]
+
+
+def _replace_statement(tree: ast.AST, old: ast.stmt, new: ast.stmt):
+    for parent in ast.walk(tree):
+        for field in ("body", "orelse", "finalbody"):
+            statements = getattr(parent, field, None)
+            if isinstance(statements, list) and old in statements:
+                statements[statements.index(old)] = new
+                return
+
+
+class _Inspector(ast.NodeVisitor):
+    """Reports the expensive patterns left in the code with an estimate of their cost"""
+
+    def __init__(self, profiles: Dict[str, DatasetProfile]):
+        self.profiles = profiles
+        self.issues = []
+        self._loops = []
+
+    def _rows(self, node: ast.expr) -> Optional[int]:
+        """Rows of the dataframe an expression starts from, the largest one if unknown"""
+        while isinstance(node, (ast.Attribute, ast.Subscript, ast.Call)):
+            node = node.func if isinstance(node, ast.Call) else node.value
+        if isinstance(node, ast.Name) and node.id in self.profiles:
+            return self.profiles[node.id].num_rows
+        return max((profile.num_rows for profile in self.profiles.values()), default=None)
+
+    def _iterations(self, loop: ast.For) -> Optional[int]:
+        iterator = loop.iter
+        if isinstance(iterator, ast.Call) and isinstance(iterator.func, ast.Attribute) \
+                and iterator.func.attr in ("iterrows", "itertuples"):
+            return self._rows(iterator.func.value)
+        if isinstance(iterator, ast.Call) and isinstance(iterator.func, ast.Name) and iterator.func.id == "range" \
+                and all(isinstance(arg, ast.Constant) and isinstance(arg.value, int) for arg in iterator.args):
+            return len(range(*(arg.value for arg in iterator.args)))
+        return None
+
+    def _report(self, kind: str, node: ast.AST, message: str, seconds: Optional[float]):
+        self.issues.append(CodeIssue(kind, node.lineno, message, seconds))
+
+    def visit_For(self, node: ast.For):
+        iterator = node.iter
+        if isinstance(iterator, ast.Call) and isinstance(iterator.func, ast.Attribute) \
+                and iterator.func.attr in ("iterrows", "itertuples"):
+            rows = self._rows(iterator.func.value)
+            per_row = ITERROWS_SECONDS if iterator.func.attr == "iterrows" else ITERTUPLES_SECONDS
+            self._report(iterator.func.attr, node, f"loop over the rows with {iterator.func.attr}()",
+                         rows * per_row if rows is not None else None)
+        self._loops.append(node)
+        self.generic_visit(node)
+        self._loops.pop()
+
+    def visit_While(self, node: ast.While):
+        self._loops.append(node)
+        self.generic_visit(node)
+        self._loops.pop()
+
+    def visit_Call(self, node: ast.Call):
+        self.generic_visit(node)
+        if not isinstance(node.func, ast.Attribute):
+            return
+        method = node.func.attr
+
+        if method == "apply" and _is_axis_columns(node):
+            rows = self._rows(node.func.value)
+            self._report("apply", node, "apply(..., axis=1) calls python once per row",
+                         rows * APPLY_ROWS_SECONDS if rows is not None else None)
+        elif method in ("apply", "map") and node.args and isinstance(node.args[0], ast.Lambda):
+            rows = self._rows(node.func.value)
+            self._report("apply", node, f"{method}(lambda ...) calls python once per value",
+                         rows * APPLY_VALUES_SECONDS if rows is not None else None)
+        elif self._loops and self._grows(node):
+            iterations = self._iterations(self._loops[-1]) if isinstance(self._loops[-1], ast.For) else None
+            self._report("concat", node, "dataframe grown inside a loop, copied at every iteration",
+                         iterations * CONCAT_SECONDS if iterations is not None else None)
+        elif method == "merge":
+            self._merge(node)
+
+    def _grows(self, call: ast.Call) -> bool:
+        """Whether the call is `x = x.append(...)` or `x = pd.concat([x, ...])` in the current loop"""
+        for child in ast.walk(self._loops[-1]):
+            if isinstance(child, ast.Assign) and child.value is call and len(child.targets) == 1 \
+                    and isinstance(child.targets[0], ast.Name):
+                if _is_concat(call):
+                    return bool(call.args) and child.targets[0].id in _names(call.args[0])
+                return isinstance(call.func.value, ast.Name) and call.func.attr == "append" \
+                    and call.func.value.id == child.targets[0].id
+        return False
+
+    def _merge(self, node: ast.Call):
+        # pd.merge(left, right, ...) or left.merge(right, ...)
+        if isinstance(node.func.value, ast.Name) and node.func.value.id == "pd":
+            frames = node.args[:2]
+        else:
+            frames = [node.func.value] + node.args[:1]
+        if len(frames) != 2:
+            return
+        keywords = {keyword.arg: keyword.value for keyword in node.keywords}
+        left, right = (frame.id if isinstance(frame, ast.Name) else None for frame in frames)
+        left_profile, right_profile = self.profiles.get(left), self.profiles.get(right)
+
+        how = keywords.get("how")
+        if isinstance(how, ast.Constant) and how.value == "cross":
+            rows = left_profile.num_rows * right_profile.num_rows if left_profile and right_profile else None
+            self._report("merge", node, "cross merge, every row paired with every row",
+                         rows * MERGE_SECONDS if rows is not None else None)
+            return
+
+        if not (left_profile and right_profile):
+            return
+        on = keywords.get("on")
+        left_on, right_on = keywords.get("left_on", on), keywords.get("right_on", on)
+        if not all(isinstance(key, ast.Constant) and isinstance(key.value, str) for key in (left_on, right_on)):
+            return
+        left_distinct = _distinct(left_profile, left_on.value)
+        right_distinct = _distinct(right_profile, right_on.value)
+        if not left_distinct or not right_distinct:
+            return
+        # Assuming uniformly distributed keys
+        rows = left_profile.num_rows * right_profile.num_rows // max(left_distinct, right_distinct)
+        if rows > MERGE_GROWTH * max(left_profile.num_rows, right_profile.num_rows):
+            self._report("merge", node, f"many-to-many merge, about {rows:,} rows", rows * MERGE_SECONDS)
+
+
+def _distinct(profile: DatasetProfile, column: str) -> Optional[int]:
+    """Distinct values of the column, from the sample of the profile"""
+    if profile.cardinalities is None or column not in profile.cardinalities.index:
+        return None
+    distinct = int(profile.cardinalities[column])
+    # A column distinct in most of the sample is taken as a key of the dataframe
+    sample = min(profile.num_rows, 100_000)
+    return profile.num_rows if distinct * 2 > sample else distinct
+
+
+def analyze_code(
+    code: str,
+    profiles: Optional[Dict[str, DatasetProfile]] = None,
+    rewrite: bool = True,
+    min_seconds: float = 1.0,
+) -> CodeAnalysis:
+    """
+    Rewrite the row-by-row patterns of the code that have a vectorized equivalent and
+    report the expensive ones left.
+
+    Args:
+        code (str): A python code
+        profiles (dict): Mapping of environment name (`df`, `df1`, ...) to the profile
+        of the dataframe, the costs are estimated from. Only the columns of these
+        dataframes, and of names assigned from them, are rewritten, taking their
+        categorical columns into account. Default to None
+        rewrite (bool): Rewrite the patterns, otherwise only report them. Default to True
+        min_seconds (float): Estimated run time under which an issue isn't reported.
+        Issues whose cost is unknown are always reported. Default to 1
+
+    Returns (CodeAnalysis): The code to execute, the rewrites made and the issues left
+    """
+
+    try:
+        tree = ast.parse(code)
+    except SyntaxError:
+        return CodeAnalysis(code, [], [])
+
+    rewrites = []
+    if rewrite:
+        categorical = {
+            column for profile in (profiles or {}).values() for column, dtype in profile.dtypes.items()
+            if isinstance(dtype, pd.CategoricalDtype) or str(dtype) == "category"
+        }
+        rewriter = _Rewriter(tree, frame_names(tree, (profiles or {}).keys()), categorical)
+        tree = ast.fix_missing_locations(rewriter.visit(tree))
+        rewrites = rewriter.rewrites
+        if rewrites:
+            code = ast.unparse(tree)
+
+    inspector = _Inspector(profiles or {})
+    inspector.visit(tree)
+    issues = [issue for issue in inspector.issues if issue.seconds is None or issue.seconds >= min_seconds]
+    return CodeAnalysis(code, rewrites, issues)
@@ -0,0 +1,161 @@
+"""
+This module contains the process-wide registry of the uploaded datasets.
+
+Every session used to hold its own copy of the dataframes it uploaded, so the same
+weekly export opened by the whole team was in memory once per session. The registry
+keeps one `Dataset` per upload content, with everything computed from it once: the
+dataframe, its profile and its ingestion report. Sessions only keep lightweight
+`DatasetHandle`s. A dataset is referenced as long as a handle to it is alive. Datasets
+no session references anymore stay loaded for the next upload of the same file, and
+are evicted least recently used first when the registry goes over its memory limit.
+
+Every dataset records how long parsing its upload took, and the registry counts the
+parsing time saved by datasets reused or memory-mapped from the store.
+"""
+import threading
+import weakref
+from collections import OrderedDict
+from typing import Callable, Optional
+
+import pandas as pd
+
+from .ingestion import IngestionReport
+from .profile import DatasetProfile
+
+
+class Dataset:
+    """
+    An uploaded dataset and everything computed from it once.
+
+    Args:
+        key (str): The content key of the upload
+        dataframe (pd.DataFrame): The parsed dataframe
+        profile (DatasetProfile): The profile the prompts are rendered from
+        report (IngestionReport): The ingestion report, None if there is none
+        parse_seconds (float): Time parsing the upload took, even if it was parsed by
+        an earlier load. Default to 0
+        load_seconds (float): Time getting the dataframe took this time, parsing it or
+        reading it from the store. Default to `parse_seconds`
+    """
+
+    def __init__(
+        self,
+        key: str,
+        dataframe: pd.DataFrame,
+        profile: Optional[DatasetProfile] = None,
+        report: Optional[IngestionReport] = None,
+        parse_seconds: float = 0.0,
+        load_seconds: Optional[float] = None,
+    ):
+        self.key = key
+        self.dataframe = dataframe
+        self.profile = profile
+        self.report = report
+        self.parse_seconds = parse_seconds
+        self.load_seconds = parse_seconds if load_seconds is None else load_seconds
+        self.nbytes = int(dataframe.memory_usage(deep=True).sum())
+
+
+class DatasetHandle:
+    """A session's reference to a dataset of the registry, released when it is collected"""
+
+    def __init__(self, registry: "DatasetRegistry", key: str):
+        self.key = key
+        self._registry = registry
+        weakref.finalize(self, registry._release, key)
+
+    @property
+    def dataset(self) -> Dataset:
+        return self._registry._get(self.key)
+
+
+class DatasetRegistry:
+    """
+    Datasets shared by every session of the server.
+
+    Args:
+        memory_limit_mb (int): Memory the datasets may use, in MB, before the ones no
+        session references are evicted. Datasets in use are never evicted. Default to
+        None for no limit
+    """
+
+    def __init__(self, memory_limit_mb: Optional[int] = None):
+        self._memory_limit = memory_limit_mb * 1024 ** 2 if memory_limit_mb else None
+        self._datasets = OrderedDict()
+        self._references = {}
+        self._loading = {}
+        self._lock = threading.Lock()
+        self.loads = 0
+        self.reuses = 0
+        self.evictions = 0
+        # Parsing time the reuses and the loads from the store didn't spend
+        self.seconds_saved = 0.0
+
+    def acquire(self, key: str, load: Callable[[], Dataset]) -> DatasetHandle:
+        """
+        Get a handle to a dataset, loading it if no session has it loaded.
+
+        Args:
+            key (str): The content key of the upload
+            load (Callable[[], Dataset]): Loads the dataset. Called at most once at a
+            time per key, concurrent uploads of the same file wait for it
+
+        Returns (DatasetHandle): A handle keeping the dataset loaded while it is alive
+        """
+
+        with self._lock:
+            loading = self._loading.setdefault(key, threading.Lock())
+
+        with loading:
+            with self._lock:
+                loaded = key in self._datasets
+            dataset = None if loaded else load()
+
+            with self._lock:
+                if dataset is not None:
+                    self._datasets[key] = dataset
+                    self.loads += 1
+                    self.seconds_saved += max(dataset.parse_seconds - dataset.load_seconds, 0.0)
+                else:
+                    self.reuses += 1
+                    self.seconds_saved += self._datasets[key].parse_seconds
+                self._datasets.move_to_end(key)
+                self._references[key] = self._references.get(key, 0) + 1
+                self._loading.pop(key, None)
+                self._evict()
+
+        return DatasetHandle(self, key)
+
+    def _get(self, key: str) -> Dataset:
+        with self._lock:
+            self._datasets.move_to_end(key)
+            return self._datasets[key]
+
+    def _release(self, key: str):
+        with self._lock:
+            self._references[key] -= 1
+            if not self._references[key]:
+                del self._references[key]
+            self._evict()
+
+    def _evict(self):
+        if self._memory_limit is None:
+            return
+        for key in list(self._datasets):
+            if self.nbytes <= self._memory_limit:
+                return
+            if key not in self._references:
+                del self._datasets[key]
+                self.evictions += 1
+
+    @property
+    def nbytes(self) -> int:
+        return sum(dataset.nbytes for dataset in self._datasets.values())
+
+    def __len__(self) -> int:
+        return len(self._datasets)
+
+    @property
+    def in_use(self) -> int:
+        """Number of datasets at least one session references"""
+        return len(self._references)
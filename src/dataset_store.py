@@ -0,0 +1,255 @@
+"""
+This module contains the content-addressed store of the uploaded dataframes.
+
+Each uploaded file is parsed once and its dataframe persisted as an Arrow IPC file,
+named after a hash of the uploaded bytes and of the parsing options. Every later load,
+from another session, from the worker processes or after a server restart, memory-maps
+that file instead of parsing the upload again. Columns without missing values and the
+Arrow-backed columns are used straight from the map, so the processes and sessions
+working on the same file share its pages in the page cache instead of each holding a
+private copy. Past a size limit, the files no dataframe is loaded from anymore are
+removed, least recently used first.
+"""
+import hashlib
+import json
+import os
+import tempfile
+import threading
+import uuid
+import weakref
+from typing import Optional, Tuple
+
+import pandas as pd
+import pyarrow as pa
+
+
+# Bytes hashed at a time, hashlib releases the GIL while it hashes them
+HASH_CHUNK_SIZE = 8 * 1024 ** 2
+
+DATASET_EXTENSIONS = (".arrow", ".pickle")
+
+
+def content_key(data, **options) -> str:
+    """
+    Key of a dataset in the store.
+
+    Args:
+        data (bytes | file-like): The uploaded file, as bytes or as a binary file
+        object hashed chunk by chunk from its start, without reading it whole
+        **options: The parsing options, which change the resulting dataframe
+
+    Returns (str): A hex digest of the file and the options
+    """
+
+    digest = hashlib.sha256()
+    if isinstance(data, (bytes, bytearray, memoryview)):
+        view = memoryview(data)
+        for start in range(0, len(view), HASH_CHUNK_SIZE):
+            digest.update(view[start:start + HASH_CHUNK_SIZE])
+    else:
+        position = data.tell()
+        data.seek(0)
+        for chunk in iter(lambda: data.read(HASH_CHUNK_SIZE), b""):
+            digest.update(chunk)
+        data.seek(position)
+    digest.update(json.dumps(options, sort_keys=True, default=str).encode("utf-8"))
+    return digest.hexdigest()
+
+
+def _json_default(value):
+    # numpy scalars are written as the python numbers they hold
+    return value.item() if hasattr(value, "item") else str(value)
+
+
+def write_dataframe(dataframe: pd.DataFrame, path: str) -> str:
+    """
+    Write the dataframe as an Arrow IPC file, atomically.
+
+    Object columns mixing types and duplicate column names have no Arrow equivalent,
+    these dataframes are pickled instead.
+
+    Args:
+        dataframe (pd.DataFrame): The dataframe to write
+        path (str): The path to write to, without extension
+
+    Returns (str): The path written, ending in .arrow or .pickle
+    """
+
+    temporary = f"{path}.{uuid.uuid4().hex}.tmp"
+    try:
+        table = pa.Table.from_pandas(dataframe, preserve_index=True)
+    except (ValueError, TypeError, NotImplementedError):
+        dataframe.to_pickle(temporary)
+        os.replace(temporary, path + ".pickle")
+        return path + ".pickle"
+
+    with pa.OSFile(temporary, "wb") as sink, pa.ipc.new_file(sink, table.schema) as writer:
+        writer.write_table(table)
+    os.replace(temporary, path + ".arrow")
+    return path + ".arrow"
+
+
+def read_dataframe(path: str) -> pd.DataFrame:
+    """
+    Read a dataframe written by `write_dataframe`.
+
+    Arrow files are memory-mapped. Columns without missing values are not copied out
+    of the map and are read-only, the sandbox copies the dataframes the code writes to.
+    """
+
+    if path.endswith(".pickle"):
+        return pd.read_pickle(path)
+    table = pa.ipc.open_file(pa.memory_map(path)).read_all()
+    return table.to_pandas(split_blocks=True)
+
+
+class DatasetStore:
+    """
+    Dataframes persisted as memory-mapped files, shared by sessions and processes.
+
+    Args:
+        directory (str): Directory of the files. Created if it does not exist
+        size_limit_mb (int): Size the dataset files may take, in MB, before the least
+        recently used ones no dataframe is loaded from are removed. Default to None for
+        no limit
+    """
+
+    def __init__(self, directory: str, size_limit_mb: Optional[int] = None):
+        self._directory = directory
+        os.makedirs(directory, exist_ok=True)
+        self._size_limit = size_limit_mb * 1024 ** 2 if size_limit_mb else None
+        self.evictions = 0
+        self._temporary_directory = None
+        # id of every dataframe handed out or written -> (weak reference, file)
+        self._files = {}
+        self._lock = threading.Lock()
+
+    def get(self, key: str) -> Optional[Tuple[pd.DataFrame, dict]]:
+        """
+        Load a dataset from the store.
+
+        Args:
+            key (str): The key from `content_key`
+
+        Returns (tuple): The dataframe and the metadata stored with it, None if the
+        dataset is not in the store
+        """
+
+        base = os.path.join(self._directory, key)
+        for path in (base + extension for extension in DATASET_EXTENSIONS):
+            if os.path.exists(path):
+                break
+        else:
+            return None
+
+        # The modification time orders the files for the eviction, across restarts
+        try:
+            os.utime(path)
+        except OSError:
+            pass
+
+        metadata = {}
+        if os.path.exists(base + ".json"):
+            with open(base + ".json", encoding="utf-8") as file:
+                metadata = json.load(file)
+
+        dataframe = read_dataframe(path)
+        self._register(dataframe, path)
+        return dataframe, metadata
+
+    def put(self, key: str, dataframe: pd.DataFrame, metadata: Optional[dict] = None) -> pd.DataFrame:
+        """
+        Persist a dataset and load it back from the store.
+
+        Args:
+            key (str): The key from `content_key`
+            dataframe (pd.DataFrame): The parsed dataframe
+            metadata (dict): JSON-serializable data to keep with the dataframe.
+            Default to None
+
+        Returns (pd.DataFrame): The dataframe backed by the stored file, to use
+        instead of the parsed one
+        """
+
+        base = os.path.join(self._directory, key)
+        # The metadata goes first, a dataset file is only there once it is complete
+        temporary = f"{base}.{uuid.uuid4().hex}.tmp"
+        with open(temporary, "w", encoding="utf-8") as file:
+            json.dump(metadata or {}, file, default=_json_default)
+        os.replace(temporary, base + ".json")
+        write_dataframe(dataframe, base)
+
+        dataframe = self.get(key)[0]
+        self._evict()
+        return dataframe
+
+    def path(self, dataframe: pd.DataFrame) -> str:
+        """
+        The file a dataframe can be read back from. Dataframes that don't come from the
+        store are written to a temporary file, removed with the dataframe.
+
+        Args:
+            dataframe (pd.DataFrame): A dataframe
+
+        Returns (str): A path for `read_dataframe`
+        """
+
+        key = id(dataframe)
+        with self._lock:
+            entry = self._files.get(key)
+            if entry is not None and entry[0]() is dataframe:
+                return entry[1]
+
+            if self._temporary_directory is None:
+                self._temporary_directory = tempfile.mkdtemp(prefix="datasets_")
+            path = write_dataframe(dataframe, os.path.join(self._temporary_directory, uuid.uuid4().hex))
+            self._files[key] = (weakref.ref(dataframe), path)
+            weakref.finalize(dataframe, self._forget, key, path, True)
+            return path
+
+    def _evict(self):
+        """Remove the least recently used dataset files past the size limit"""
+        if self._size_limit is None:
+            return
+
+        files = []
+        with os.scandir(self._directory) as entries:
+            for entry in entries:
+                if entry.name.endswith(DATASET_EXTENSIONS):
+                    try:
+                        stat = entry.stat()
+                    except OSError:
+                        continue
+                    files.append((stat.st_mtime, stat.st_size, entry.path))
+
+        size = sum(file_size for _, file_size, _ in files)
+        with self._lock:
+            in_use = {path for reference, path in self._files.values() if reference() is not None}
+        for _, file_size, path in sorted(files):
+            if size <= self._size_limit:
+                return
+            if path in in_use:
+                continue
+            for remove in (path, os.path.splitext(path)[0] + ".json"):
+                try:
+                    os.remove(remove)
+                except OSError:
+                    pass
+            size -= file_size
+            self.evictions += 1
+
+    def _register(self, dataframe: pd.DataFrame, path: str):
+        key = id(dataframe)
+        with self._lock:
+            self._files[key] = (weakref.ref(dataframe), path)
+        weakref.finalize(dataframe, self._forget, key, path, False)
+
+    def _forget(self, key: int, path: str, remove: bool):
+        with self._lock:
+            if self._files.get(key, (None, None))[1] == path:
+                del self._files[key]
+        if remove:
+            try:
+                os.remove(path)
+            except OSError:
+                pass
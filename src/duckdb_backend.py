@@ -0,0 +1,135 @@
+"""
+This module contains the DuckDB execution backend.
+
+Aggregations and filters asked about large uploads run much faster as a single SQL
+query in DuckDB than as pandas code. The uploaded dataframes are registered as DuckDB
+views without copying them, or spilled once to Parquet files that DuckDB scans
+directly. Questions that cannot be answered with one query (charts, multi-step
+analysis) are left to the pandas path.
+"""
+import hashlib
+import os
+import re
+import threading
+from typing import Optional
+
+import duckdb
+import pandas as pd
+import pyarrow.dataset as ds
+from pandasai.constants import END_CODE_TAG, START_CODE_TAG
+
+from .prompts import NO_SQL_MARKER
+
+
+# String literals, quoted identifiers and comments, where a `;` doesn't end the statement
+SQL_LITERAL_PATTERN = re.compile(r"'(?:[^']|'')*'|\"(?:[^\"]|\"\")*\"|--[^\n]*|/\*.*?\*/", re.DOTALL)
+
+# Questions asking for a visualization always go to the pandas path
+CHART_PATTERN = re.compile(r"\b(plot|chart|graph|visuali[sz]\w*|histogram|draw|diagram)\b", re.IGNORECASE)
+
+
+class SQLNotSuitableError(Exception):
+    """Raised when the question cannot be answered with a single SQL query"""
+
+
+def wants_chart(prompt: str) -> bool:
+    return CHART_PATTERN.search(prompt) is not None
+
+
+def extract_sql(response: str) -> str:
+    """
+    Extract the SQL query from the LLM response.
+
+    Raises:
+        SQLNotSuitableError: If the LLM declined to write SQL or no query was found
+
+    Returns (str): The SQL query
+    """
+
+    if NO_SQL_MARKER in response:
+        raise SQLNotSuitableError("The LLM considers the question unsuitable for SQL")
+
+    match = re.search(
+        rf"{START_CODE_TAG}(.*?)({END_CODE_TAG}|{END_CODE_TAG.replace('<', '</')})",
+        response,
+        re.DOTALL,
+    )
+    sql = match.group(1) if match else response
+    if "```" in sql:
+        sql = sql.split("```")[1]
+    sql = re.sub(r"^\s*sql\b", "", sql.strip(), flags=re.IGNORECASE).strip().rstrip(";")
+
+    if not re.match(r"^(select|with)\b", sql, re.IGNORECASE):
+        raise SQLNotSuitableError("No SQL query found in the response")
+    check_single_statement(sql)
+    return sql
+
+
+def check_single_statement(sql: str) -> None:
+    """
+    Raises:
+        SQLNotSuitableError: If the SQL has more than one statement
+    """
+    if ";" in SQL_LITERAL_PATTERN.sub("", sql).rstrip().rstrip(";"):
+        raise SQLNotSuitableError("The SQL has more than one statement")
+
+
+class DuckDBBackend:
+    """
+    Run SQL queries over the uploaded dataframes.
+
+    The queries are written by the LLM, so the connection can't access files or the
+    network (no `read_csv`, `COPY ... TO`, `ATTACH`, ...) and its configuration is locked.
+    The dataframes, and the Parquet files they are spilled to, are registered from python.
+
+    Args:
+        spill_dir (str): If set, dataframes are written once to Parquet files in this
+        directory and queried from there instead of from memory. Default to None
+    """
+
+    def __init__(self, spill_dir: Optional[str] = None):
+        self.spill_dir = spill_dir
+        self._conn = duckdb.connect(config={"enable_external_access": False})
+        self._conn.execute("SET lock_configuration = true")
+        self._lock = threading.Lock()
+        self._registered = {}
+
+    def _spill(self, dataframe: pd.DataFrame) -> str:
+        digest = hashlib.sha256(pd.util.hash_pandas_object(dataframe, index=False).values.tobytes())
+        digest.update(repr(list(dataframe.columns)).encode())
+        path = os.path.join(self.spill_dir, f"{digest.hexdigest()}.parquet")
+        if not os.path.exists(path):
+            os.makedirs(self.spill_dir, exist_ok=True)
+            dataframe.to_parquet(path, index=False)
+        return path
+
+    def register(self, dataframes: dict) -> None:
+        """
+        Make the dataframes available to SQL queries under their environment names.
+
+        Args:
+            dataframes (dict): Mapping of table name (`df`, `df1`, ...) to dataframe
+        """
+
+        with self._lock:
+            for name, dataframe in dataframes.items():
+                self._register(name, dataframe)
+
+    def _register(self, name: str, dataframe: pd.DataFrame) -> None:
+        # Registration is keyed on identity so reruns don't spill or register twice
+        if self._registered.get(name) is dataframe:
+            return
+
+        if self.spill_dir:
+            # Scanned by Arrow, DuckDB itself isn't allowed to read files
+            self._conn.register(name, ds.dataset(self._spill(dataframe), format="parquet"))
+        else:
+            self._conn.register(name, dataframe)
+        self._registered[name] = dataframe
+
+    def query(self, sql: str) -> pd.DataFrame:
+        """Run the query and return its result as a dataframe"""
+        # Queries can come from the code cache as well as from `extract_sql`
+        check_single_statement(sql)
+        with self._lock:
+            return self._conn.execute(sql).df()
@@ -0,0 +1,208 @@
+"""
+This module contains the single-pass executor for the python code generated by the LLM.
+
+The code is executed exactly once. Everything the UI needs to render the answer
+(standard output, the value of the last expression, the charts and the resulting
+environment) is captured during that one run, so nothing has to be re-executed
+when the answer is displayed.
+
+Only the dataframes and series the code created or modified are kept from its
+environment, see `track_frames`. The modules, the builtins, the dataframes it was given
+and every other variable are released with the environment once it ran.
+"""
+import ast
+import contextlib
+import io
+import sys
+import threading
+from typing import Dict, Iterable, List
+
+import pandas as pd
+
+
+CAPTURE_CHARTS_NAME = "__capture_charts__"
+
+# stdout and the matplotlib figures are process-wide, executions in the same process
+# can't overlap
+_EXECUTION_LOCK = threading.Lock()
+
+
+class TrackedFrame:
+    """Shape and memory size of a dataframe or series the code created or modified"""
+
+    def __init__(self, name: str, value):
+        self.name = name
+        self.shape = value.shape
+        usage = value.memory_usage(deep=True)
+        self.nbytes = int(usage.sum() if isinstance(value, pd.DataFrame) else usage)
+        self.is_dataframe = isinstance(value, pd.DataFrame)
+
+
+class ExecutionResult:
+    """Everything captured from a single execution of generated code"""
+
+    def __init__(self, code: str, output: str = "", result=None, has_result: bool = False,
+                 printed_result: bool = False, figures: list = None, environment: dict = None,
+                 language: str = "python"):
+        self.code = code
+        self.language = language
+        self.output = output
+        self.result = result
+        self.has_result = has_result
+        self.printed_result = printed_result
+        self.figures = figures if figures is not None else []
+        self.environment = environment if environment is not None else {}
+        self._frames = None
+
+    @property
+    def frames(self) -> List[TrackedFrame]:
+        """The dataframes and series of the environment, measured the first time"""
+        if self._frames is None:
+            self._frames = [
+                TrackedFrame(name, value)
+                for name, value in self.environment.items()
+                if isinstance(value, (pd.DataFrame, pd.Series))
+            ]
+        return self._frames
+
+    @property
+    def has_chart(self) -> bool:
+        return len(self.figures) > 0
+
+    @property
+    def display_result(self) -> str:
+        """
+        String representation of the last expression, as it would have been printed.
+        Empty if the last line already printed it or there is no last expression.
+        """
+        if not self.has_result or self.printed_result or self.result is None:
+            return ""
+        return str(self.result).strip()
+
+
+class _RedirectCharts(ast.NodeTransformer):
+    """Replace every `plt.show()` call with a call that captures the open figures"""
+
+    def visit_Call(self, node):
+        self.generic_visit(node)
+        if (
+            isinstance(node.func, ast.Attribute)
+            and node.func.attr == "show"
+            and isinstance(node.func.value, ast.Name)
+            and node.func.value.id == "plt"
+        ):
+            return ast.copy_location(
+                ast.Call(func=ast.Name(id=CAPTURE_CHARTS_NAME, ctx=ast.Load()), args=[], keywords=[]),
+                node,
+            )
+        return node
+
+
+def track_frames(environment: dict, inputs: Dict[str, pd.DataFrame], mutated: Iterable[str] = ()) -> dict:
+    """
+    Keep the dataframes and series the code created or modified from its environment.
+
+    Args:
+        environment (dict): The globals the code was executed with
+        inputs (dict): Mapping of environment name to the dataframe the code was given
+        mutated (Iterable[str]): Names of the given dataframes the code may modify in
+        place, see `src.sandbox.find_mutated_dataframes`
+
+    Returns (dict): Mapping of variable name to dataframe or series
+    """
+
+    mutated = set(mutated)
+    return {
+        name: value
+        for name, value in environment.items()
+        if isinstance(value, (pd.DataFrame, pd.Series))
+        and not name.startswith("__")
+        and not (name in inputs and value is inputs[name] and name not in mutated)
+    }
+
+
+def _is_print_call(node: ast.AST) -> bool:
+    return (
+        isinstance(node, ast.Call)
+        and isinstance(node.func, ast.Name)
+        and node.func.id == "print"
+        and not node.keywords
+        and not any(isinstance(arg, ast.Starred) for arg in node.args)
+    )
+
+
+def _collect_figures(figures: list):
+    """Move all open matplotlib figures into `figures` and close them"""
+    pyplot = sys.modules.get("matplotlib.pyplot")
+    if pyplot is None:
+        return
+
+    for num in pyplot.get_fignums():
+        figure = pyplot.figure(num)
+        if figure not in figures:
+            figures.append(figure)
+    pyplot.close("all")
+
+
+def execute(code: str, environment: dict) -> ExecutionResult:
+    """
+    Execute the code once in the given environment and capture its output.
+
+    The last statement, if it is an expression, is evaluated separately so its value is
+    available without evaluating it a second time. A trailing `print(...)` is handled
+    the same way: its arguments are evaluated once, then printed. Executions from
+    several threads run one at a time, the worker pool runs them in parallel.
+
+    Args:
+        code (str): A python code to execute
+        environment (dict): Globals to execute the code with. Modified in place.
+
+    Returns (ExecutionResult): The captured output, last value, figures and environment
+    """
+
+    tree = ast.parse(code)
+    tree = ast.fix_missing_locations(_RedirectCharts().visit(tree))
+
+    last_expr = None
+    if tree.body and isinstance(tree.body[-1], ast.Expr):
+        last_expr = tree.body.pop().value
+
+    figures = []
+    environment[CAPTURE_CHARTS_NAME] = lambda: _collect_figures(figures)
+
+    output = io.StringIO()
+    result = None
+    has_result = False
+    printed_result = False
+
+    with _EXECUTION_LOCK:
+        try:
+            with contextlib.redirect_stdout(output):
+                exec(compile(tree, "<generated>", "exec"), environment)
+
+                if last_expr is not None:
+                    if _is_print_call(last_expr):
+                        arguments = ast.Tuple(elts=last_expr.args, ctx=ast.Load())
+                        arguments = ast.fix_missing_locations(ast.copy_location(arguments, last_expr))
+                        values = eval(compile(ast.Expression(arguments), "<generated>", "eval"), environment)
+                        print(*values)
+                        result = values[0] if len(values) == 1 else values
+                        has_result = len(values) > 0
+                        printed_result = True
+                    else:
+                        result = eval(compile(ast.Expression(last_expr), "<generated>", "eval"), environment)
+                        has_result = True
+        finally:
+            # Charts that were drawn but never shown are still part of the answer
+            _collect_figures(figures)
+            environment.pop(CAPTURE_CHARTS_NAME, None)
+
+    return ExecutionResult(
+        code=code,
+        output=output.getvalue().strip(),
+        result=result,
+        has_result=has_result,
+        printed_result=printed_result,
+        figures=figures,
+        environment=environment,
+    )
@@ -0,0 +1,148 @@
+"""
+This module contains the export of result dataframes for download.
+
+Building the CSV of a result as one string, then as bytes, kept several copies of a
+large result in memory before the download even started. Exports are written to a
+file instead, a chunk of rows at a time, as CSV, gzip-compressed CSV or Parquet, and
+only the file is handed to the download. An export is written once per dataframe and
+format, and removed with the dataframe.
+"""
+import gzip
+import os
+import tempfile
+import threading
+import uuid
+import weakref
+from typing import Optional
+
+import pandas as pd
+
+# Format -> (file extension, mimetype)
+EXPORT_FORMATS = {
+    "csv": (".csv", "text/csv"),
+    "csv.gz": (".csv.gz", "application/gzip"),
+    "parquet": (".parquet", "application/vnd.apache.parquet"),
+}
+
+
+def write_csv(dataframe: pd.DataFrame, path: str, compress: bool = False, chunk_rows: int = 100_000) -> None:
+    """Write the dataframe as CSV without its index, `chunk_rows` rows at a time"""
+    # Level 6 like the gzip command, the default 9 is several times slower for a few % smaller
+    file = gzip.open(path, "wt", compresslevel=6, encoding="utf-8", newline="") if compress \
+        else open(path, "w", encoding="utf-8", newline="")
+    with file:
+        if dataframe.empty:
+            dataframe.to_csv(file, index=False)
+        for start in range(0, len(dataframe), chunk_rows):
+            dataframe.iloc[start:start + chunk_rows].to_csv(file, index=False, header=start == 0)
+
+
+def write_parquet(dataframe: pd.DataFrame, path: str, chunk_rows: int = 100_000) -> None:
+    """Write the dataframe as Parquet without its index, one row group per chunk of rows"""
+    import pyarrow as pa
+    import pyarrow.parquet as pq
+
+    # The types of object columns are inferred from the first chunk, the others are cast to them
+    schema = pa.Table.from_pandas(dataframe.iloc[:chunk_rows], preserve_index=False).schema
+    with pq.ParquetWriter(path, schema) as writer:
+        for start in range(0, max(len(dataframe), 1), chunk_rows):
+            chunk = dataframe.iloc[start:start + chunk_rows]
+            writer.write_table(pa.Table.from_pandas(chunk, schema=schema, preserve_index=False))
+
+
+def write_export(dataframe: pd.DataFrame, path: str, format: str, chunk_rows: int = 100_000) -> None:
+    """
+    Write the dataframe to a file in one of `EXPORT_FORMATS`.
+
+    Args:
+        dataframe (pd.DataFrame): The dataframe to export
+        path (str): The file to write
+        format (str): "csv", "csv.gz" or "parquet"
+        chunk_rows (int): Number of rows converted at a time. Default to 100 000
+
+    Raises:
+        ValueError: If the format is unknown, or the dataframe has no Parquet equivalent
+    """
+
+    if format == "csv":
+        write_csv(dataframe, path, chunk_rows=chunk_rows)
+    elif format == "csv.gz":
+        write_csv(dataframe, path, compress=True, chunk_rows=chunk_rows)
+    elif format == "parquet":
+        import pyarrow as pa
+
+        try:
+            write_parquet(dataframe, path, chunk_rows=chunk_rows)
+        except (pa.ArrowInvalid, pa.ArrowNotImplementedError, pa.ArrowTypeError) as e:
+            raise ValueError(f"This dataframe can't be exported as Parquet: {e}") from e
+    else:
+        raise ValueError(f"Unknown export format {format!r}, expected one of {tuple(EXPORT_FORMATS)}")
+
+
+class Exports:
+    """
+    Export files of the dataframes, written once per dataframe and format.
+
+    Args:
+        directory (str): Directory of the files. Default to None, a temporary directory
+        chunk_rows (int): Number of rows converted at a time. Default to 100 000
+    """
+
+    def __init__(self, directory: Optional[str] = None, chunk_rows: int = 100_000):
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        self._directory = directory
+        self._chunk_rows = chunk_rows
+        # (id of the dataframe, format) -> (weak reference, file)
+        self._files = {}
+        self._lock = threading.Lock()
+
+    def get(self, dataframe: pd.DataFrame, format: str) -> Optional[str]:
+        """The export file of the dataframe in the format, None if it wasn't written"""
+        with self._lock:
+            entry = self._files.get((id(dataframe), format))
+            if entry is not None and entry[0]() is dataframe:
+                return entry[1]
+        return None
+
+    def path(self, dataframe: pd.DataFrame, format: str) -> str:
+        """
+        The export file of the dataframe in the format, written if it wasn't already.
+        The file is removed with the dataframe.
+
+        Args:
+            dataframe (pd.DataFrame): A dataframe
+            format (str): One of `EXPORT_FORMATS`
+
+        Returns (str): The path of the file
+        """
+
+        path = self.get(dataframe, format)
+        if path is not None:
+            return path
+
+        if self._directory is None:
+            self._directory = tempfile.mkdtemp(prefix="exports_")
+        path = os.path.join(self._directory, uuid.uuid4().hex + EXPORT_FORMATS[format][0])
+        temporary = f"{path}.tmp"
+        try:
+            write_export(dataframe, temporary, format, chunk_rows=self._chunk_rows)
+            os.replace(temporary, path)
+        finally:
+            if os.path.exists(temporary):
+                os.remove(temporary)
+
+        key = (id(dataframe), format)
+        with self._lock:
+            self._files[key] = (weakref.ref(dataframe), path)
+        weakref.finalize(dataframe, self._forget, key, path)
+        return path
+
+    def _forget(self, key: tuple, path: str):
+        with self._lock:
+            if self._files.get(key, (None, None))[1] == path:
+                del self._files[key]
+        try:
+            os.remove(path)
+        except OSError:
+            pass
@@ -0,0 +1,410 @@
+"""
+This module contains the ingestion stage for uploaded files.
+
+Two engines are available. With the pandas engine, CSV files are read in chunks. The first chunk is used as a sample to infer compact
+dtypes (categoricals for low-cardinality strings, nullable integers for integral
+columns with missing values) and every chunk is converted as soon as it is
+read, so the full file never sits in memory with the default object/int64/float64
+dtypes. The pyarrow engine parses the file with the multithreaded Arrow reader and
+keeps the columns Arrow-backed, or converts them to numpy without copying where the
+layout allows it. With both engines a memory budget stops the ingestion early instead
+of exhausting the server.
+
+Integer columns are kept as int64. The generated code runs on these dataframes, and
+arithmetic on narrower integers wraps around silently: a year stored as int16 times
+100 is a wrong number, not an error. Categoricals don't support everything strings
+do (concatenation, ordering, new fill values), the prompts tell the LLM how to handle
+them, see `src.prompts`.
+
+Excel workbooks are read one sheet at a time. Their sheets are listed from the workbook
+index without parsing them, and only the selected ones are parsed, with the Rust
+calamine reader when python-calamine is installed, otherwise with openpyxl.
+"""
+import zipfile
+from typing import List, Optional, Tuple
+from xml.etree import ElementTree
+
+import numpy as np
+import pandas as pd
+from pandas.api.types import union_categoricals
+
+try:
+    import python_calamine
+except ImportError:  # Workbooks are read with openpyxl without it
+    python_calamine = None
+
+
+INGESTION_ENGINES = ("pandas", "pyarrow")
+EXCEL_ENGINES = ("calamine", "openpyxl")
+
+
+class MemoryBudgetExceededError(Exception):
+    """Raised when an uploaded file does not fit in the configured memory budget"""
+
+
+class IngestionReport:
+    """Memory footprint of a file with the default dtypes and after compaction"""
+
+    def __init__(self, name: str, rows: int, columns: int, original_bytes: int, compact_bytes: int):
+        self.name = name
+        self.rows = rows
+        self.columns = columns
+        self.original_bytes = original_bytes
+        self.compact_bytes = compact_bytes
+
+    @property
+    def saved_ratio(self) -> float:
+        if not self.original_bytes:
+            return 0.0
+        return 1 - self.compact_bytes / self.original_bytes
+
+    def __str__(self):
+        return (
+            f"{self.name}: {self.rows:,} rows x {self.columns} columns, "
+            f"{format_bytes(self.original_bytes)} -> {format_bytes(self.compact_bytes)} "
+            f"({self.saved_ratio:.0%} smaller)"
+        )
+
+
+def format_bytes(size: float) -> str:
+    for unit in ("B", "KB", "MB", "GB"):
+        if abs(size) < 1024:
+            return f"{size:.1f} {unit}"
+        size /= 1024
+    return f"{size:.1f} TB"
+
+
+def infer_categorical_columns(sample: pd.DataFrame, max_category_ratio: float = 0.5) -> list:
+    """
+    Pick the string columns worth storing as categoricals.
+
+    Args:
+        sample (pd.DataFrame): The first rows of the file
+        max_category_ratio (float): Maximum ratio of distinct to non-null values for a
+        column to be considered low-cardinality. Default to 0.5
+
+    Returns (list): Names of the columns to convert
+    """
+
+    columns = []
+    for column in sample.select_dtypes(include="object").columns:
+        values = sample[column].dropna()
+        if len(values) and values.nunique() / len(values) <= max_category_ratio:
+            columns.append(column)
+    return columns
+
+
+def compact_numeric_columns(df: pd.DataFrame) -> pd.DataFrame:
+    """
+    Turn integral float columns with missing values into nullable 64-bit integers.
+    Integer columns are not downcast, the generated code would overflow them, and
+    float columns with fractional values are left untouched to keep their precision.
+    """
+
+    for column in df.columns:
+        series = df[column]
+        if pd.api.types.is_float_dtype(series.dtype):
+            values = series.dropna()
+            if len(values) and len(values) < len(series) and np.isfinite(values).all() \
+                    and np.array_equal(values, np.floor(values)) \
+                    and -2 ** 63 <= values.min() and values.max() < 2 ** 63:
+                df[column] = series.astype(pd.Int64Dtype())
+    return df
+
+
+def read_csv_compact(
+    file,
+    name: str = "",
+    chunk_rows: int = 100_000,
+    max_category_ratio: float = 0.5,
+    memory_budget: Optional[int] = None,
+) -> Tuple[pd.DataFrame, IngestionReport]:
+    """
+    Read a CSV file in chunks into a dataframe with compact dtypes.
+
+    Args:
+        file: A path or file-like object
+        name (str): Name of the file, used in the report
+        chunk_rows (int): Number of rows read at a time. The first chunk is also the
+        sample the dtypes are inferred from. Default to 100 000
+        max_category_ratio (float): See `infer_categorical_columns`. Default to 0.5
+        memory_budget (int): Maximum size in bytes of the resulting dataframe.
+        Default to None, meaning no limit
+
+    Raises:
+        MemoryBudgetExceededError: If the dataframe grows above the memory budget
+
+    Returns (tuple): The dataframe and the report of its memory footprint
+    """
+
+    chunks = []
+    original_bytes = 0
+    compact_bytes = 0
+
+    # A later chunk may parse a categorical column as numbers or as all missing, and
+    # categoricals of different types can't be concatenated. The columns are read as
+    # strings in every chunk, the sample is read again for that
+    start = file.tell() if hasattr(file, "tell") else None
+    categorical_columns = infer_categorical_columns(pd.read_csv(file, nrows=chunk_rows), max_category_ratio)
+    if start is not None:
+        file.seek(start)
+
+    for chunk in pd.read_csv(file, chunksize=chunk_rows, dtype={column: str for column in categorical_columns}):
+        original_bytes += chunk.memory_usage(deep=True).sum()
+
+        for column in categorical_columns:
+            chunk[column] = chunk[column].astype("category")
+
+        compact_bytes += chunk.memory_usage(deep=True).sum()
+        if memory_budget is not None and compact_bytes > memory_budget:
+            raise MemoryBudgetExceededError(
+                f"{name or 'The file'} needs more than the {format_bytes(memory_budget)} memory budget "
+                f"after {sum(len(c) for c in chunks) + len(chunk):,} rows"
+            )
+        chunks.append(chunk)
+
+    if not chunks:
+        return pd.DataFrame(), IngestionReport(name, 0, 0, 0, 0)
+
+    # Chunks share their categories so concatenating keeps the categorical dtype
+    for column in categorical_columns:
+        categories = union_categoricals([chunk[column] for chunk in chunks]).categories
+        for chunk in chunks:
+            chunk[column] = chunk[column].cat.set_categories(categories)
+
+    df = pd.concat(chunks, ignore_index=True)
+    del chunks
+
+    # Missing values make integer columns float, in some chunks only, normalize on
+    # the full column
+    df = compact_numeric_columns(df)
+
+    report = IngestionReport(name, len(df), len(df.columns), original_bytes, df.memory_usage(deep=True).sum())
+    return df, report
+
+
+def _arrow_types_mapper(arrow_type):
+    import pyarrow as pa
+
+    # Arrow strings as pandas' StringDtype, which supports the .str accessor. The other
+    # columns are converted to numpy dtypes, pandas 1.5 methods like nlargest don't
+    # support pd.ArrowDtype, and dictionary columns keep converting to categoricals
+    if pa.types.is_string(arrow_type) or pa.types.is_large_string(arrow_type):
+        return pd.StringDtype("pyarrow")
+    return None
+
+
+def read_csv_arrow(
+    file,
+    name: str = "",
+    arrow_backed: bool = False,
+    sample_rows: int = 100_000,
+    max_category_ratio: float = 0.5,
+    memory_budget: Optional[int] = None,
+) -> Tuple[pd.DataFrame, IngestionReport]:
+    """
+    Read a CSV file with the multithreaded pyarrow reader.
+
+    Args:
+        file: A path or file-like object
+        name (str): Name of the file, used in the report
+        arrow_backed (bool): Keep the string columns in Arrow memory. If False they
+        are converted to python strings. Other columns are converted to numpy-backed
+        columns, zero-copy where possible. Default to False
+        sample_rows (int): Number of rows used to pick categorical columns.
+        Default to 100 000
+        max_category_ratio (float): See `infer_categorical_columns`. Default to 0.5
+        memory_budget (int): Maximum size in bytes of the parsed table, and of the
+        dataframe estimated from its first `sample_rows` rows. Default to None,
+        meaning no limit
+
+    Raises:
+        MemoryBudgetExceededError: If the parsed table or the dataframe would be larger
+        than the memory budget
+
+    Returns (tuple): The dataframe and the report of its memory footprint
+    """
+
+    import pyarrow as pa
+    import pyarrow.compute as pc
+    import pyarrow.csv as pa_csv
+
+    table = pa_csv.read_csv(file, read_options=pa_csv.ReadOptions(use_threads=True))
+    original_bytes = table.nbytes
+    if memory_budget is not None and original_bytes > memory_budget:
+        raise MemoryBudgetExceededError(
+            f"{name or 'The file'} needs {format_bytes(original_bytes)}, more than the "
+            f"{format_bytes(memory_budget)} memory budget"
+        )
+
+    # Dictionary-encode low-cardinality strings, they become categoricals in pandas
+    sample = table.slice(0, sample_rows)
+    for i, field in enumerate(table.schema):
+        if not pa.types.is_string(field.type):
+            continue
+        values = sample.column(i)
+        non_null = len(values) - values.null_count
+        if non_null and pc.count_distinct(values).as_py() / non_null <= max_category_ratio:
+            table = table.set_column(i, field.name, pc.dictionary_encode(table.column(i)))
+
+    types_mapper = _arrow_types_mapper if arrow_backed else None
+
+    # Python strings can take several times their Arrow size, estimate the dataframe
+    # from the sample before converting the whole table
+    if memory_budget is not None and table.num_rows:
+        sample = table.slice(0, sample_rows)
+        sample_bytes = sample.to_pandas(types_mapper=types_mapper).memory_usage(deep=True).sum()
+        estimated_bytes = sample_bytes * table.num_rows / sample.num_rows
+        if estimated_bytes > memory_budget:
+            raise MemoryBudgetExceededError(
+                f"{name or 'The file'} needs about {format_bytes(estimated_bytes)} as a dataframe, more than "
+                f"the {format_bytes(memory_budget)} memory budget"
+            )
+
+    if arrow_backed:
+        df = table.to_pandas(types_mapper=types_mapper, split_blocks=True, self_destruct=True)
+        df = compact_numeric_columns(df)
+    else:
+        # Free the Arrow buffers column by column while converting
+        df = table.to_pandas(split_blocks=True, self_destruct=True)
+        df = compact_numeric_columns(df)
+    del table
+
+    report = IngestionReport(name, len(df), len(df.columns), original_bytes, df.memory_usage(deep=True).sum())
+    return df, report
+
+
+def ingest_csv(file, engine: str = "pandas", **kwargs) -> Tuple[pd.DataFrame, IngestionReport]:
+    """
+    Read a CSV file with the given ingestion engine.
+
+    Args:
+        file: A path or file-like object
+        engine (str): "pandas" for chunked reading, "pyarrow" for the Arrow reader.
+        Default to "pandas"
+        **kwargs: Passed on to `read_csv_compact` or `read_csv_arrow`
+
+    Returns (tuple): The dataframe and the report of its memory footprint
+    """
+
+    if engine == "pyarrow":
+        return read_csv_arrow(file, **kwargs)
+    if engine == "pandas":
+        return read_csv_compact(file, **kwargs)
+    raise ValueError(f"Unknown ingestion engine {engine!r}, expected one of {INGESTION_ENGINES}")
+
+
+def list_excel_sheets(file) -> List[str]:
+    """
+    List the sheets of an .xlsx workbook from its index, without parsing them.
+
+    Args:
+        file: A path or seekable file-like object
+
+    Returns (list): The names of the sheets, in the order of the workbook
+    """
+
+    position = file.tell() if hasattr(file, "tell") else None
+    try:
+        with zipfile.ZipFile(file) as archive:
+            workbook = ElementTree.fromstring(archive.read("xl/workbook.xml"))
+    finally:
+        if position is not None:
+            file.seek(position)
+    # Transitional and strict workbooks use different namespaces
+    return [element.get("name") for element in workbook.iter() if element.tag.rsplit("}", 1)[-1] == "sheet"]
+
+
+def _excel_column(values: tuple) -> pd.Series:
+    # calamine returns empty cells as "", every number as a float and dates as
+    # datetime.date, convert them the way pandas' readers do
+    series = pd.Series(values, dtype=object)
+    series = series.mask(series == "").infer_objects()
+    if series.dtype == object:
+        non_null = series.dropna()
+        if len(non_null) and non_null.map(lambda value: hasattr(value, "year")).all():
+            return pd.to_datetime(series)
+    elif pd.api.types.is_float_dtype(series.dtype) and len(series) and not series.isna().any():
+        if np.isfinite(series).all() and np.array_equal(series, np.floor(series)):
+            return series.astype(np.int64)
+    return series
+
+
+def _read_excel_calamine(file, sheet: Optional[str]) -> pd.DataFrame:
+    workbook = python_calamine.load_workbook(file)
+    rows = workbook.get_sheet_by_name(sheet if sheet is not None else workbook.sheet_names[0]).to_python()
+    if not rows:
+        return pd.DataFrame()
+
+    header, body = rows[0], rows[1:]
+    columns, seen = [], {}
+    for i, column in enumerate(header):
+        if column == "":
+            column = f"Unnamed: {i}"
+        elif isinstance(column, float) and column.is_integer():
+            column = int(column)
+        # Duplicate headers are numbered like pandas does
+        if column in seen:
+            seen[column] += 1
+            column = f"{column}.{seen[column]}"
+        else:
+            seen[column] = 0
+        columns.append(column)
+
+    if not body:
+        return pd.DataFrame(columns=columns)
+    return pd.DataFrame({column: _excel_column(values) for column, values in zip(columns, zip(*body))})
+
+
+def read_excel_compact(
+    file,
+    sheet: Optional[str] = None,
+    name: str = "",
+    engine: Optional[str] = None,
+    max_category_ratio: float = 0.5,
+    memory_budget: Optional[int] = None,
+) -> Tuple[pd.DataFrame, IngestionReport]:
+    """
+    Read one sheet of an Excel workbook into a dataframe with compact dtypes.
+
+    Args:
+        file: A path or seekable file-like object
+        sheet (str): Name of the sheet to read, see `list_excel_sheets`. Default to
+        None, the first sheet
+        name (str): Name of the file, used in the report
+        engine (str): "calamine" or "openpyxl". Default to None, calamine if
+        python-calamine is installed
+        max_category_ratio (float): See `infer_categorical_columns`. Default to 0.5
+        memory_budget (int): Maximum size in bytes of the resulting dataframe.
+        Default to None, meaning no limit
+
+    Raises:
+        MemoryBudgetExceededError: If the dataframe is larger than the memory budget
+
+    Returns (tuple): The dataframe and the report of its memory footprint
+    """
+
+    # Workbooks are read from the start, the previous sheet may have been read from the same file
+    if hasattr(file, "seek"):
+        file.seek(0)
+    if engine is None:
+        engine = "calamine" if python_calamine is not None else "openpyxl"
+    if engine == "calamine":
+        df = _read_excel_calamine(file, sheet)
+    elif engine == "openpyxl":
+        df = pd.read_excel(file, sheet_name=sheet if sheet is not None else 0, engine="openpyxl")
+    else:
+        raise ValueError(f"Unknown Excel engine {engine!r}, expected one of {EXCEL_ENGINES}")
+
+    original_bytes = df.memory_usage(deep=True).sum()
+    for column in infer_categorical_columns(df, max_category_ratio):
+        df[column] = df[column].astype("category")
+    df = compact_numeric_columns(df)
+
+    report = IngestionReport(name, len(df), len(df.columns), original_bytes, df.memory_usage(deep=True).sum())
+    if memory_budget is not None and report.compact_bytes > memory_budget:
+        raise MemoryBudgetExceededError(
+            f"{name or 'The sheet'} needs {format_bytes(report.compact_bytes)}, more than the "
+            f"{format_bytes(memory_budget)} memory budget"
+        )
+    return df, report
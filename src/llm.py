@@ -0,0 +1,84 @@
+"""
+This module contains the streaming OpenAI LLM.
+
+The pandasai OpenAI LLM blocks until the whole completion is returned. This subclass
+adds `acall`, an asyncio call that streams the completion and reports the text
+received so far after every chunk, so answers can be displayed as they are written
+and independent calls can run concurrently. `call` keeps the blocking interface
+pandasai expects and streams too when a token callback is set.
+"""
+import asyncio
+from typing import Callable, Optional
+
+import openai
+from pandasai.exceptions import UnsupportedOpenAIModelError
+from pandasai.llm.openai import OpenAI
+from pandasai.prompts.base import Prompt
+
+
+class StreamingOpenAI(OpenAI):
+    """
+    OpenAI LLM streaming its completions.
+
+    Attributes:
+        on_token (Callable[[str], None]): Called with the text received so far by the
+        blocking `call`. Default to None, calling the API without streaming
+    """
+
+    on_token: Optional[Callable[[str], None]] = None
+
+    def call(self, instruction: Prompt, value: str, suffix: str = "") -> str:
+        if self.on_token is None:
+            return super().call(instruction, value, suffix)
+        return asyncio.run(self.acall(instruction, value, suffix, on_token=self.on_token))
+
+    async def acall(
+        self,
+        instruction: Prompt,
+        value: str,
+        suffix: str = "",
+        on_token: Optional[Callable[[str], None]] = None,
+    ) -> str:
+        """
+        Call the OpenAI LLM and stream the response.
+
+        Args:
+            instruction (Prompt): Instruction to pass
+            value (str): Value to pass
+            suffix (str): Suffix to pass
+            on_token (Callable[[str], None]): Called with the text received so far
+            after every chunk. Default to None
+
+        Raises:
+            UnsupportedOpenAIModelError: Unsupported model
+
+        Returns:
+            str: Response
+        """
+        self.last_prompt = str(instruction) + str(value)
+        prompt = str(instruction) + str(value) + suffix
+
+        if self.model in self._supported_completion_models:
+            params = {**self._default_params, "prompt": prompt}
+            create = openai.Completion.acreate
+        elif self.model in self._supported_chat_models:
+            params = {**self._default_params, "messages": [{"role": "system", "content": prompt}]}
+            create = openai.ChatCompletion.acreate
+        else:
+            raise UnsupportedOpenAIModelError("Unsupported model")
+
+        if self.stop is not None:
+            params["stop"] = [self.stop]
+
+        response = ""
+        async for chunk in await create(**params, stream=True):
+            if not chunk["choices"]:
+                continue
+            choice = chunk["choices"][0]
+            delta = choice.get("text") if "text" in choice else choice["delta"].get("content")
+            if delta:
+                response += delta
+                if on_token is not None:
+                    on_token(response)
+
+        return response
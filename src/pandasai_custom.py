@@ -1,13 +1,14 @@
 
 # import ast
-import io
 # import logging
-import re
 # import sys
+import asyncio
+import copy
 import uuid
+import threading
 import time
-from contextlib import redirect_stdout
-from typing import List, Optional, Union
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from typing import Callable, List, Optional, Tuple, Union
 # from pandasai.middlewares.streamlit import StreamlitMiddleware
 
 # import astor
@@ -34,19 +35,114 @@ from pandasai.helpers.save_chart import add_save_chart
 from pandasai.prompts.correct_error_prompt import CorrectErrorPrompt
 from pandasai.prompts.correct_multiples_prompt import CorrectMultipleDataframesErrorPrompt
 from pandasai.prompts.generate_python_code import GeneratePythonCodePrompt
-# from pandasai.prompts.generate_response import GenerateResponsePrompt
+from pandasai.prompts.generate_response import GenerateResponsePrompt
 from pandasai.prompts.multiple_dataframes import MultipleDataframesPrompt
 
 from pandasai import PandasAI
-import contextlib
-
-
-from .prompts import CodeSummaryPrompt, ColumnKeyErrorPrompt, GraphCleaupPrompt
+import duckdb
+
+
+from .code_analysis import CodeAnalysis, CodeIssue, analyze_code
+from .cache import CodeCache, fingerprint_dataframes, fingerprint_profiles
+from .duckdb_backend import DuckDBBackend, SQLNotSuitableError, extract_sql, wants_chart
+from .execution import ExecutionResult, execute, track_frames
+from .profile import DatasetProfile
+from .sandbox import find_mutated_dataframes, protect_dataframes
+from .result_cache import ResultCache
+from .semantic_cache import SemanticCache
+from .spans import CODE_SUMMARY, CONVERSATIONAL_REWRITE, EXEC, LLM_GENERATE, PROMPT_BUILD, RETRY, Trace
+from .worker_pool import ExecutionCancelledError, SandboxLimitError, WorkerPool, build_environment
+from .prompts import (
+    CodeSummaryPrompt,
+    ColumnKeyErrorPrompt,
+    CustomMultipleDataframesPrompt,
+    GenerateSQLPrompt,
+    GraphCleaupPrompt,
+)
 
 class ExceededMaxRetriesError(Exception):
     """Raised when the maximum number of retries is exceeded"""
 
 class CustomPandasAI(PandasAI):
+    _code_cache: Optional[CodeCache] = None
+    _semantic_cache: Optional[SemanticCache] = None
+    _result_cache: Optional[ResultCache] = None
+    _execution_backend: str = "pandas"
+    _duckdb: Optional[DuckDBBackend] = None
+    last_execution: Optional[ExecutionResult] = None
+    last_code_cached: bool = False
+    last_result_cached: bool = False
+    last_semantic_match: Optional[Tuple[int, str, str, float]] = None
+    last_corrected_code: Optional[str] = None
+    last_backend: Optional[str] = None
+    last_latency: Optional[float] = None
+    last_execution_latency: Optional[float] = None
+    last_candidate: Optional[int] = None
+    last_trace: Optional[Trace] = None
+    last_code_rewrites: List[str] = []
+    last_code_issues: List[CodeIssue] = []
+    on_code_issues: Optional[Callable[[List[CodeIssue]], None]] = None
+
+    def __init__(
+        self,
+        *args,
+        code_cache: Optional[CodeCache] = None,
+        semantic_cache: Optional[SemanticCache] = None,
+        result_cache: Optional[ResultCache] = None,
+        execution_backend: str = "pandas",
+        duckdb_spill_dir: Optional[str] = None,
+        speculative_candidates: int = 1,
+        speculative_temperature: float = 0.7,
+        worker_pool: Optional[WorkerPool] = None,
+        optimize_code: bool = False,
+        code_warning_seconds: float = 1.0,
+        **kwargs,
+    ):
+        """
+        Args:
+            code_cache (CodeCache): Persistent cache of generated code keyed on the
+            prompt and the dataframe fingerprint. Default to None
+            semantic_cache (SemanticCache): Cache of generated code matched on
+            questions similar to the prompt, asked on the same dataframes. Looked up
+            when the code cache misses. Default to None
+            result_cache (ResultCache): Cache of execution results keyed on the code
+            and the content of the dataframes, so the same code isn't executed twice
+            on the same data. Default to None
+            execution_backend (str): "pandas" to always answer with generated python
+            code, "duckdb" to first try a single SQL query run by DuckDB.
+            Default to "pandas"
+            duckdb_spill_dir (str): Directory to spill the dataframes to as Parquet
+            for DuckDB. Default to None, querying the dataframes in memory
+            speculative_candidates (int): Number of corrections requested at the same
+            time when the generated code fails. Default to 1, correcting the code one
+            attempt at a time
+            speculative_temperature (float): Temperature of the LLM for every
+            speculative candidate but the first, so they differ. Default to 0.7
+            worker_pool (WorkerPool): Worker processes to execute the generated code
+            in, with a timeout and a memory limit. Default to None, executing it in
+            this process
+            optimize_code (bool): Rewrite the row-by-row patterns of the generated code
+            that have a vectorized equivalent before executing it, see
+            `src.code_analysis`. Default to False
+            code_warning_seconds (float): Estimated run time from which the expensive
+            patterns left in the code are reported to `on_code_issues` before it runs.
+            Default to 1
+        """
+        super().__init__(*args, **kwargs)
+        self._code_cache = code_cache
+        self._semantic_cache = semantic_cache
+        self._result_cache = result_cache
+        self._execution_backend = execution_backend
+        self._speculative_candidates = speculative_candidates
+        self._speculative_temperature = speculative_temperature
+        self._worker_pool = worker_pool
+        self._optimize_code = optimize_code
+        self._code_warning_seconds = code_warning_seconds
+        self.last_trace = Trace()
+        self._clean_code_lock = threading.Lock()
+        if execution_backend == "duckdb":
+            self._duckdb = DuckDBBackend(spill_dir=duckdb_spill_dir)
+
     def run(
         self,
         data_frame: Union[pd.DataFrame, List[pd.DataFrame]],
@@ -56,6 +152,7 @@ class CustomPandasAI(PandasAI):
         anonymize_df: bool = True,
         use_error_correction_framework: bool = True,
         df_head: Optional[pd.DataFrame] = None,
+        df_profile: Optional[Union[DatasetProfile, List[DatasetProfile]]] = None,
     ) -> Union[str, pd.DataFrame]:
         """
         Run the PandasAI to make Dataframes Conversational.
@@ -70,6 +167,10 @@ class CustomPandasAI(PandasAI):
             anonymize_df (bool): Running the code with Sensitive Data. Default to True
             use_error_correction_framework (bool): Turn on Error Correction mechanism.
             Default to True
+            df_head (pd.DataFrame): The metadata rows to send instead of the head
+            df_profile (DatasetProfile): Profiles computed once per upload. The prompts
+            are rendered from them without touching the dataframes, and `df_head`
+            and `anonymize_df` are ignored. Default to None
 
         Returns (str): Answer to the Input Questions about the DataFrame
 
@@ -82,105 +183,78 @@ class CustomPandasAI(PandasAI):
         self._prompt_id = str(uuid.uuid4())
         self.log(f"Prompt ID: {self._prompt_id}")
 
+        self.last_execution = None
+        self.last_execution_latency = None
+        self.last_trace = Trace()
+
         try:
-            if self._enable_cache and self._cache and self._cache.get(prompt):
-                self.log("Using cached response")
-                code = self._cache.get(prompt)
-            else:
-                rows_to_display = 0 if self._enforce_privacy else 5
+            multiple: bool = isinstance(data_frame, list)
 
-                multiple: bool = isinstance(data_frame, list)
+            with self.last_trace.span(PROMPT_BUILD):
+                profiles = self._get_profiles(data_frame, df_head, anonymize_df, df_profile)
+                instruction = self._code_instruction(prompt, profiles, multiple, precomputed=df_profile is not None)
 
                 # MOD
                 if multiple:
-                    if df_head:
-                        heads = df_head
-                    else:
-                        heads = [
-                            anonymize_dataframe_head(dataframe)
-                            if anonymize_df
-                            else dataframe.head(rows_to_display)
-                            for dataframe in data_frame
-                    ]
-                    
-
-                    multiple_dataframes_instruction = self._non_default_prompts.get(
-                        "multiple_dataframes", MultipleDataframesPrompt
-                    )
-                    code = self._llm.generate_code(
-                        multiple_dataframes_instruction(dataframes=heads),
-                        prompt,
-                    )
-
                     self._original_instructions = {
                         "question": prompt,
-                        "df_head": heads,
+                        "df_head": [profile.head for profile in profiles],
+                        "profiles": profiles,
                     }
 
                 else:
-                    # MOD
-                    if not df_head:
-                        df_head = data_frame.head(rows_to_display)
-                        if anonymize_df:
-                            df_head = anonymize_dataframe_head(df_head)
-
-                    generate_code_instruction = self._non_default_prompts.get(
-                        "generate_python_code", GeneratePythonCodePrompt
-                    )(
-                        prompt=prompt,
-                        df_head=df_head,
-                        num_rows=data_frame.shape[0],
-                        num_columns=data_frame.shape[1],
-                    )
-                    code = self._llm.generate_code(
-                        generate_code_instruction,
-                        prompt,
-                    )
-
+                    profile = profiles[0]
                     self._original_instructions = {
                         "question": prompt,
-                        "df_head": df_head,
-                        "num_rows": data_frame.shape[0],
-                        "num_columns": data_frame.shape[1],
+                        "df_head": profile.head,
+                        "num_rows": profile.num_rows,
+                        "num_columns": profile.num_columns,
+                        "profiles": profiles,
                     }
 
-                self.last_code_generated = code
-                self.log(
-                    f"""
-                        Code generated:
-                        ```
-                        {code}
-                        ```
-                    """
+            # The code cache is keyed on the prompt AND the metadata sent to the LLM.
+            # Heads anonymized on the fly are random, so only a head passed in is
+            # fingerprinted
+            fingerprint = None
+            if self._code_cache is not None or self._semantic_cache is not None:
+                if df_profile is not None:
+                    fingerprint = fingerprint_profiles(profiles)
+                else:
+                    fingerprint = fingerprint_dataframes(data_frame, df_head)
+
+            # Try answering with a single SQL query first, fall back to pandas code
+            answer = None
+            if self._execution_backend == "duckdb" and not wants_chart(prompt):
+                answer = self._run_sql(prompt, data_frame, fingerprint)
+
+            if answer is None:
+                self.last_backend = "pandas" if self._execution_backend == "pandas" else "duckdb-fallback"
+                answer = self._generate_and_run_code(
+                    data_frame,
+                    prompt,
+                    instruction,
+                    fingerprint,
+                    show_code=show_code,
+                    use_error_correction_framework=use_error_correction_framework,
                 )
 
-                if self._enable_cache and self._cache:
-                    self._cache.set(prompt, code)
-
-            if show_code and self._in_notebook:
-                self.notebook.create_new_cell(code)
-
-            for middleware in self._middlewares:
-                code = middleware(code)
-
-            answer = self.run_code(
-                code,
-                data_frame,
-                use_error_correction_framework=use_error_correction_framework,
-            )
             self.code_output = answer
             self.log(f"Answer: {answer}")
 
             if is_conversational_answer is None:
                 is_conversational_answer = self._is_conversational_answer
             if is_conversational_answer:
-                answer = self.conversational_answer(prompt, answer)
+                with self.last_trace.span(CONVERSATIONAL_REWRITE) as span:
+                    answer = self.conversational_answer(prompt, answer)
+                    span.record_llm_call(self._llm.last_prompt, answer, getattr(self._llm, "model", None))
                 self.log(f"Conversational answer: {answer}")
 
-            self.log(f"Executed in: {time.time() - self._start_time}s")
+            self.last_latency = time.time() - self._start_time
+            self.log(f"Executed in: {self.last_latency}s")
 
             return answer
         except Exception as exception:
+            self.last_latency = time.time() - self._start_time
             self.last_error = str(exception)
             print(exception)
             return (
@@ -188,12 +262,232 @@ class CustomPandasAI(PandasAI):
                 "because of the following error:\n"
                 f"\n{exception}\n"
             )
+    def _get_profiles(
+        self,
+        data_frame: Union[pd.DataFrame, List[pd.DataFrame]],
+        df_head=None,
+        anonymize_df: bool = True,
+        df_profile: Optional[Union[DatasetProfile, List[DatasetProfile]]] = None,
+    ) -> List[DatasetProfile]:
+        """
+        Return the profiles the prompts are rendered from. Without precomputed profiles,
+        schema-only profiles are built from the dataframes and their (anonymized) heads.
+
+        Returns (List[DatasetProfile]): One profile per dataframe
+        """
+
+        if df_profile is not None:
+            profiles = df_profile if isinstance(df_profile, list) else [df_profile]
+            # The head and column statistics hold actual values of the data
+            if self._enforce_privacy:
+                profiles = [profile.redacted() for profile in profiles]
+            return profiles
+
+        rows_to_display = 0 if self._enforce_privacy else 5
+        dataframes = data_frame if isinstance(data_frame, list) else [data_frame]
+
+        if df_head is not None:
+            heads = df_head if isinstance(df_head, list) else [df_head]
+        else:
+            heads = [
+                anonymize_dataframe_head(dataframe.head(rows_to_display))
+                if anonymize_df
+                else dataframe.head(rows_to_display)
+                for dataframe in dataframes
+            ]
+
+        return [
+            DatasetProfile(*dataframe.shape, dataframe.dtypes, head)
+            for dataframe, head in zip(dataframes, heads)
+        ]
+
+    def _code_instruction(self, prompt: str, profiles: List[DatasetProfile], multiple: bool, precomputed: bool):
+        """Build the code generation prompt from the profiles"""
+        if multiple:
+            multiple_dataframes_instruction = self._non_default_prompts.get(
+                "multiple_dataframes", MultipleDataframesPrompt
+            )
+            # Prompts other than ours only know about the heads
+            if precomputed and issubclass(multiple_dataframes_instruction, CustomMultipleDataframesPrompt):
+                return multiple_dataframes_instruction(profiles=profiles)
+            return multiple_dataframes_instruction(dataframes=[profile.head for profile in profiles])
+
+        profile = profiles[0]
+        return self._non_default_prompts.get(
+            "generate_python_code", GeneratePythonCodePrompt
+        )(
+            prompt=prompt,
+            df_head=profile.head,
+            num_rows=profile.num_rows,
+            num_columns=profile.num_columns,
+            column_profile=profile.column_profile,
+        )
+
+    def _generate_and_run_code(
+        self,
+        data_frame: Union[pd.DataFrame, List[pd.DataFrame]],
+        prompt: str,
+        instruction,
+        fingerprint: Optional[str],
+        show_code: bool = False,
+        use_error_correction_framework: bool = True,
+    ):
+        """
+        Generate python code for the prompt, or take it from the cache, and run it.
+
+        Returns: The result of `run_code`
+        """
+
+        # The inherited cache is keyed only on the prompt, the code cache also on
+        # the dataframe fingerprint
+        code = None
+        cache_key = None
+        if self._code_cache is not None:
+            cache_key = self._code_cache.key(prompt, fingerprint)
+            code = self._code_cache.get(cache_key)
+        elif self._enable_cache and self._cache:
+            code = self._cache.get(prompt)
+
+        if code is not None:
+            self.log("Using cached response")
+
+        self.last_semantic_match = None
+        if code is None and self._semantic_cache is not None and fingerprint is not None:
+            self.last_semantic_match = self._semantic_cache.get(prompt, fingerprint)
+            if self.last_semantic_match is not None:
+                _, similar_prompt, code, similarity = self.last_semantic_match
+                self.log(f"Using the code of a similar question: {similar_prompt} (similarity {similarity:.2f})")
+
+        self.last_code_cached = code is not None
+        if not self.last_code_cached:
+            with self.last_trace.span(LLM_GENERATE) as span:
+                code = self._llm.generate_code(instruction, prompt)
+                span.record_llm_call(self._llm.last_prompt, code, getattr(self._llm, "model", None))
+
+            self.log(
+                f"""
+                    Code generated:
+                    ```
+                    {code}
+                    ```
+                """
+            )
+
+            if self._enable_cache and self._cache and self._code_cache is None:
+                self._cache.set(prompt, code)
+
+        self.last_code_generated = code
+
+        if show_code and self._in_notebook:
+            self.notebook.create_new_cell(code)
+
+        for middleware in self._middlewares:
+            code = middleware(code)
+
+        answer = self.run_code(
+            code,
+            data_frame,
+            use_error_correction_framework=use_error_correction_framework,
+        )
+
+        # Only code that ran successfully is cached, corrected code if a retry fixed it
+        if cache_key is not None and not self.last_code_cached:
+            self._code_cache.set(cache_key, self.last_corrected_code or self.last_code_generated)
+
+        if self._semantic_cache is not None and fingerprint is not None:
+            # The code of the similar question had to be corrected, it wasn't the same question
+            if self.last_semantic_match is not None and self.last_corrected_code:
+                self._semantic_cache.delete(self.last_semantic_match[0])
+            if not self.last_code_cached or self.last_corrected_code:
+                self._semantic_cache.set(prompt, fingerprint, self.last_corrected_code or self.last_code_generated)
+
+        return answer
+
+    def _run_sql(
+        self,
+        prompt: str,
+        data_frame: Union[pd.DataFrame, List[pd.DataFrame]],
+        fingerprint: Optional[str],
+    ) -> Optional[pd.DataFrame]:
+        """
+        Answer the prompt with a single SQL query run by DuckDB over the dataframes.
+
+        Returns (pd.DataFrame): The query result, or None if the question is not
+        suitable for SQL or the query failed, in which case the pandas path is used.
+        """
+
+        multiple: bool = isinstance(data_frame, list)
+        if multiple:
+            dataframes = {f"df{i}": dataframe for i, dataframe in enumerate(data_frame, start=1)}
+        else:
+            dataframes = {"df": data_frame}
+
+        cache_key = None
+        sql = None
+        if self._code_cache is not None:
+            cache_key = self._code_cache.key(f"sql: {prompt}", fingerprint)
+            sql = self._code_cache.get(cache_key)
+
+        try:
+            if sql is None:
+                instruction = GenerateSQLPrompt(
+                    profiles=self._original_instructions["profiles"],
+                    names=list(dataframes.keys()),
+                )
+                with self.last_trace.span(LLM_GENERATE) as span:
+                    sql = extract_sql(self._llm.call(instruction, prompt, suffix="\n\nSQL:\n"))
+                    span.record_llm_call(self._llm.last_prompt, sql, getattr(self._llm, "model", None))
+                self.log(
+                    f"""
+                        SQL generated:
+                        ```
+                        {sql}
+                        ```
+                    """
+                )
+
+            self.last_code_generated = sql
+            self.last_code_executed = sql
+
+            with self.last_trace.span(EXEC) as span:
+                self._duckdb.register(dataframes)
+                result = self._duckdb.query(sql)
+            self.last_execution_latency = span.duration
+        except SQLNotSuitableError as e:
+            self.log(f"Falling back to pandas: {e}")
+            return None
+        except duckdb.Error as e:
+            self.log(f"Falling back to pandas, the SQL query failed: {e}")
+            return None
+
+        if cache_key is not None:
+            self._code_cache.set(cache_key, sql)
+
+        self.last_backend = "duckdb"
+        self.last_error = None
+        self.last_execution = ExecutionResult(
+            code=sql,
+            result=result,
+            has_result=True,
+            environment={"result": result},
+            language="sql",
+        )
+        return result
+
     def cleanup_graph_code(self, code):
         return self._llm.call(GraphCleaupPrompt(),
                                  code, 
                                  suffix="\n\nNew Code:\n")
         
-    def _retry_run_code(self, code: str, e: Exception, multiple: bool = False):
+    def _retry_run_code(
+        self,
+        code: str,
+        e: Exception,
+        multiple: bool = False,
+        llm=None,
+        attempt: int = None,
+        trace: Optional[Trace] = None,
+    ):
         """
         A method to retry the code execution with error correction framework.
 
@@ -202,6 +496,12 @@ class CustomPandasAI(PandasAI):
             e (Exception): An exception
             multiple (bool): A boolean to indicate if the code is for multiple
             dataframes
+            llm: The LLM to ask for the correction. Default to None, using the
+            PandasAI LLM
+            attempt (int): The retry or speculative candidate, recorded with its span.
+            Default to None
+            trace (Trace): The trace to record the span in. Default to None, the
+            trace of the prompt
 
         Returns (str): A python code
         """
@@ -213,6 +513,7 @@ class CustomPandasAI(PandasAI):
                     error_returned=e,
                     question=self._original_instructions["question"],
                     df_head=self._original_instructions["df_head"],
+                    profiles=self._original_instructions["profiles"],
                 )
             else:
                 error_correcting_instruction = self._non_default_prompts.get(
@@ -237,54 +538,210 @@ class CustomPandasAI(PandasAI):
                 num_columns=self._original_instructions["num_columns"],
             )
 
-        return self._llm.generate_code(error_correcting_instruction, "")
-    
-    def get_raw_response(self, 
-                         prompt, 
-                         data_frame, 
-                         anonymize_df=False):
-        
-        rows_to_display = 0 if self._enforce_privacy else 5
+        llm = llm or self._llm
+        trace = trace or self.last_trace
+        with trace.span(RETRY, attempt) as span:
+            code = llm.generate_code(error_correcting_instruction, "")
+            span.record_llm_call(llm.last_prompt, code, getattr(llm, "model", None))
+        return code
+
+    def _candidate_llm(self, candidate: int):
+        """Copy of the LLM for one speculative candidate, safe to call from a worker thread"""
+        llm = copy.copy(self._llm)
+        # Streamlit elements can't be updated from worker threads
+        if getattr(llm, "on_token", None) is not None:
+            llm.on_token = None
+        if candidate > 1 and hasattr(llm, "temperature"):
+            llm.temperature = self._speculative_temperature
+        return llm
+
+    def _run_speculative_candidates(
+        self,
+        code: str,
+        e: Exception,
+        multiple: bool,
+        dataframes: dict,
+    ) -> Tuple[ExecutionResult, str]:
+        """
+        Ask the LLM for several corrections of the failing code at the same time, each
+        candidate running its correction in its own sandbox as soon as it arrives. The
+        first one that runs without error wins, the others are cancelled: their
+        workers are killed and the corrections still pending are never executed.
 
-        multiple: bool = isinstance(data_frame, list)
+        With a worker pool the candidates run in parallel in their own processes, so a
+        slow candidate doesn't hold back the others. Without one they run in this
+        process one at a time, as stdout redirection and matplotlib are process-wide.
 
-        if multiple:
-            heads = [
-                anonymize_dataframe_head(dataframe)
-                if anonymize_df
-                else dataframe.head(rows_to_display)
-                for dataframe in data_frame
-            ]
+        Each candidate records its spans in its own trace, merged into the trace of the
+        prompt once the candidate is taken, so the abandoned candidates finishing later
+        don't show up in the trace of this prompt or the next one. Only the winner is
+        reported to `on_code_issues` and sets the state of the last execution.
 
-            multiple_dataframes_instruction = self._non_default_prompts.get(
-                "multiple_dataframes", MultipleDataframesPrompt
-            )
-            # response = self._llm.generate_code(
-            #     multiple_dataframes_instruction(dataframes=heads),
-            #     prompt,
-            # )
-            response = self._llm.call(multiple_dataframes_instruction(dataframes=heads), 
-                                 prompt, 
-                                 suffix="\n\nCode:\n")
+        Returns (tuple): The execution of the winning candidate and its code
+        """
+
+        trace = self.last_trace
+        traces = {candidate: Trace() for candidate in range(1, self._speculative_candidates + 1)}
+        cancel = threading.Event()
+        executor = ThreadPoolExecutor(max_workers=self._speculative_candidates)
+        futures = {
+            executor.submit(
+                self._run_candidate, code, e, multiple, dataframes, self._candidate_llm(candidate), candidate,
+                traces[candidate], cancel,
+            ): candidate
+            for candidate in traces
+        }
+
+        error = e
+        try:
+            for future in as_completed(futures):
+                candidate = futures[future]
+                trace.merge(traces[candidate])
+                try:
+                    execution, analysis, cached, dependencies = future.result()
+                except Exception as candidate_error:
+                    self.log(f"Speculative candidate {candidate} failed: {candidate_error}")
+                    error = candidate_error
+                    continue
+
+                self.log(f"Speculative candidate {candidate} succeeded")
+                self._report_code_analysis(analysis)
+                self._additional_dependencies = dependencies
+                self.last_result_cached = cached
+                self.last_execution_latency = next(
+                    span.duration for span in traces[candidate].spans if span.stage == EXEC
+                )
+                self.last_candidate = candidate
+                return execution, analysis.code
+        finally:
+            cancel.set()
+            executor.shutdown(wait=False, cancel_futures=True)
+
+        if isinstance(error, KeyError):
+            raise error
+        raise ExceededMaxRetriesError("Exceeded maximum number of retries")
+
+    def _run_candidate(self, code: str, e: Exception, multiple: bool, dataframes: dict, llm, candidate: int,
+                       trace: Trace, cancel: threading.Event) -> Tuple[ExecutionResult, CodeAnalysis, bool, List[dict]]:
+        """
+        Ask for one speculative correction and execute it, in a worker thread.
+
+        Returns (tuple): The execution, the analysis of the code, whether the execution
+        came from the result cache and the imports of the code
+        """
+
+        corrected = self._retry_run_code(code, e, multiple, llm, candidate, trace)
+        # `_clean_code` collects the imports of the code in `_additional_dependencies`
+        with self._clean_code_lock:
+            if cancel.is_set():
+                raise ExecutionCancelledError("Another candidate succeeded")
+            cleaned = self._clean_code(corrected)
+            dependencies = list(self._additional_dependencies)
+        analysis = self._code_analysis(cleaned, dataframes)
+        with trace.span(EXEC, candidate):
+            execution, cached = self._execute_cached(analysis.code, dataframes, dependencies, cancel)
+        return execution, analysis, cached, dependencies
+
+    def _analyze_code(self, code: str, dataframes: dict) -> str:
+        """
+        Rewrite the row-by-row patterns of the code if `optimize_code` is set, and
+        report the expensive ones left to `on_code_issues` before the code runs.
+
+        Args:
+            code (str): A python code
+            dataframes (dict): Mapping of environment name (`df`, `df1`, ...) to dataframe
+
+        Returns (str): The code to execute
+        """
+
+        analysis = self._code_analysis(code, dataframes)
+        self._report_code_analysis(analysis)
+        return analysis.code
+
+    def _code_analysis(self, code: str, dataframes: dict) -> CodeAnalysis:
+        """The analysis of `_analyze_code`, without reporting it. Safe from worker threads"""
+
+        # The profiles of the prompt carry the column statistics, if they describe
+        # these dataframes
+        profiles = self._original_instructions.get("profiles")
+        if not profiles or [profile.num_rows for profile in profiles] != [len(df) for df in dataframes.values()]:
+            profiles = [DatasetProfile.from_dataframe(df, column_stats=False) for df in dataframes.values()]
+
+        return analyze_code(code, dict(zip(dataframes, profiles)), rewrite=self._optimize_code,
+                            min_seconds=self._code_warning_seconds)
+
+    def _report_code_analysis(self, analysis: CodeAnalysis):
+        self.last_code_rewrites = analysis.rewrites
+        self.last_code_issues = analysis.issues
+        for message in analysis.rewrites + [str(issue) for issue in analysis.issues]:
+            self.log(message)
+        if analysis.issues and self.on_code_issues is not None:
+            self.on_code_issues(analysis.issues)
+
+    def _execute(self, code: str, dataframes: dict) -> ExecutionResult:
+        """
+        Execute the code once against the dataframes, in the worker pool if there is one.
+        Otherwise only the dataframes the code mutates are copied, the rest are shared
+        with the upload. The result of code already executed on the same data is
+        returned from the result cache instead.
+
+        Args:
+            code (str): A python code to execute
+            dataframes (dict): Mapping of environment name (`df`, `df1`, ...) to dataframe
+
+        Returns (ExecutionResult): The captured output, last value, figures and the
+        dataframes and series the code created or modified
+        """
+
+        execution, self.last_result_cached = self._execute_cached(code, dataframes, self._additional_dependencies)
+        return execution
 
+    def _execute_cached(self, code: str, dataframes: dict, dependencies: List[dict],
+                        cancel: Optional[threading.Event] = None) -> Tuple[ExecutionResult, bool]:
+        """
+        `_execute` with the imports of the code given, safe from worker threads. Setting
+        `cancel` stops a run in the worker pool.
+
+        Returns (tuple): The execution and whether it came from the result cache
+        """
+
+        key = None
+        if self._result_cache is not None:
+            key = self._result_cache.key(code, dataframes)
+            execution = self._result_cache.get(key, dataframes) if key is not None else None
+            if execution is not None:
+                return execution, True
+
+        untouched = {}
+        if self._worker_pool is not None:
+            execution = self._worker_pool.execute(code, dataframes, dependencies, cancel)
         else:
-            df_head = data_frame.head(rows_to_display)
-            if anonymize_df:
-                df_head = anonymize_dataframe_head(df_head)
+            environment = build_environment(dependencies)
+            with protect_dataframes(code, dataframes) as protected:
+                environment.update(protected)
+                execution = execute(code, environment)
+            mutated = find_mutated_dataframes(code, dataframes.keys())
+            # The rest of the environment is released with it
+            execution.environment = track_frames(execution.environment, protected, mutated)
+            # Shallow copies of the dataframes, not to be stored again
+            untouched = {name: protected[name] for name in protected.keys() - mutated}
+
+        # Failed executions raise, only successful ones are cached
+        if key is not None:
+            self._result_cache.set(key, execution, dataframes, shared=untouched)
+        return execution, False
 
-            generate_code_instruction = self._non_default_prompts.get(
-                "generate_python_code", GeneratePythonCodePrompt
-            )(
-                prompt=prompt,
-                df_head=df_head,
-                num_rows=data_frame.shape[0],
-                num_columns=data_frame.shape[1],
-            )
-            # response = self._llm.generate_code(
-            #     generate_code_instruction,
-            #     prompt,
-            # )
-            response = self._llm.call(generate_code_instruction, 
+    def get_raw_response(self, 
+                         prompt, 
+                         data_frame, 
+                         anonymize_df=False,
+                         df_profile=None):
+
+        multiple: bool = isinstance(data_frame, list)
+        profiles = self._get_profiles(data_frame, anonymize_df=anonymize_df, df_profile=df_profile)
+        instruction = self._code_instruction(prompt, profiles, multiple, precomputed=df_profile is not None)
+
+        response = self._llm.call(instruction, 
                                  prompt, 
                                  suffix="\n\nCode:\n")
         
@@ -312,6 +769,111 @@ class CustomPandasAI(PandasAI):
         except Exception as e:
             return f"Code summary failed to generate because of error: {e}"
     
+    async def _acall_llm(
+        self,
+        instruction,
+        value: str,
+        suffix: str = "",
+        on_token: Optional[Callable[[str], None]] = None,
+    ) -> str:
+        """Call the LLM without blocking the event loop, streaming when the LLM supports it"""
+        if hasattr(self._llm, "acall"):
+            return await self._llm.acall(instruction, value, suffix, on_token=on_token)
+
+        response = await asyncio.to_thread(self._llm.call, instruction, value, suffix)
+        if on_token is not None:
+            on_token(response)
+        return response
+
+    async def aconversational_answer(
+        self,
+        question: str,
+        answer: str,
+        on_token: Optional[Callable[[str], None]] = None,
+    ) -> str:
+        """Async version of `conversational_answer`, see `_acall_llm`"""
+        if self._enforce_privacy:
+            # we don't want to send potentially sensitive data to the LLM server
+            return answer
+
+        generate_response_instruction = self._non_default_prompts.get(
+            "generate_response", GenerateResponsePrompt
+        )(question=question, answer=answer)
+        # The rewrite is optional, the raw answer is kept if it fails
+        try:
+            with self.last_trace.span(CONVERSATIONAL_REWRITE) as span:
+                response = await self._acall_llm(generate_response_instruction, "", on_token=on_token)
+                span.record_llm_call(str(generate_response_instruction), response, getattr(self._llm, "model", None))
+            return response
+        except Exception as e:
+            self.log(f"Conversational answer failed to generate because of error: {e}")
+            return answer
+
+    async def agenerate_code_summary(
+        self,
+        number_dataframes,
+        prompt,
+        code,
+        on_token: Optional[Callable[[str], None]] = None,
+    ) -> str:
+        """Async version of `generate_code_summary`, see `_acall_llm`"""
+        rows_to_display = 0 if self._enforce_privacy else 5
+
+        instruction = CodeSummaryPrompt(
+            number_dataframes=number_dataframes,
+            rows_to_display=rows_to_display,
+            prompt=prompt,
+            code=code,
+        )
+        try:
+            with self.last_trace.span(CODE_SUMMARY) as span:
+                response = await self._acall_llm(instruction, prompt, suffix="\n\nAnswer:\n", on_token=on_token)
+                span.record_llm_call(str(instruction) + prompt, response, getattr(self._llm, "model", None))
+            return response
+        except Exception as e:
+            return f"Code summary failed to generate because of error: {e}"
+
+    async def afollow_up(
+        self,
+        question: str,
+        answer,
+        code: Optional[str] = None,
+        number_dataframes: int = 1,
+        on_answer_token: Optional[Callable[[str], None]] = None,
+        on_summary_token: Optional[Callable[[str], None]] = None,
+    ) -> Tuple[str, Optional[str]]:
+        """
+        Rewrite the answer in a conversational way and explain the code concurrently,
+        instead of one call after the other. Run it after `run` with
+        `is_conversational_answer=False`.
+
+        Args:
+            question (str): The question asked
+            answer: The answer returned by `run`
+            code (str): The code that produced the answer. Default to None, skipping
+            the summary
+            number_dataframes (int): Number of dataframes the code ran on
+            on_answer_token (Callable[[str], None]): Receives the conversational answer
+            as it streams. Default to None
+            on_summary_token (Callable[[str], None]): Receives the code summary as it
+            streams. Default to None
+
+        Returns (tuple): The conversational answer and the code summary
+        """
+
+        start_time = time.time()
+
+        calls = [self.aconversational_answer(question, answer, on_token=on_answer_token)]
+        if code:
+            calls.append(self.agenerate_code_summary(number_dataframes, question, code, on_token=on_summary_token))
+        responses = await asyncio.gather(*calls)
+
+        # Keep last_latency covering the whole answer, as when `run` rewrites it
+        self.last_latency = (self.last_latency or 0) + time.time() - start_time
+        self.log(f"Conversational answer: {responses[0]}")
+
+        return responses[0], responses[1] if code else None
+
     def custom_run(self,
         data_frame: Union[pd.DataFrame, List[pd.DataFrame]],
         prompt: str,
@@ -320,6 +882,7 @@ class CustomPandasAI(PandasAI):
         anonymize_df: bool = True,
         use_error_correction_framework: bool = True,
         df_head: Optional[pd.DataFrame] = None,
+        df_profile: Optional[Union[DatasetProfile, List[DatasetProfile]]] = None,
     ) -> Union[str, pd.DataFrame]:
         try:
             result = self.run(
@@ -330,6 +893,7 @@ class CustomPandasAI(PandasAI):
                 anonymize_df,
                 use_error_correction_framework,
                 df_head=df_head,
+                df_profile=df_profile,
             )
         except ExceededMaxRetriesError:
             result = """
@@ -371,8 +935,14 @@ class CustomPandasAI(PandasAI):
         if self._save_charts:
             code = add_save_chart(code, self._prompt_id, not self._verbose)
 
-        # Get the code to run removing unsafe imports and df overwrites
-        code_to_run = self._clean_code(code)
+        if multiple:
+            dataframes = {f"df{i}": dataframe for i, dataframe in enumerate(data_frame, start=1)}
+        else:
+            dataframes = {"df": data_frame}
+
+        # Get the code to run removing unsafe imports and df overwrites, and
+        # vectorizing the row-by-row patterns
+        code_to_run = self._analyze_code(self._clean_code(code), dataframes)
         self.last_code_executed = code_to_run
         self.log(
             f"""
@@ -382,70 +952,63 @@ Code running:
 ```"""
         )
 
-        environment: dict = self._get_environment()
+        self.last_corrected_code = None
+        self.last_candidate = None
 
-        if multiple:
-            environment.update(
-                {f"df{i}": dataframe for i, dataframe in enumerate(data_frame, start=1)}
-            )
-        else:
-            environment["df"] = data_frame
-
-        # Redirect standard output to a StringIO buffer
-        with redirect_stdout(io.StringIO()) as output:
-            count = 0
-            while count < self._max_retries:
-                try:
-                    # Execute the code
-                    output = io.StringIO()
-
-                    # Execute the code block and capture the output
-                    with contextlib.redirect_stdout(output):
-                        exec(code_to_run, environment)
-                    code = code_to_run
+        count = 0
+        while count < self._max_retries:
+            try:
+                # Execute the code once, capturing output, last value and charts
+                with self.last_trace.span(EXEC, count) as span:
+                    execution = self._execute(code_to_run, dataframes)
+                self.last_execution_latency = span.duration
+                if count > 0:
+                    self.last_corrected_code = code_to_run
+                code = code_to_run
+                self.last_error = None
+                break
+            except Exception as e:
+                # Correcting code that was stopped would cost another full timeout
+                if not use_error_correction_framework or isinstance(e, SandboxLimitError):
+                    raise e
+
+                if self._speculative_candidates > 1:
+                    execution, code = self._run_speculative_candidates(code, e, multiple, dataframes)
+                    self.last_corrected_code = code
                     self.last_error = None
                     break
-                except Exception as e:
-                    if not use_error_correction_framework:
-                        raise e
-                    count += 1
 
-                    if count == self._max_retries and isinstance(e, KeyError):
-                        raise e
+                count += 1
 
+                if count == self._max_retries and isinstance(e, KeyError):
+                    raise e
 
-                    code_to_run = self._retry_run_code(code, e, multiple)
-            
-            if count == self._max_retries:
-                raise ExceededMaxRetriesError("Exceeded maximum number of retries")
 
-        captured_output = output.getvalue().strip()
-        if code.count("print(") > 1:
+                code_to_run = self._analyze_code(
+                    self._clean_code(self._retry_run_code(code, e, multiple, attempt=count)), dataframes)
+        
+        if count == self._max_retries:
+            raise ExceededMaxRetriesError("Exceeded maximum number of retries")
+
+        self.last_execution = execution
+
+        captured_output = execution.output
+        if code.count("print(") > 1 or not execution.has_result:
             return captured_output
 
-        # Evaluate the last line and return its value or the captured output
+        # Return the value of the last line rather than the captured output.
         # We do this because we want to return the right value and the right
         # type of the value. For example, if the last line is `df.head()`, we
         # want to return the head of the dataframe, not the captured output.
-        lines = code.strip().split("\n")
-        last_line = lines[-1].strip()
-
-        match = re.match(r"^print\((.*)\)$", last_line)
-        if match:
-            last_line = match.group(1)
+        result = execution.result
 
-        try:
-            result = eval(last_line, environment)
-
-            # In some cases, the result is a tuple of values. For example, when
-            # the last line is `print("Hello", "World")`, the result is a tuple
-            # of two strings. In this case, we want to return a string
-            if isinstance(result, tuple):
-                result = " ".join([str(element) for element in result])
+        # In some cases, the result is a tuple of values. For example, when
+        # the last line is `print("Hello", "World")`, the result is a tuple
+        # of two strings. In this case, we want to return a string
+        if isinstance(result, tuple):
+            result = " ".join([str(element) for element in result])
 
-            return result
-        except Exception:
-            return captured_output
+        return result
 
     def get_code_output(
         self,
@@ -464,8 +1027,11 @@ Code running:
             data_frame (pd.DataFrame): A full Pandas DataFrame
             use_error_correction_framework (bool): Turn on Error Correction mechanism.
             Default to True
+            has_chart (bool): Whether the code draws a chart, in which case the last
+            line is not evaluated for display. Default to False
 
-        Returns (str): String representation of the result of the code execution.
+        Returns (tuple): The captured output, the printed last line and the dataframes
+        and series the code created or modified.
 
         """
 
@@ -475,8 +1041,14 @@ Code running:
         if self._save_charts:
             code = add_save_chart(code, self._prompt_id, not self._verbose)
 
-        # Get the code to run removing unsafe imports and df overwrites
-        code_to_run = self._clean_code(code)
+        if multiple:
+            dataframes = {f"df{i}": dataframe for i, dataframe in enumerate(data_frame, start=1)}
+        else:
+            dataframes = {"df": data_frame}
+
+        # Get the code to run removing unsafe imports and df overwrites, and
+        # vectorizing the row-by-row patterns
+        code_to_run = self._analyze_code(self._clean_code(code), dataframes)
         self.last_code_executed = code_to_run
         self.log(
             f"""
@@ -486,62 +1058,27 @@ Code running:
 ```"""
         )
 
-        environment: dict = self._get_environment()
-
-        if multiple:
-            environment.update(
-                {f"df{i}": dataframe for i, dataframe in enumerate(data_frame, start=1)}
-            )
-        else:
-            environment["df"] = data_frame
-
-        # Redirect standard output to a StringIO buffer
-        with redirect_stdout(io.StringIO()):
-            count = 0
-            while count < self._max_retries:
-                try:
-                    # Execute the code
-                    output = io.StringIO()
-
-                    # Execute the code block and capture the output
-                    with contextlib.redirect_stdout(output):
-
-                        exec(code_to_run, environment)
-                    code = code_to_run
-                    break
-                except Exception as e:
-                    if not use_error_correction_framework:
-                        raise e
-                    count += 1
-
-                    if count == self._max_retries and isinstance(e, KeyError):
-                        raise e
-
-                    code_to_run = self._retry_run_code(code, e, multiple)
-            
-            if count == self._max_retries:
-                raise ExceededMaxRetriesError("Exceeded maximum number of retries")
-
-        captured_output = output.getvalue().strip()
-
-        lines = code.strip().split("\n")
-        last_line = lines[-1].strip()
-
-        match = re.match(r"^print\((.*)\)$", last_line)
-
-        result = ""
-        # Evaluate the last line and return its value or the captured output only if it isn't a print statement
-        # Print statements are captured by default, we print the last line IFF there is no print statement for the final line
-        if not match and not has_chart:
+        count = 0
+        while count < self._max_retries:
             try:
-                res_output = io.StringIO()
-                with contextlib.redirect_stdout(res_output):
-                    eval(f'print({last_line})', environment)
-                
-                result = res_output.getvalue().strip()
-            except Exception:
-                pass
+                execution = self._execute(code_to_run, dataframes)
+                break
+            except Exception as e:
+                if not use_error_correction_framework or isinstance(e, SandboxLimitError):
+                    raise e
+                count += 1
+
+                if count == self._max_retries and isinstance(e, KeyError):
+                    raise e
+
+                code_to_run = self._analyze_code(
+                    self._clean_code(self._retry_run_code(code, e, multiple)), dataframes)
         
-        return captured_output, result, environment
+        if count == self._max_retries:
+            raise ExceededMaxRetriesError("Exceeded maximum number of retries")
 
-        
+        # The last line is only shown if it isn't a print statement, since
+        # print statements are already part of the captured output
+        result = "" if has_chart else execution.display_result
+
+        return execution.output, result, execution.environment
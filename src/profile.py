@@ -0,0 +1,204 @@
+"""
+This module contains the dataset profile used to describe the uploaded dataframes to
+the LLM.
+
+A handful of head rows says little about a column with millions of values. The profile
+adds, for every column, the number of missing values, the range of ordered columns and
+the most common values. Null counts and ranges are computed on the full dataframe with
+vectorized reductions, one column at a time; the most common values come from
+hash-based value counts over a bounded random sample, so profiling a huge upload stays
+fast.
+
+The profile is computed once per upload and kept in the session. Prompts are rendered
+from it, so building a prompt never touches the dataframes again.
+"""
+import hashlib
+from typing import Optional
+
+import numpy as np
+import pandas as pd
+
+
+# Longest value rendered in the prompt, longer strings are truncated
+MAX_VALUE_LENGTH = 30
+
+
+def _sample_rows(df: pd.DataFrame, sample_size: Optional[int], random_state: int) -> pd.DataFrame:
+    if sample_size is None or len(df) <= sample_size:
+        return df
+    rng = np.random.default_rng(random_state)
+    return df.take(np.sort(rng.choice(len(df), size=sample_size, replace=False)))
+
+
+def _is_ordered(dtype) -> bool:
+    return (
+        (pd.api.types.is_numeric_dtype(dtype) and not pd.api.types.is_bool_dtype(dtype))
+        or pd.api.types.is_datetime64_any_dtype(dtype)
+    )
+
+
+def profile_columns(
+    df: pd.DataFrame,
+    k: int = 5,
+    sample_size: Optional[int] = 100_000,
+    random_state: int = 0,
+) -> pd.DataFrame:
+    """
+    Profile every column of the dataframe.
+
+    Args:
+        df (pd.DataFrame): The dataframe to profile
+        k (int): Number of most common values kept per column. Default to 5
+        sample_size (int): Maximum number of rows the value counts are computed on.
+        None counts the full dataframe. Default to 100 000
+        random_state (int): Seed of the sample, fixed so a dataset always gets the
+        same profile. Default to 0
+
+    Returns (pd.DataFrame): One row per column with its dtype, null count, distinct
+    count (in the sample), min, max and the list of its `k` most common values
+    """
+
+    # Reduced column by column, a frame-wide min() would upcast integers to float
+    ordered = [position for position, dtype in enumerate(df.dtypes) if _is_ordered(dtype)]
+    minimums = pd.Series({df.columns[position]: df.iloc[:, position].min() for position in ordered}, dtype=object)
+    maximums = pd.Series({df.columns[position]: df.iloc[:, position].max() for position in ordered}, dtype=object)
+    # Counted column by column too, a frame-wide isnull() copies the whole dataframe as booleans
+    null_counts = pd.Series([len(df) - df.iloc[:, position].count() for position in range(df.shape[1])],
+                            index=df.columns, dtype="int64")
+
+    sample = _sample_rows(df, sample_size, random_state)
+    distinct = {}
+    top = {}
+    for position, column in enumerate(df.columns):
+        # value_counts hashes the values, nlargest avoids sorting every distinct value
+        counts = sample.iloc[:, position].value_counts(sort=False)
+        # Categoricals also count their unused categories
+        counts = counts[counts > 0]
+        distinct[column] = len(counts)
+        # When every value is unique (ids, timestamps) the top values are arbitrary
+        top[column] = counts.nlargest(k).index.tolist() if len(counts) <= k or counts.max() > 1 else []
+
+    profile = pd.DataFrame({
+        "dtype": df.dtypes.astype(str),
+        "nulls": null_counts,
+        "distinct": pd.Series(distinct),
+        "min": minimums.reindex(df.columns),
+        "max": maximums.reindex(df.columns),
+        "top": pd.Series(top),
+    }, index=df.columns)
+    profile.attrs["rows"] = len(df)
+    profile.attrs["sampled_rows"] = len(sample)
+    return profile
+
+
+def _format_value(value) -> str:
+    if isinstance(value, pd.Timestamp) and value == value.normalize():
+        return str(value.date())
+    if isinstance(value, str):
+        if len(value) > MAX_VALUE_LENGTH:
+            value = value[:MAX_VALUE_LENGTH] + "..."
+        return repr(value)
+    return str(value)
+
+
+def format_column_profile(profile: pd.DataFrame) -> str:
+    """
+    Render a profile from `profile_columns` as a compact block for the prompts.
+
+    Returns (str): One line per column
+    """
+
+    sampled = profile.attrs.get("sampled_rows", 0) < profile.attrs.get("rows", 0)
+    lines = [
+        "Column profile (dtype, missing values, "
+        + ("distinct values in a sample, " if sampled else "distinct values, ")
+        + "range, most common values):"
+    ]
+    for column, row in profile.iterrows():
+        parts = [f"{row['nulls']} missing", f"{row['distinct']} distinct"]
+        if not pd.isnull(row["min"]):
+            parts.append(f"{_format_value(row['min'])} to {_format_value(row['max'])}")
+        if row["top"]:
+            parts.append("top: " + ", ".join(_format_value(value) for value in row["top"]))
+        lines.append(f"- {column} ({row['dtype']}): " + "; ".join(parts))
+    return "\n".join(lines)
+
+
+class DatasetProfile:
+    """
+    Schema, head sample and column statistics of a dataframe.
+
+    Args:
+        num_rows (int): Number of rows of the dataframe
+        num_columns (int): Number of columns of the dataframe
+        dtypes (pd.Series): Data types of the columns
+        head (pd.DataFrame): The metadata rows sent to the LLM
+        columns (pd.DataFrame): Column statistics from `profile_columns`. Default to
+        None, for a profile of the schema and head only
+    """
+
+    def __init__(
+        self,
+        num_rows: int,
+        num_columns: int,
+        dtypes: pd.Series,
+        head: pd.DataFrame,
+        columns: Optional[pd.DataFrame] = None,
+    ):
+        self.num_rows = num_rows
+        self.num_columns = num_columns
+        self.dtypes = dtypes
+        self.head = head
+        self.columns = columns
+        self.column_profile = format_column_profile(columns) if columns is not None else ""
+        self.hash = self._hash()
+
+    @classmethod
+    def from_dataframe(
+        cls,
+        df: pd.DataFrame,
+        head: Optional[pd.DataFrame] = None,
+        column_stats: bool = True,
+        **kwargs,
+    ) -> "DatasetProfile":
+        """
+        Profile a dataframe.
+
+        Args:
+            df (pd.DataFrame): The uploaded dataframe
+            head (pd.DataFrame): The metadata rows sent to the LLM. Default to df.head()
+            column_stats (bool): Compute the column statistics. Default to True
+            **kwargs: Passed on to `profile_columns`
+
+        Returns (DatasetProfile): The profile
+        """
+
+        if head is None:
+            head = df.head()
+        columns = profile_columns(df, **kwargs) if column_stats else None
+        return cls(len(df), len(df.columns), df.dtypes, head, columns)
+
+    def _hash(self) -> str:
+        digest = hashlib.sha256()
+        digest.update(repr((self.num_rows, self.num_columns)).encode())
+        for column, dtype in self.dtypes.items():
+            digest.update(f"{column}\x1f{dtype}\x1e".encode())
+        digest.update(self.head.to_csv(index=False).encode())
+        digest.update(self.column_profile.encode())
+        return digest.hexdigest()
+
+    @property
+    def shape(self) -> tuple:
+        return self.num_rows, self.num_columns
+
+    @property
+    def null_counts(self) -> Optional[pd.Series]:
+        return self.columns["nulls"] if self.columns is not None else None
+
+    @property
+    def cardinalities(self) -> Optional[pd.Series]:
+        return self.columns["distinct"] if self.columns is not None else None
+
+    def redacted(self) -> "DatasetProfile":
+        """Return the profile without any value of the data, only its schema"""
+        return DatasetProfile(self.num_rows, self.num_columns, self.dtypes, self.head.iloc[:0])
@@ -6,6 +6,16 @@ from pandasai.constants import END_CODE_TAG, START_CODE_TAG
 from pandasai.prompts.base import Prompt
 import pandas as pd
 
+from .profile import DatasetProfile
+
+
+def _profiles(dataframes: list[pd.DataFrame], profiles: list[DatasetProfile] = None) -> list[DatasetProfile]:
+    """The profiles to render, built from the dataframes for callers that have none"""
+    if profiles is not None:
+        return profiles
+    return [DatasetProfile(*dataframe.shape, dataframe.dtypes, dataframe) for dataframe in dataframes]
+
+
 class GraphCleaupPrompt(Prompt):
     text: str = """
 You are modifying the python code below to ensure the following criteria are met:
@@ -39,13 +49,13 @@ You are provided with the following pandas dataframes metadata:"""
         error_returned: Exception,
         question: str,
         df_head: list[pd.DataFrame],
+        profiles: list[DatasetProfile] = None,
     ):
-        for i, dataframe in enumerate(df_head, start=1):
-            row, col = dataframe.shape
+        for i, profile in enumerate(_profiles(df_head, profiles), start=1):
             self.text += f"""
-Dataframe df{i}, with {row} rows and {col} columns.
+Dataframe df{i}, with {profile.num_rows} rows and {profile.num_columns} columns.
 The column names and their respective data types for this dataframe are:
-{dataframe.dtypes}
+{profile.dtypes}
 """
 
         instruction: str = f"""
@@ -78,13 +88,13 @@ You are provided with the following pandas dataframes metadata:"""
         error_returned: Exception,
         question: str,
         df_head: list[pd.DataFrame],
+        profiles: list[DatasetProfile] = None,
     ):
-        for i, dataframe in enumerate(df_head, start=1):
-            row, col = dataframe.shape
+        for i, profile in enumerate(_profiles(df_head, profiles), start=1):
             self.text += f"""
-Dataframe df{i}, with {row} rows and {col} columns.
+Dataframe df{i}, with {profile.num_rows} rows and {profile.num_columns} columns.
 The column names and their respective data types for this dataframe are:
-{dataframe.dtypes}
+{profile.dtypes}
 """
 
         instruction: str = f"""
@@ -124,15 +134,18 @@ Today is {today_date}.
 You are provided with a pandas dataframe (df) with {num_rows} rows and {num_columns} columns.
 This is the metadata of the dataframe:
 {df_head}.
+{column_profile}
 
 When asked about the data, your response should include a python code that describes the dataframe `df`. 
 Assume that columns may have None or NaN values. Make sure column names are case-sensitive match EXACTLY as they appear in the dataframe.
+Columns with the category dtype are pandas categoricals, so always pass observed=True to groupby. Comparing them with == or !=, isin and the .str methods work as on strings, but convert them to plain strings with .astype(object) before concatenating them with strings, comparing them with < or >, sorting them alphabetically with min or max, or filling their missing values with a new value.
 Using the provided dataframe, df, return the python code and make sure to prefix the requested python code with {START_CODE_TAG} exactly and suffix the code with {END_CODE_TAG} exactly to get the answer to the following question:
         """  # noqa: E501
 
-    def __init__(self, **kwargs):
+    def __init__(self, column_profile: str = "", **kwargs):
         super().__init__(
             **kwargs,
+            column_profile=column_profile,
             START_CODE_TAG=START_CODE_TAG,
             END_CODE_TAG=END_CODE_TAG,
             today_date=date.today()
@@ -174,27 +187,72 @@ Obey the following rules:
 - Following the user’s requirements carefully and to the letter.
 - Make sure to filter out null, None, and NaN values.
 - Make sure column names are case-sensitive match EXACTLY as they appear in the dataframe.
+- Columns with the category dtype are pandas categoricals, so always pass observed=True to groupby.
+- Comparing categoricals with == or !=, isin and the .str methods work as on strings, but convert them to plain strings with .astype(object) before concatenating them with strings, comparing them with < or >, sorting them alphabetically with min or max, or filling their missing values with a new value.
 - Make sure to prefix the requested python code with {START_CODE_TAG} exactly and suffix the code with {END_CODE_TAG}.
 - If the question relies on visualization, respond with "Refer to the visualization.".
 Using the provided dataframes and no other dataframes, return the python code to get the answer to the following question:
         """ 
 
-    def __init__(self, dataframes: list[pd.DataFrame]):
-        for i, dataframe in enumerate(dataframes, start=1):
-            row, col = dataframe.shape
-
+    def __init__(self, dataframes: list[pd.DataFrame] = None, profiles: list[DatasetProfile] = None):
+        # Only the fixed parts are formatted, the metadata may contain braces
+        self.text = self.text.format(today_date=date.today())
+        for i, profile in enumerate(_profiles(dataframes, profiles), start=1):
             self.text += f"""
-Dataframe df{i}, with {row} rows and {col} columns. The data types of the dataframe columns are:
-{dataframe.dtypes}
+Dataframe df{i}, with {profile.num_rows} rows and {profile.num_columns} columns. The data types of the dataframe columns are:
+{profile.dtypes}
 
 This is the metadata of the dataframe df{i}:
-{dataframe}"""
+{profile.head}"""
+            if profile.column_profile:
+                self.text += "\n" + profile.column_profile
+
+        self.text += self.instruction.format(
+            START_CODE_TAG=START_CODE_TAG,
+            END_CODE_TAG=END_CODE_TAG,
+        )
+
+    def __str__(self):
+        return self.text
+
+# The LLM answers with this marker when the question is not suitable for SQL
+NO_SQL_MARKER = "NO_SQL"
+
+
+class GenerateSQLPrompt(Prompt):
+    """Prompt to generate a DuckDB SQL query"""
+
+    text: str = """
+Today is {today_date}.
+You are provided with the following tables in a DuckDB database:"""
+    instruction: str = """
+Obey the following rules:
+- Write a single DuckDB SQL query that answers the question. Only use the tables and columns listed above.
+- Make sure column names are case-sensitive match EXACTLY as they appear in the tables. Quote them with double quotes.
+- Make sure to filter out NULL values where they would affect the answer.
+- Make sure to prefix the query with {START_CODE_TAG} exactly and suffix the query with {END_CODE_TAG}.
+- If the question asks for a visualization, or cannot be answered with a single SQL query, respond with exactly {NO_SQL_MARKER} and nothing else.
+Return the SQL query to get the answer to the following question:
+        """
+
+    def __init__(self, profiles: list[DatasetProfile], names: list[str]):
+        # Only the fixed parts are formatted, the tables may contain braces
+        self.text = self.text.format(today_date=date.today())
+        for name, profile in zip(names, profiles):
+            self.text += f"""
+Table {name}, with {profile.num_rows} rows and {profile.num_columns} columns. The data types of the columns are:
+{profile.dtypes}
+
+This is the metadata of the table {name}:
+{profile.head}
+"""
+            if profile.column_profile:
+                self.text += profile.column_profile + "\n"
 
-        self.text += self.instruction
-        self.text = self.text.format(
-            today_date=date.today(),
+        self.text += self.instruction.format(
             START_CODE_TAG=START_CODE_TAG,
             END_CODE_TAG=END_CODE_TAG,
+            NO_SQL_MARKER=NO_SQL_MARKER,
         )
 
     def __str__(self):
@@ -0,0 +1,312 @@
+"""
+This module contains the cache of execution results.
+
+Streamlit reruns the whole script on every widget interaction, and the same code runs
+again on the same data whenever a question is asked again, answered from the code
+cache or matched by the semantic cache. The result cache keeps what the UI renders from
+an execution (the standard output, the last value, the figures and the dataframes and
+series the code created or modified) keyed on the normalized code and the content
+version of the dataframes it ran on.
+
+Results are kept in memory up to a size limit, least recently used first. Past the
+limit they are pickled to the spill directory instead of being dropped, and the
+directory is itself bounded. Spilled files are named after their key, so they are
+found again after a restart. The dataframes the code ran on are never stored, they are
+put back from the dataframes of the lookup.
+"""
+import ast
+import hashlib
+import os
+import pickle
+import threading
+import uuid
+import weakref
+from collections import OrderedDict
+from typing import Dict, Optional
+
+import pandas as pd
+
+from .execution import ExecutionResult
+
+
+def normalize_code(code: str) -> Optional[str]:
+    """
+    Drop comments and formatting differences, so they don't change the key.
+
+    Returns (str): The normalized code, None if it can't be cached because it renders
+    to the page while it runs, like the code rewritten by `StreamlitMiddleware`
+    """
+
+    try:
+        tree = ast.parse(code)
+    except SyntaxError:
+        return code.strip()
+
+    # Names bound to streamlit, the import alone is added to every code by the middleware
+    names = set()
+    for node in ast.walk(tree):
+        if isinstance(node, ast.Import):
+            names.update(alias.asname or alias.name.split(".")[0]
+                         for alias in node.names if alias.name.split(".")[0] == "streamlit")
+        elif isinstance(node, ast.ImportFrom) and (node.module or "").split(".")[0] == "streamlit":
+            names.update(alias.asname or alias.name for alias in node.names)
+    if any(isinstance(node, ast.Name) and node.id in names for node in ast.walk(tree)):
+        return None
+    return ast.unparse(tree)
+
+
+class _Input:
+    """Stands for a dataframe the code ran on in a stored result"""
+
+    def __init__(self, name: str):
+        self.name = name
+
+
+class ResultCache:
+    """
+    Size-bounded LRU cache of execution results, spilling to disk.
+
+    Args:
+        memory_limit_mb (int): Memory the cached results may use, in MB. Default to 256
+        spill_dir (str): Directory the results evicted from memory are pickled to.
+        Default to None, dropping them
+        spill_limit_mb (int): Disk space the spilled results may use, in MB. Default
+        to 2048
+    """
+
+    def __init__(self, memory_limit_mb: int = 256, spill_dir: Optional[str] = None, spill_limit_mb: int = 2048):
+        self._memory_limit = memory_limit_mb * 1024 ** 2
+        self._spill_dir = spill_dir
+        self._spill_limit = spill_limit_mb * 1024 ** 2
+        self._memory = OrderedDict()
+        self._disk = OrderedDict()
+        # id of every dataframe versioned -> (weak reference, version)
+        self._versions = {}
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.spills = 0
+
+        if spill_dir:
+            os.makedirs(spill_dir, exist_ok=True)
+            files = [entry for entry in os.scandir(spill_dir) if entry.name.endswith(".pickle")]
+            for entry in sorted(files, key=lambda entry: entry.stat().st_mtime):
+                self._disk[entry.name[:-len(".pickle")]] = entry.stat().st_size
+
+    def register(self, dataframe: pd.DataFrame, version: str):
+        """Set the version of a dataframe whose content is already keyed, like an upload"""
+        key = id(dataframe)
+        with self._lock:
+            self._versions[key] = (weakref.ref(dataframe), version)
+        weakref.finalize(dataframe, self._forget, key, version)
+
+    def _forget(self, key: int, version: str):
+        with self._lock:
+            if self._versions.get(key, (None, None))[1] == version:
+                del self._versions[key]
+
+    def version(self, dataframe: pd.DataFrame) -> Optional[str]:
+        """
+        The content version of a dataframe, hashed once per dataframe. Dataframes are
+        not mutated in place by the generated code, see `src.sandbox`.
+
+        Returns (str): A hex digest, None if the values can't be hashed
+        """
+
+        with self._lock:
+            entry = self._versions.get(id(dataframe))
+            if entry is not None and entry[0]() is dataframe:
+                return entry[1]
+
+        try:
+            hashes = pd.util.hash_pandas_object(dataframe, index=True).values
+        except TypeError:  # Unhashable values, like lists
+            return None
+        digest = hashlib.sha256(hashes.tobytes())
+        for column, dtype in dataframe.dtypes.items():
+            digest.update(f"{column}\x1f{dtype}\x1e".encode())
+        version = digest.hexdigest()
+        self.register(dataframe, version)
+        return version
+
+    def key(self, code: str, dataframes: Dict[str, pd.DataFrame]) -> Optional[str]:
+        """
+        Build the key of the code run on the dataframes.
+
+        Returns (str): The key, None if the code or a dataframe can't be cached
+        """
+
+        normalized = normalize_code(code)
+        if normalized is None:
+            return None
+        digest = hashlib.sha256(normalized.encode())
+        for name, dataframe in dataframes.items():
+            version = self.version(dataframe)
+            if version is None:
+                return None
+            digest.update(f"\x1d{name}\x1f{version}".encode())
+        return digest.hexdigest()
+
+    def get(self, key: str, dataframes: Dict[str, pd.DataFrame]) -> Optional[ExecutionResult]:
+        """Return the result of the key with the dataframes put back, or None if missing"""
+        with self._lock:
+            if key in self._memory:
+                self._memory.move_to_end(key)
+                stored = self._memory[key][0]
+            elif key in self._disk:
+                stored = self._load(key)
+            else:
+                stored = None
+
+            if stored is None:
+                self.misses += 1
+                return None
+            self.hits += 1
+
+        return self._restore(stored, dataframes)
+
+    def set(
+        self,
+        key: str,
+        execution: ExecutionResult,
+        dataframes: Dict[str, pd.DataFrame],
+        shared: Optional[Dict[str, pd.DataFrame]] = None,
+    ) -> None:
+        """
+        Store the result of a successful execution and evict past the memory limit.
+
+        Args:
+            key (str): The key of the code and the dataframes, see `key`
+            execution (ExecutionResult): The result to store
+            dataframes (dict): Mapping of environment name to the dataframe the code ran on
+            shared (dict): Mapping of environment name to a dataframe sharing the data
+            of the dataframe of that name, like the shallow copies of `src.sandbox`.
+            Stored as the dataframe it shares. Default to None
+        """
+
+        stored = self._strip(execution, dataframes, shared or {})
+        nbytes = self._nbytes(stored)
+        with self._lock:
+            self._memory[key] = (stored, nbytes)
+            self._memory.move_to_end(key)
+            self._evict()
+
+    def _strip(self, execution: ExecutionResult, dataframes: Dict[str, pd.DataFrame],
+               shared: Dict[str, pd.DataFrame]) -> ExecutionResult:
+        # Only the dataframes and series are kept from the environment, the dataframes
+        # the code ran on are replaced with placeholders
+        inputs = {id(dataframe): name for name, dataframe in dataframes.items()}
+        inputs.update((id(dataframe), name) for name, dataframe in shared.items())
+
+        def strip(value):
+            return _Input(inputs[id(value)]) if id(value) in inputs else value
+
+        environment = {
+            name: strip(value)
+            for name, value in execution.environment.items()
+            if isinstance(value, (pd.DataFrame, pd.Series))
+        }
+        return ExecutionResult(
+            code=execution.code,
+            output=execution.output,
+            result=strip(execution.result),
+            has_result=execution.has_result,
+            printed_result=execution.printed_result,
+            figures=list(execution.figures),
+            environment=environment,
+            language=execution.language,
+        )
+
+    def _restore(self, stored: ExecutionResult, dataframes: Dict[str, pd.DataFrame]) -> ExecutionResult:
+        def restore(value):
+            return dataframes.get(value.name) if isinstance(value, _Input) else value
+
+        return ExecutionResult(
+            code=stored.code,
+            output=stored.output,
+            result=restore(stored.result),
+            has_result=stored.has_result,
+            printed_result=stored.printed_result,
+            figures=list(stored.figures),
+            environment={name: restore(value) for name, value in stored.environment.items()},
+            language=stored.language,
+        )
+
+    @staticmethod
+    def _nbytes(stored: ExecutionResult) -> int:
+        values = list(stored.environment.values()) + [stored.result]
+        nbytes = len(stored.output)
+        for value in values:
+            if isinstance(value, pd.DataFrame):
+                nbytes += int(value.memory_usage(deep=True).sum())
+            elif isinstance(value, pd.Series):
+                nbytes += int(value.memory_usage(deep=True))
+        # A figure is mostly its artists, count it as a small frame
+        return nbytes + 1024 ** 2 * len(stored.figures)
+
+    def _path(self, key: str) -> str:
+        return os.path.join(self._spill_dir, f"{key}.pickle")
+
+    def _load(self, key: str) -> Optional[ExecutionResult]:
+        try:
+            with open(self._path(key), "rb") as file:
+                stored = pickle.load(file)
+        except (OSError, pickle.UnpicklingError, EOFError, AttributeError, ImportError):
+            del self._disk[key]
+            return None
+        self._disk.move_to_end(key)
+        self._memory[key] = (stored, self._nbytes(stored))
+        self._evict()
+        return stored
+
+    def _evict(self):
+        while self._memory and self.nbytes > self._memory_limit:
+            key, (stored, _) = self._memory.popitem(last=False)
+            if self._spill_dir and key not in self._disk:
+                self._spill(key, stored)
+
+        while self._disk and sum(self._disk.values()) > self._spill_limit:
+            key, _ = self._disk.popitem(last=False)
+            try:
+                os.remove(self._path(key))
+            except OSError:
+                pass
+
+    def _spill(self, key: str, stored: ExecutionResult):
+        temporary = os.path.join(self._spill_dir, f"{key}.{uuid.uuid4().hex}.tmp")
+        try:
+            with open(temporary, "wb") as file:
+                pickle.dump(stored, file, protocol=pickle.HIGHEST_PROTOCOL)
+            os.replace(temporary, self._path(key))
+        except Exception:  # Results that can't be pickled are dropped
+            if os.path.exists(temporary):
+                os.remove(temporary)
+            return
+        self._disk[key] = os.path.getsize(self._path(key))
+        self.spills += 1
+
+    def clear(self) -> None:
+        with self._lock:
+            self._memory.clear()
+            for key in self._disk:
+                try:
+                    os.remove(self._path(key))
+                except OSError:
+                    pass
+            self._disk.clear()
+            self.hits = 0
+            self.misses = 0
+
+    @property
+    def nbytes(self) -> int:
+        """Memory used by the results in memory"""
+        return sum(nbytes for _, nbytes in self._memory.values())
+
+    def __len__(self) -> int:
+        with self._lock:
+            return len(self._memory.keys() | self._disk.keys())
+
+    @property
+    def hit_rate(self) -> float:
+        total = self.hits + self.misses
+        return self.hits / total if total else 0.0
@@ -0,0 +1,183 @@
+"""
+This module contains the protected execution environment for the generated code.
+
+Instead of deep-copying every uploaded dataframe before each execution, the generated
+code is analysed first. The dataframes the code may mutate (column assignment,
+`.loc[...] = ...`, `inplace=True`, `del df[...]`, ...) or whose data it may reach as
+numpy arrays (`.values`, `.to_numpy()`, `np.asarray(df)`, `out=`), which can be written
+to without pandas knowing, are deep-copied. Only the dataframes the analysis rules out
+are handed over as shallow copies. No pandas option is changed, they are process-wide
+and the sessions run concurrently.
+"""
+import ast
+import contextlib
+
+
+# Methods that change the dataframe they are called on without `inplace=True`
+MUTATING_METHODS = {"insert", "pop", "update", "set_value", "_set_value", "__setitem__", "__delitem__"}
+
+# Attributes and functions exposing the data of a dataframe as arrays that can be written to
+VIEW_ATTRIBUTES = {"values", "to_numpy", "array", "_values", "__array__", "_mgr", "_data", "view"}
+VIEW_FUNCTIONS = {
+    "asarray", "asanyarray", "ascontiguousarray", "asfortranarray", "frombuffer", "getattr", "setattr", "vars",
+}
+
+
+def _root_name(node: ast.AST):
+    """Return the variable name an attribute/subscript/call chain starts from"""
+    while isinstance(node, (ast.Attribute, ast.Subscript, ast.Call)):
+        node = node.func if isinstance(node, ast.Call) else node.value
+    if isinstance(node, ast.Name):
+        return node.id
+    return None
+
+
+def _is_inplace(call: ast.Call) -> bool:
+    for keyword in call.keywords:
+        if keyword.arg == "inplace":
+            return not (isinstance(keyword.value, ast.Constant) and not keyword.value.value)
+    return False
+
+
+def _names(node: ast.AST) -> set:
+    return {element.id for element in ast.walk(node) if isinstance(element, ast.Name)}
+
+
+def _bound_names(target: ast.AST) -> list:
+    """The names a target binds, `a, *b = ...` binds a and b but `x[0] = ...` binds nothing"""
+    if isinstance(target, ast.Name):
+        return [target.id]
+    if isinstance(target, ast.Starred):
+        return _bound_names(target.value)
+    if isinstance(target, (ast.Tuple, ast.List)):
+        return [name for element in target.elts for name in _bound_names(element)]
+    return []
+
+
+def _bindings(tree: ast.AST):
+    """
+    Yield the (target, value) pairs of the code, where value is the expression the
+    target may get its object from: assignments, loop and comprehension variables,
+    `with ... as`, and the parameters of the functions defined in the code with the
+    arguments of their calls.
+    """
+    functions = {}
+    for node in ast.walk(tree):
+        if isinstance(node, (ast.FunctionDef, ast.AsyncFunctionDef)):
+            functions.setdefault(node.name, []).append(node.args)
+
+    for node in ast.walk(tree):
+        if isinstance(node, ast.Assign):
+            for target in node.targets:
+                yield target, node.value
+        elif isinstance(node, (ast.AnnAssign, ast.NamedExpr)) and node.value is not None:
+            yield node.target, node.value
+        elif isinstance(node, (ast.For, ast.AsyncFor, ast.comprehension)):
+            yield node.target, node.iter
+        elif isinstance(node, ast.withitem) and node.optional_vars is not None:
+            yield node.optional_vars, node.context_expr
+        elif isinstance(node, ast.Call) and isinstance(node.func, ast.Name) and node.func.id in functions:
+            for arguments in functions[node.func.id]:
+                parameters = arguments.posonlyargs + arguments.args + arguments.kwonlyargs
+                for parameter in parameters + [arguments.vararg, arguments.kwarg]:
+                    if parameter is not None:
+                        for value in node.args + [keyword.value for keyword in node.keywords]:
+                            yield ast.Name(id=parameter.arg), value
+
+
+def _aliases(tree: ast.AST, names: set) -> dict:
+    """
+    Map every name to the dataframe names it may refer to. `x = df`, views such as
+    `s = df['col']` or `x = df.loc[...]`, but also `frames = [df]`, `for x in frames`
+    or `f(df)` for a function of the code make x an alias of df. Anything computed from
+    a dataframe is an alias, so the mutations of the objects that may share its data are
+    all found.
+    """
+    aliases = {name: {name} for name in names}
+    bindings = list(_bindings(tree))
+
+    changed = True
+    while changed:
+        changed = False
+        for target, value in bindings:
+            source = set().union(*(aliases.get(name, set()) for name in _names(value)))
+            if not source:
+                continue
+            for name in _bound_names(target):
+                known = aliases.setdefault(name, set())
+                if not source <= known:
+                    known |= source
+                    changed = True
+    return aliases
+
+
+def find_mutated_dataframes(code: str, names) -> set:
+    """
+    Find the dataframes the code may modify in place, directly or through their
+    arrays.
+
+    Args:
+        code (str): A python code
+        names (Iterable[str]): Names of the dataframes available to the code
+
+    Returns (set): The subset of `names` that the code may mutate
+    """
+
+    tree = ast.parse(code)
+    aliases = _aliases(tree, set(names))
+
+    def resolve(node):
+        return aliases.get(_root_name(node), set())
+
+    mutated = set()
+    for node in ast.walk(tree):
+        if isinstance(node, (ast.Assign, ast.AugAssign, ast.AnnAssign, ast.Delete)):
+            targets = node.targets if isinstance(node, (ast.Assign, ast.Delete)) else [node.target]
+            for target in targets:
+                for element in (target.elts if isinstance(target, (ast.Tuple, ast.List)) else [target]):
+                    # `df = ...` only rebinds the name, except for augmented assignment
+                    # which pandas implements in place
+                    if isinstance(element, ast.Name) and not isinstance(node, ast.AugAssign):
+                        continue
+                    mutated |= resolve(element)
+        elif isinstance(node, ast.Call):
+            method = node.func.attr if isinstance(node.func, ast.Attribute) else None
+            if _is_inplace(node) or method in MUTATING_METHODS:
+                mutated |= resolve(node.func)
+            # np.asarray(df), getattr(df, "values") and ufuncs writing to out=df
+            function = node.func.id if isinstance(node.func, ast.Name) else method
+            if function in VIEW_FUNCTIONS:
+                for argument in node.args:
+                    mutated |= resolve(argument)
+            for keyword in node.keywords:
+                if keyword.arg == "out":
+                    for element in ast.walk(keyword.value):
+                        mutated |= resolve(element)
+        if isinstance(node, ast.Attribute) and node.attr in VIEW_ATTRIBUTES:
+            mutated |= resolve(node.value)
+
+    return mutated
+
+
+@contextlib.contextmanager
+def protect_dataframes(code: str, dataframes: dict):
+    """
+    Prepare the dataframes the code will run against.
+
+    Dataframes the code may mutate are deep-copied, the others are shallow copies
+    sharing the original data.
+
+    Args:
+        code (str): A python code
+        dataframes (dict): Mapping of environment name (`df`, `df1`, ...) to dataframe
+
+    Yields (dict): Mapping of environment name to the dataframe to expose to the code
+    """
+
+    mutated = find_mutated_dataframes(code, dataframes.keys())
+
+    protected = {
+        name: dataframe.copy(deep=name in mutated)
+        for name, dataframe in dataframes.items()
+    }
+    yield protected
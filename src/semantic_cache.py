@@ -0,0 +1,288 @@
+"""
+This module contains the cache of generated code for paraphrased questions.
+
+The code cache only matches a question asked again in the same words. Analysts ask the
+same things in different ones ("average salary by experience level", "mean
+salary_in_usd per experience_level"), so the semantic cache keeps every question that
+was answered without error on a dataset, with the code that answered it, and matches
+new questions against them with the cosine similarity of TF-IDF vectors of their words.
+
+Close in words is not the same question: "median salary", "average salary by company
+size" and "average salary of seniors" are all one or two words away from "average
+salary by company location". Questions are only compared with the questions asked on
+the same dataset fingerprint, must ask for the same aggregations, orderings and
+numbers, the same one-letter values ("company_size is L") and quoted values, and may
+only differ, after synonyms, by words of a column name whose other
+words they share, like "usd" in salary_in_usd.
+"""
+import math
+import os
+import re
+import sqlite3
+import threading
+import time
+from collections import Counter
+from typing import Dict, Optional, Tuple
+
+# Words with the same meaning in a question, mapped to one of them
+SYNONYMS = {
+    "mean": "average", "avg": "average",
+    "total": "sum", "sums": "sum",
+    "max": "highest", "maximum": "highest", "largest": "highest", "biggest": "highest", "most": "highest",
+    "min": "lowest", "minimum": "lowest", "smallest": "lowest", "least": "lowest", "fewest": "lowest",
+    "number": "count", "many": "count",
+    "graph": "plot", "chart": "plot", "draw": "plot", "visualize": "plot",
+    "percent": "percentage", "share": "percentage", "proportion": "percentage",
+    "without": "not", "excluding": "not", "except": "not", "no": "not",
+}
+
+# Words two questions must agree on to share code, after synonyms
+GUARDED = {
+    "average", "median", "sum", "count", "highest", "lowest", "top", "bottom", "first", "last",
+    "std", "deviation", "variance", "percentage", "ratio", "distinct", "unique", "cumulative",
+    "plot", "histogram", "scatter", "pie", "not", "ascending", "descending", "increase", "decrease",
+}
+
+STOPWORDS = {
+    "a", "an", "the", "of", "by", "per", "for", "in", "on", "to", "and", "or", "is", "are", "was", "were",
+    "what", "which", "who", "how", "do", "does", "me", "show", "give", "tell", "find", "list", "get",
+    "each", "every", "with", "from", "that", "this", "there", "it", "its", "be", "all", "please", "can",
+    "you", "we", "value", "have", "has", "data", "dataset",
+}
+
+
+# Quoted values, the quotes must not be part of a word like in "company's"
+QUOTED_PATTERN = re.compile(r"""(?<!\w)'([^']+)'(?!\w)|(?<!\w)"([^"]+)"(?!\w)""")
+
+
+def _normalize(word: str) -> str:
+    if len(word) > 4 and word.endswith("ies"):
+        word = word[:-3] + "y"
+    elif len(word) > 6 and word.endswith("ly"):
+        word = word[:-2]
+    elif len(word) > 3 and word.endswith("s") and not word.endswith("ss"):
+        word = word[:-1]
+    return SYNONYMS.get(word, word)
+
+
+class Question:
+    """
+    The words of a question, mapping synonyms and plurals to one word.
+
+    Attributes:
+        terms (Counter): Number of times every word is used
+        guard (frozenset): The aggregations, orderings, numbers, one-letter values and
+        quoted values asked for
+        soft (frozenset): Words of a column name other than its first one
+    """
+
+    def __init__(self, prompt: str):
+        self.prompt = prompt
+        self.terms = Counter()
+        # Quoted values are kept whole and as written
+        literals = [first or second for first, second in QUOTED_PATTERN.findall(prompt)]
+        self.terms.update(f"'{literal}'" for literal in literals)
+        soft = set()
+        # "isn't" asks for "not", the "s" of "what's" would be taken for a value
+        words_only = re.sub(r"n't\b", " not", QUOTED_PATTERN.sub(" ", prompt))
+        words_only = re.sub(r"(?<=[A-Za-z])'[A-Za-z]+\b", "", words_only)
+        for identifier in re.findall(r"[A-Za-z0-9_.]+", words_only):
+            words = re.findall(r"[A-Za-z]+|\d+(?:\.\d+)?", identifier)
+            # A lone "a" is the article, a lone "A" is a value like any other letter
+            words = [word.lower() for word in words if word != "a"]
+            words = [_normalize(word) for word in words]
+            words = [word for word in words if word not in STOPWORDS or len(word) == 1]
+            self.terms.update(words)
+            if "_" in identifier:
+                soft.update(words[1:])
+        self.soft = frozenset(soft)
+        self.guard = frozenset(
+            term for term in self.terms
+            if term in GUARDED or term[0].isdigit() or term[0] == "'" or len(term) == 1
+        )
+
+    def matches(self, other: "Question") -> bool:
+        """Whether the other question can be answered with the code of this one"""
+        if self.guard != other.guard:
+            return False
+        return (self.terms.keys() ^ other.terms.keys()) <= (self.soft | other.soft)
+
+
+class _Index:
+    """The questions answered on one dataset fingerprint, with their document frequencies"""
+
+    def __init__(self):
+        self.entries: Dict[int, Question] = {}
+        self.document_frequency = Counter()
+
+    def add(self, id: int, prompt: str):
+        self.remove(id)
+        question = Question(prompt)
+        self.entries[id] = question
+        self.document_frequency.update(question.terms.keys())
+
+    def remove(self, id: int):
+        if id in self.entries:
+            self.document_frequency.subtract(self.entries.pop(id).terms.keys())
+
+    def vector(self, question: Question) -> Dict[str, float]:
+        documents = len(self.entries) + 1
+        vector = {
+            term: (1 + math.log(count)) * (math.log(documents / (1 + self.document_frequency[term])) + 1)
+            for term, count in question.terms.items()
+        }
+        norm = math.sqrt(sum(weight * weight for weight in vector.values())) or 1.0
+        return {term: weight / norm for term, weight in vector.items()}
+
+    def nearest(self, prompt: str) -> Optional[Tuple[int, str, float]]:
+        """The most similar question that can be answered with the same code"""
+        question = Question(prompt)
+        query = self.vector(question)
+
+        best = None
+        for id, entry in self.entries.items():
+            if not entry.matches(question):
+                continue
+            vector = self.vector(entry)
+            similarity = sum(weight * vector.get(term, 0.0) for term, weight in query.items())
+            if best is None or similarity > best[2]:
+                best = (id, entry.prompt, similarity)
+        return best
+
+
+class SemanticCache:
+    """
+    On-disk cache of generated code matched on similar questions, with LRU and TTL
+    eviction.
+
+    Args:
+        path (str): SQLite file to store the cache in. Can be the code cache file
+        threshold (float): Cosine similarity between the TF-IDF vectors of two
+        questions from which they share code, between 0 and 1. Default to 0.6
+        max_entries (int): Number of entries kept before the least recently used are
+        evicted. Default to 1000
+        ttl (float): Seconds an entry stays valid. None keeps entries forever
+    """
+
+    def __init__(
+        self,
+        path: str = "cache/code_cache.db",
+        threshold: float = 0.6,
+        max_entries: int = 1000,
+        ttl: Optional[float] = None,
+    ):
+        if os.path.dirname(path):
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+
+        self.threshold = threshold
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self.hits = 0
+        self.misses = 0
+
+        self._lock = threading.Lock()
+        self._indexes: Dict[str, _Index] = {}
+        self._conn = sqlite3.connect(path, check_same_thread=False)
+        self._conn.execute('''CREATE TABLE IF NOT EXISTS semantic_cache (
+                                id INTEGER PRIMARY KEY AUTOINCREMENT,
+                                fingerprint TEXT,
+                                prompt TEXT,
+                                code TEXT,
+                                created_at REAL,
+                                accessed_at REAL,
+                                hits INTEGER DEFAULT 0,
+                                UNIQUE (fingerprint, prompt)
+                            )''')
+        self._conn.execute('''CREATE INDEX IF NOT EXISTS semantic_cache_accessed_at ON semantic_cache (accessed_at)''')
+        self._conn.commit()
+
+    def _index(self, fingerprint: str) -> _Index:
+        # Loaded from the database the first time a dataset is asked about
+        if fingerprint not in self._indexes:
+            index = _Index()
+            for id, prompt in self._conn.execute(
+                "SELECT id, prompt FROM semantic_cache WHERE fingerprint = ?", (fingerprint,)
+            ):
+                index.add(id, prompt)
+            self._indexes[fingerprint] = index
+        return self._indexes[fingerprint]
+
+    def get(self, prompt: str, fingerprint: str) -> Optional[Tuple[int, str, str, float]]:
+        """
+        Find the code of the question closest to the prompt asked on the same dataset.
+
+        Returns (tuple): The id of the entry, its question, its code and the similarity,
+        or None if no question is similar enough
+        """
+
+        now = time.time()
+        with self._lock:
+            nearest = self._index(fingerprint).nearest(prompt)
+            row = None
+            if nearest is not None and nearest[2] >= self.threshold:
+                row = self._conn.execute(
+                    "SELECT code, created_at FROM semantic_cache WHERE id = ?", (nearest[0],)
+                ).fetchone()
+
+                if row is not None and self.ttl is not None and now - row[1] > self.ttl:
+                    self._delete(nearest[0])
+                    row = None
+
+            if row is None:
+                self.misses += 1
+                return None
+
+            self._conn.execute("UPDATE semantic_cache SET accessed_at = ?, hits = hits + 1 WHERE id = ?",
+                               (now, nearest[0]))
+            self._conn.commit()
+            self.hits += 1
+            id, similar_prompt, similarity = nearest
+            return id, similar_prompt, row[0], similarity
+
+    def set(self, prompt: str, fingerprint: str, code: str) -> None:
+        """Store the code that answered the prompt and evict the least recently used entries"""
+        now = time.time()
+        with self._lock:
+            self._conn.execute('''INSERT OR REPLACE INTO semantic_cache (fingerprint, prompt, code, created_at, accessed_at)
+                                  VALUES (?, ?, ?, ?, ?)''', (fingerprint, prompt, code, now, now))
+            self._conn.execute('''DELETE FROM semantic_cache WHERE id NOT IN (
+                                    SELECT id FROM semantic_cache ORDER BY accessed_at DESC LIMIT ?
+                                  )''', (self.max_entries,))
+            if self.ttl is not None:
+                self._conn.execute("DELETE FROM semantic_cache WHERE created_at < ?", (now - self.ttl,))
+            self._conn.commit()
+            # Replaced and evicted entries change the ids, the indexes are reloaded
+            self._indexes.clear()
+
+    def _delete(self, id: int):
+        self._conn.execute("DELETE FROM semantic_cache WHERE id = ?", (id,))
+        self._conn.commit()
+        for index in self._indexes.values():
+            index.remove(id)
+
+    def delete(self, id: int) -> None:
+        """Forget one question, when its code answered a similar question wrongly"""
+        with self._lock:
+            self._delete(id)
+
+    def invalidate(self, fingerprint: Optional[str] = None) -> None:
+        """Forget the questions asked on a dataset, or on every dataset if None"""
+        with self._lock:
+            if fingerprint is None:
+                self._conn.execute("DELETE FROM semantic_cache")
+                self._indexes.clear()
+                self.hits = 0
+                self.misses = 0
+            else:
+                self._conn.execute("DELETE FROM semantic_cache WHERE fingerprint = ?", (fingerprint,))
+                self._indexes.pop(fingerprint, None)
+            self._conn.commit()
+
+    def __len__(self) -> int:
+        with self._lock:
+            return self._conn.execute("SELECT COUNT(*) FROM semantic_cache").fetchone()[0]
+
+    @property
+    def hit_rate(self) -> float:
+        total = self.hits + self.misses
+        return self.hits / total if total else 0.0
@@ -0,0 +1,143 @@
+"""
+This module contains the per-stage timing of a prompt.
+
+`run` used to log a single total time, which doesn't tell whether a slow answer waited
+on the LLM, on the execution or on the retries. A `Trace` collects one `Span` per stage
+of a prompt: building the prompt, every LLM call, every execution, the conversational
+rewrite, the code summary and the rendering of the answer. Spans of LLM calls also
+count the tokens and bytes sent and the tokens received. The spans are logged with the
+prompt in the prompt_span table, see `src.sqlite`.
+"""
+import threading
+import time
+from contextlib import contextmanager
+from typing import Iterator, List, Optional
+
+try:
+    import tiktoken
+except ImportError:  # Token counts are estimated without it
+    tiktoken = None
+
+# Stages, in the order they happen
+PROMPT_BUILD = "prompt_build"
+LLM_GENERATE = "llm_generate"
+EXEC = "exec"
+RETRY = "retry"
+CONVERSATIONAL_REWRITE = "conversational_rewrite"
+CODE_SUMMARY = "code_summary"
+UI_RENDER = "ui_render"
+
+STAGES = (PROMPT_BUILD, LLM_GENERATE, EXEC, RETRY, CONVERSATIONAL_REWRITE, CODE_SUMMARY, UI_RENDER)
+
+# Characters per token of English text and code, when tiktoken is not available
+CHARACTERS_PER_TOKEN = 4
+
+_encodings = {}
+
+
+def count_tokens(text: Optional[str], model: Optional[str] = None) -> Optional[int]:
+    """
+    Count the tokens of a text with the tokenizer of the model, or estimate them from
+    its length if tiktoken or the tokenizer is not available.
+
+    Returns (int): The number of tokens, None if there is no text
+    """
+
+    if text is None:
+        return None
+
+    if tiktoken is not None:
+        if model not in _encodings:
+            try:
+                _encodings[model] = tiktoken.encoding_for_model(model)
+            except Exception:  # Unknown model or the tokenizer can't be downloaded
+                try:
+                    _encodings[model] = tiktoken.get_encoding("cl100k_base")
+                except Exception:
+                    _encodings[model] = None
+        if _encodings[model] is not None:
+            return len(_encodings[model].encode(text, disallowed_special=()))
+
+    return -(-len(text) // CHARACTERS_PER_TOKEN)
+
+
+class Span:
+    """
+    One stage of a prompt.
+
+    Args:
+        stage (str): One of `STAGES`
+        start (float): Timestamp the stage started at
+        attempt (int): The retry or speculative candidate the stage belongs to.
+        Default to None
+    """
+
+    def __init__(self, stage: str, start: float, attempt: Optional[int] = None):
+        self.stage = stage
+        self.start = start
+        self.attempt = attempt
+        self.duration: Optional[float] = None
+        self.prompt_tokens: Optional[int] = None
+        self.completion_tokens: Optional[int] = None
+        self.bytes_sent: Optional[int] = None
+        self._started: Optional[float] = None
+
+    def record_llm_call(self, sent: Optional[str], received: Optional[str], model: Optional[str] = None):
+        """Record the tokens and bytes of the prompt sent to the LLM and of its response"""
+        if sent is not None:
+            self.prompt_tokens = count_tokens(sent, model)
+            self.bytes_sent = len(sent.encode("utf-8"))
+        self.completion_tokens = count_tokens(received, model)
+
+    def __repr__(self):
+        return f"Span({self.stage!r}, duration={self.duration}, attempt={self.attempt})"
+
+
+class Trace:
+    """The spans of one prompt. Spans can be recorded from several threads"""
+
+    def __init__(self):
+        self.spans: List[Span] = []
+        self._lock = threading.Lock()
+
+    @contextmanager
+    def span(self, stage: str, attempt: Optional[int] = None) -> Iterator[Span]:
+        """
+        Time the block as a stage of the prompt. The span is recorded even if the
+        block raises.
+
+        Args:
+            stage (str): One of `STAGES`
+            attempt (int): The retry or speculative candidate. Default to None
+        """
+
+        span = self.start(stage, attempt)
+        try:
+            yield span
+        finally:
+            self.end(span)
+
+    def start(self, stage: str, attempt: Optional[int] = None) -> Span:
+        """Start timing a stage that doesn't fit in a block, see `end`"""
+        span = Span(stage, time.time(), attempt)
+        span._started = time.perf_counter()
+        return span
+
+    def end(self, span: Span) -> Span:
+        """Stop timing a span returned by `start` and record it"""
+        span.duration = time.perf_counter() - span._started
+        with self._lock:
+            self.spans.append(span)
+        return span
+
+    def merge(self, other: "Trace"):
+        """Record the spans of another trace, like the one of a speculative candidate"""
+        with other._lock:
+            spans = list(other.spans)
+        with self._lock:
+            self.spans.extend(spans)
+
+    def total(self, stage: str) -> float:
+        """Seconds spent in a stage, summed over its spans"""
+        with self._lock:
+            return sum(span.duration for span in self.spans if span.stage == stage)
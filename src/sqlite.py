@@ -1,18 +1,273 @@
 
 """
 This module contains functions for logging prompt-answer pairs in a SQLite database
+
+`PromptLogger` takes the writes off the request path: entries go to a bounded queue
+and a background thread inserts them in batches, one commit per batch, in WAL mode.
+Every thread reading the database opens its own connection with `connect`.
+
+The Prompt Database page reads the log a page at a time. Pages are keyed on the id of
+the last entry of the previous page rather than an offset, the error and date filters
+are backed by indexes and the text search by an FTS5 index kept in sync by triggers, so
+a page costs the same however large the log grows.
+
+The stages of every prompt, with their latency and the tokens sent to and received from
+the LLM, are logged in the prompt_span table, linked to their entry by prompt_id.
 """
+import atexit
+import logging
+import queue
+import sqlite3
+import threading
+import time
+
+LOGGER = logging.getLogger(__name__)
+
+PROMPT_LOG_DB = "prompt_log.db"
+
+# Columns added after the first version of the table, with their types
+PROMPT_LOG_EXTRA_COLUMNS = {
+    "backend": "TEXT",
+    "latency": "REAL",
+    "execution_latency": "REAL",
+    "candidate": "INTEGER",
+    "created_at": "REAL",
+    "prompt_id": "TEXT",
+}
+
+PROMPT_LOG_COLUMNS = (
+    "prompt", "full_prompt", "answer", "code_executed", "code_generated", "error",
+    "backend", "latency", "execution_latency", "candidate", "created_at", "prompt_id",
+)
+
+INSERT_PROMPT_LOG = (
+    f"INSERT INTO prompt_log ({', '.join(PROMPT_LOG_COLUMNS)}) "
+    f"VALUES ({', '.join('?' * len(PROMPT_LOG_COLUMNS))})"
+)
+
+PROMPT_SPAN_COLUMNS = (
+    "prompt_id", "stage", "attempt", "start", "duration", "prompt_tokens", "completion_tokens", "bytes_sent",
+)
 
-def log_prompt(conn, cursor, prompt, full_prompt, answer, code_executed, code_generated, error):
+INSERT_PROMPT_SPAN = (
+    f"INSERT INTO prompt_span ({', '.join(PROMPT_SPAN_COLUMNS)}) "
+    f"VALUES ({', '.join('?' * len(PROMPT_SPAN_COLUMNS))})"
+)
+
+def connect(path=PROMPT_LOG_DB):
+    """
+    Open a connection to the prompt log database in WAL mode, so readers don't block
+    the writer. Connections must not be shared between threads
+    """
+
+    conn = sqlite3.connect(path, timeout=30)
+    conn.execute("PRAGMA journal_mode=WAL")
+    # In WAL mode a commit is only synced at checkpoints, a crash can lose the last
+    # entries but never corrupts the database
+    conn.execute("PRAGMA synchronous=NORMAL")
+    return conn
+
+def create_prompt_log_table(conn):
     """
-    Log a prompt-answer pair in the database
+    Create the prompt_log and prompt_span tables, adding the columns missing from older
+    databases
+    """
+
+    cursor = conn.cursor()
+    cursor.execute('''CREATE TABLE IF NOT EXISTS prompt_log (
+                        id INTEGER PRIMARY KEY AUTOINCREMENT,
+                        prompt TEXT,
+                        full_prompt TEXT,
+                        answer TEXT,
+                        code_executed TEXT,
+                        code_generated TEXT,
+                        error TEXT
+                    )''')
+
+    existing_columns = {row[1] for row in cursor.execute("PRAGMA table_info(prompt_log)")}
+    for column, column_type in PROMPT_LOG_EXTRA_COLUMNS.items():
+        if column not in existing_columns:
+            cursor.execute(f"ALTER TABLE prompt_log ADD COLUMN {column} {column_type}")
+
+    cursor.execute("CREATE INDEX IF NOT EXISTS prompt_log_created_at ON prompt_log (created_at)")
+    cursor.execute("CREATE INDEX IF NOT EXISTS prompt_log_has_error ON prompt_log (error IS NOT NULL, id)")
+    cursor.execute("CREATE INDEX IF NOT EXISTS prompt_log_prompt_id ON prompt_log (prompt_id)")
+    create_search_index(cursor)
+
+    cursor.execute('''CREATE TABLE IF NOT EXISTS prompt_span (
+                        id INTEGER PRIMARY KEY AUTOINCREMENT,
+                        prompt_id TEXT,
+                        stage TEXT,
+                        attempt INTEGER,
+                        start REAL,
+                        duration REAL,
+                        prompt_tokens INTEGER,
+                        completion_tokens INTEGER,
+                        bytes_sent INTEGER
+                    )''')
+    cursor.execute("CREATE INDEX IF NOT EXISTS prompt_span_prompt_id ON prompt_span (prompt_id)")
+    cursor.execute("CREATE INDEX IF NOT EXISTS prompt_span_start ON prompt_span (start)")
+    conn.commit()
+
+def create_search_index(cursor):
+    """
+    Create the FTS5 index over prompt, answer and code_generated and the triggers that
+    keep it in sync, indexing the entries already logged. Returns False if SQLite was
+    built without FTS5, search then falls back to LIKE
+    """
+
+    if has_search_index(cursor):
+        return True
+
+    try:
+        cursor.execute('''CREATE VIRTUAL TABLE prompt_log_fts USING fts5(
+                            prompt, answer, code_generated, content='prompt_log', content_rowid='id'
+                        )''')
+    except sqlite3.OperationalError:
+        return False
+
+    cursor.execute('''CREATE TRIGGER IF NOT EXISTS prompt_log_fts_insert AFTER INSERT ON prompt_log BEGIN
+                        INSERT INTO prompt_log_fts (rowid, prompt, answer, code_generated)
+                        VALUES (new.id, new.prompt, new.answer, new.code_generated);
+                    END''')
+    cursor.execute('''CREATE TRIGGER IF NOT EXISTS prompt_log_fts_delete AFTER DELETE ON prompt_log BEGIN
+                        INSERT INTO prompt_log_fts (prompt_log_fts, rowid, prompt, answer, code_generated)
+                        VALUES ('delete', old.id, old.prompt, old.answer, old.code_generated);
+                    END''')
+    cursor.execute('''CREATE TRIGGER IF NOT EXISTS prompt_log_fts_update AFTER UPDATE ON prompt_log BEGIN
+                        INSERT INTO prompt_log_fts (prompt_log_fts, rowid, prompt, answer, code_generated)
+                        VALUES ('delete', old.id, old.prompt, old.answer, old.code_generated);
+                        INSERT INTO prompt_log_fts (rowid, prompt, answer, code_generated)
+                        VALUES (new.id, new.prompt, new.answer, new.code_generated);
+                    END''')
+    cursor.execute("INSERT INTO prompt_log_fts (prompt_log_fts) VALUES ('rebuild')")
+    return True
+
+def has_search_index(cursor):
+    return cursor.execute("SELECT 1 FROM sqlite_master WHERE name = 'prompt_log_fts'").fetchone() is not None
+
+def span_rows(prompt_id, spans):
+    """Rows of the prompt_span table for the spans of a prompt, see `src.spans.Span`"""
+    return [
+        (prompt_id, span.stage, span.attempt, span.start, span.duration,
+         span.prompt_tokens, span.completion_tokens, span.bytes_sent)
+        for span in spans
+    ]
+
+def log_prompt(conn, cursor, prompt, full_prompt, answer, code_executed, code_generated, error,
+               backend=None, latency=None, execution_latency=None, candidate=None, prompt_id=None, spans=()):
+    """
+    Log a prompt-answer pair in the database, with the backend that answered it, its
+    latency in seconds, the speculative candidate that won, if any, and the spans of
+    its stages
     """
 
     # Insert a new prompt-answer pair into the database
-    cursor.execute('''INSERT INTO prompt_log (prompt, full_prompt, answer, code_executed, code_generated, error)
-                      VALUES (?, ?, ?, ?, ?, ?)''', (prompt, full_prompt, answer, code_executed, code_generated, error))
+    cursor.execute(INSERT_PROMPT_LOG, (prompt, full_prompt, answer, code_executed, code_generated, error,
+                                       backend, latency, execution_latency, candidate, time.time(), prompt_id))
+    cursor.executemany(INSERT_PROMPT_SPAN, span_rows(prompt_id, spans))
     conn.commit()
 
+class PromptLogger:
+    """
+    Log prompt-answer pairs from a background thread.
+
+    Args:
+        path (str): Path of the database. Default to prompt_log.db
+        max_queue (int): Entries waiting to be written before new ones are dropped.
+        Default to 1000
+        batch_size (int): Entries written per commit at most. Default to 100
+        flush_interval (float): Seconds the writer waits for more entries before
+        committing a partial batch. Default to 0.5
+    """
+
+    def __init__(self, path=PROMPT_LOG_DB, max_queue=1000, batch_size=100, flush_interval=0.5):
+        self._path = path
+        self._batch_size = batch_size
+        self._flush_interval = flush_interval
+        self._queue = queue.Queue(maxsize=max_queue)
+        self.written = 0
+        self.dropped = 0
+
+        conn = connect(path)
+        create_prompt_log_table(conn)
+        conn.close()
+
+        self._thread = threading.Thread(target=self._run, name="prompt-logger", daemon=True)
+        self._thread.start()
+        # Entries still queued at shutdown are written before the process exits
+        atexit.register(self.close)
+
+    def log(self, prompt, full_prompt, answer, code_executed, code_generated, error,
+            backend=None, latency=None, execution_latency=None, candidate=None, prompt_id=None, spans=()):
+        """
+        Queue a prompt-answer pair, with the same fields as `log_prompt`. Returns
+        immediately, the entry is dropped if the queue is full
+        """
+
+        row = (prompt, full_prompt, answer, code_executed, code_generated, error,
+               backend, latency, execution_latency, candidate, time.time(), prompt_id)
+        self._put({INSERT_PROMPT_LOG: [row], INSERT_PROMPT_SPAN: span_rows(prompt_id, spans)}, prompt)
+
+    def log_spans(self, prompt_id, spans):
+        """
+        Queue spans of a prompt already logged, for the stages that end after the
+        entry is logged, like the rendering of the answer
+        """
+        self._put({INSERT_PROMPT_SPAN: span_rows(prompt_id, spans)}, prompt_id)
+
+    def _put(self, entry, description):
+        # An entry maps each insert statement to its rows, written in the same commit
+        try:
+            self._queue.put_nowait(entry)
+        except queue.Full:
+            self.dropped += 1
+            LOGGER.warning("Prompt log queue is full, dropped the entry for: %s", description)
+
+    def _run(self):
+        conn = connect(self._path)
+        try:
+            running = True
+            while running:
+                # Wait for an entry, then up to flush_interval for the rest of the batch
+                batch = [self._queue.get()]
+                deadline = time.monotonic() + self._flush_interval
+                try:
+                    while len(batch) < self._batch_size and None not in batch:
+                        batch.append(self._queue.get(timeout=max(deadline - time.monotonic(), 0)))
+                except queue.Empty:
+                    pass
+
+                if None in batch:
+                    running = False
+                    batch = [entry for entry in batch if entry is not None]
+                statements = {}
+                for entry in batch:
+                    for statement, rows in entry.items():
+                        statements.setdefault(statement, []).extend(rows)
+                try:
+                    with conn:
+                        for statement, rows in statements.items():
+                            conn.executemany(statement, rows)
+                    self.written += len(batch)
+                except sqlite3.Error:
+                    LOGGER.exception("Failed to write %d prompt log entries", len(batch))
+                finally:
+                    for _ in range(len(batch) + (not running)):
+                        self._queue.task_done()
+        finally:
+            conn.close()
+
+    def flush(self):
+        """Wait until every queued entry is written"""
+        self._queue.join()
+
+    def close(self):
+        """Write the queued entries and stop the writer thread"""
+        if self._thread.is_alive():
+            self._queue.put(None)
+            self._thread.join()
+
 # def retrieve_prompt_log(cursor):
 #     """
 #     Retrieve all prompt-answer pairs from the database
@@ -22,10 +277,114 @@ def log_prompt(conn, cursor, prompt, full_prompt, answer, code_executed, code_ge
 #     log_data = log_data[::-1]
 #     return log_data
 
-def retrieve_prompt_log(cursor):
+def _match_query(search):
+    """Quote every word of the search, so it is matched as text and not FTS5 syntax"""
+    return " ".join('"' + word.replace('"', '""') + '"' for word in search.split())
+
+def retrieve_prompt_log(cursor, before_id=None, limit=50, search=None, has_error=None, since=None, until=None):
+    """
+    Retrieve a page of prompt-answer pairs, starting with the latest entry. The answer
+    is cut to its first 1000 characters and full_prompt is left out, see
+    `retrieve_full_prompt`
+
+    Args:
+        before_id (int): Only entries older than this one, the last id of the previous
+        page. Default to None, starting from the latest entry
+        limit (int): Number of entries. Default to 50
+        search (str): Only entries whose prompt, answer or generated code contain
+        every word. Default to None
+        has_error (bool): Only entries with an error if True, without if False.
+        Default to None
+        since (float): Only entries logged at this timestamp or later. Default to None
+        until (float): Only entries logged before this timestamp. Default to None
+
+    Returns (list): Rows of id, prompt, answer, code_executed, code_generated, error,
+    backend, latency, execution_latency, candidate, created_at and prompt_id
     """
-    Retrieve all prompt-answer pairs from the database, starting with the latest entry
+
+    source = "prompt_log p"
+    order = "p.id"
+    conditions = []
+    parameters = []
+
+    if search and search.split():
+        if has_search_index(cursor):
+            source = "prompt_log_fts JOIN prompt_log p ON p.id = prompt_log_fts.rowid"
+            order = "prompt_log_fts.rowid"
+            conditions.append("prompt_log_fts MATCH ?")
+            parameters.append(_match_query(search))
+        else:
+            for word in search.split():
+                conditions.append("(p.prompt LIKE ? OR p.answer LIKE ? OR p.code_generated LIKE ?)")
+                parameters += [f"%{word}%"] * 3
+    if before_id is not None:
+        conditions.append(f"{order} < ?")
+        parameters.append(before_id)
+    if has_error is not None:
+        conditions.append("(p.error IS NOT NULL) = ?")
+        parameters.append(int(has_error))
+    if since is not None:
+        conditions.append("p.created_at >= ?")
+        parameters.append(since)
+    if until is not None:
+        conditions.append("p.created_at < ?")
+        parameters.append(until)
+
+    cursor.execute(f'''SELECT p.id, p.prompt, substr(p.answer, 1, 1000), p.code_executed, p.code_generated, p.error,
+                              p.backend, p.latency, p.execution_latency, p.candidate, p.created_at, p.prompt_id
+                       FROM {source}
+                       WHERE {" AND ".join(conditions) or "1"}
+                       ORDER BY {order} DESC LIMIT ?''', parameters + [limit])
+    return cursor.fetchall()
+
+def retrieve_full_prompt(cursor, id):
+    """
+    Retrieve the full prompt sent to the LLM for one entry
+    """
+    row = cursor.execute("SELECT full_prompt FROM prompt_log WHERE id = ?", (id,)).fetchone()
+    return row[0] if row else None
+
+def retrieve_spans(cursor, prompt_ids):
+    """
+    Retrieve the spans of some prompts, in the order their stages started
+
+    Returns (list): Rows of prompt_id, stage, attempt, duration, prompt_tokens,
+    completion_tokens and bytes_sent
+    """
+    prompt_ids = [prompt_id for prompt_id in prompt_ids if prompt_id is not None]
+    if not prompt_ids:
+        return []
+    cursor.execute(f'''SELECT prompt_id, stage, attempt, duration, prompt_tokens, completion_tokens, bytes_sent
+                       FROM prompt_span
+                       WHERE prompt_id IN ({", ".join("?" * len(prompt_ids))})
+                       ORDER BY start''', prompt_ids)
+    return cursor.fetchall()
+
+def retrieve_span_durations(cursor, since=None, until=None, limit=100_000):
+    """
+    Retrieve the duration of the latest spans, with the total latency of their prompt,
+    to compute latency percentiles per stage
+
+    Args:
+        since (float): Only spans started at this timestamp or later. Default to None
+        until (float): Only spans started before this timestamp. Default to None
+        limit (int): Number of spans at most. Default to 100000
+
+    Returns (list): Rows of prompt_id, stage, duration, prompt_tokens,
+    completion_tokens and the latency of the prompt
     """
-    cursor.execute('''SELECT * FROM prompt_log ORDER BY id DESC LIMIT 50''')
-    for row in cursor.fetchall():
-        yield row
\ No newline at end of file
+
+    conditions = []
+    parameters = []
+    if since is not None:
+        conditions.append("s.start >= ?")
+        parameters.append(since)
+    if until is not None:
+        conditions.append("s.start < ?")
+        parameters.append(until)
+
+    cursor.execute(f'''SELECT s.prompt_id, s.stage, s.duration, s.prompt_tokens, s.completion_tokens, p.latency
+                       FROM prompt_span s LEFT JOIN prompt_log p ON p.prompt_id = s.prompt_id
+                       WHERE {" AND ".join(conditions) or "1"}
+                       ORDER BY s.id DESC LIMIT ?''', parameters + [limit])
+    return cursor.fetchall()
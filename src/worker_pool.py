@@ -0,0 +1,377 @@
+"""
+This module contains the pool of worker processes the generated code is executed in.
+
+Executed in the Streamlit server, a runaway `df.apply` or a cartesian merge written by
+the LLM blocks the server and can take it down with an out of memory error for every
+session. The pool keeps worker processes with pandas, numpy, matplotlib and seaborn
+already imported. The workers memory-map the dataframes from the dataset store, so they
+are not pickled through a pipe on every run and the workers share them through the page
+cache. Each run has a wall-clock timeout and a cap on the memory the code allocates on
+top of the dataframes it was given, a worker exceeding either is killed and replaced. The result comes back as an
+`ExecutionResult` with the captured output, the last value, the figures and the
+dataframes and series the code created or modified.
+"""
+import builtins
+import multiprocessing
+import os
+import pickle
+import queue
+import tempfile
+import threading
+import time
+from collections import OrderedDict
+from typing import Dict, Iterable, Optional
+
+import pandas as pd
+from pandasai.constants import WHITELISTED_BUILTINS
+from pandasai.helpers._optional import import_dependency
+
+from .dataset_store import DatasetStore, read_dataframe
+from .execution import ExecutionResult, execute, track_frames
+from .sandbox import find_mutated_dataframes, protect_dataframes
+
+
+# How often the parent checks the deadline and the memory of a busy worker, in seconds
+POLL_INTERVAL = 0.05
+
+# Dataframes a worker keeps loaded between runs
+WORKER_CACHED_DATAFRAMES = 8
+
+
+class SandboxLimitError(Exception):
+    """The generated code was stopped before it finished"""
+
+
+class ExecutionTimeoutError(SandboxLimitError):
+    """The generated code ran longer than the timeout"""
+
+
+class ExecutionMemoryError(SandboxLimitError):
+    """The generated code used more memory than the limit"""
+
+
+class ExecutionCancelledError(SandboxLimitError):
+    """The run was cancelled, its result is no longer needed"""
+
+
+def build_environment(dependencies: Iterable[dict]) -> dict:
+    """
+    The globals the generated code runs with, as `PandasAI._get_environment` builds them.
+
+    Args:
+        dependencies (Iterable[dict]): The imports allowed by `_clean_code`, with the
+        module, name and alias of each
+
+    Returns (dict): A dictionary of environment variables
+    """
+
+    environment = {
+        "pd": pd,
+        "__builtins__": {builtin: getattr(builtins, builtin) for builtin in WHITELISTED_BUILTINS},
+    }
+    for lib in dependencies:
+        module = import_dependency(lib["module"])
+        environment[lib["alias"]] = getattr(module, lib["name"]) if hasattr(module, lib["name"]) else module
+    return environment
+
+
+def _warm_up():
+    """Import everything the generated code usually needs before the first run"""
+    import numpy  # noqa: F401
+    import matplotlib
+
+    matplotlib.use("Agg")
+    import matplotlib.pyplot  # noqa: F401
+
+    try:
+        import seaborn  # noqa: F401
+    except ImportError:
+        pass
+
+
+def _status_kb(field: str) -> Optional[int]:
+    """A memory field of /proc/self/status in kB, None where /proc is not available"""
+    try:
+        with open("/proc/self/status") as status:
+            for line in status:
+                if line.startswith(field + ":"):
+                    return int(line.split()[1])
+    except (OSError, ValueError, IndexError):
+        pass
+    return None
+
+
+def _limit_memory(memory_limit_mb: Optional[int]):
+    """
+    Make the allocations of the code past the limit fail with a MemoryError.
+
+    RLIMIT_DATA counts the heap and the private mappings, which include the python
+    objects and the Arrow buffers of the dataframes already loaded. The limit is set
+    on top of what the process uses once they are loaded, and lifted with None.
+    """
+    try:
+        import resource
+    except ImportError:
+        return
+    if not hasattr(resource, "RLIMIT_DATA"):
+        return
+    _, hard = resource.getrlimit(resource.RLIMIT_DATA)
+    if memory_limit_mb:
+        data_kb = _status_kb("VmData")
+        if data_kb is None:
+            return
+        soft = data_kb * 1024 + memory_limit_mb * 1024 ** 2
+        if hard != resource.RLIM_INFINITY:
+            soft = min(soft, hard)
+    else:
+        soft = hard
+    resource.setrlimit(resource.RLIMIT_DATA, (soft, hard))
+
+
+def _dumps(value) -> Optional[bytes]:
+    try:
+        return pickle.dumps(value, protocol=pickle.HIGHEST_PROTOCOL)
+    except Exception:
+        return None
+
+
+def _picklable_error(error: Exception) -> Exception:
+    """The error itself if it survives the trip to the parent, else its message"""
+    try:
+        pickle.loads(pickle.dumps(error))
+        return error
+    except Exception:
+        return RuntimeError(f"{type(error).__name__}: {error}")
+
+
+def _pack(execution: ExecutionResult, protected: dict, mutated: set) -> dict:
+    """
+    Pickle what the parent needs from the execution value by value, so one variable
+    that can't be pickled doesn't lose the whole answer. Only the dataframes and series
+    the code created or modified are sent back, see `track_frames`.
+    """
+
+    variables = {}
+    for name, value in track_frames(execution.environment, protected, mutated).items():
+        pickled = _dumps(value)
+        if pickled is not None:
+            variables[name] = pickled
+
+    result = _dumps(execution.result)
+    if result is None:
+        result = _dumps(str(execution.result))
+
+    return {
+        "output": execution.output,
+        "result": result,
+        "has_result": execution.has_result,
+        "printed_result": execution.printed_result,
+        "figures": [figure for figure in map(_dumps, execution.figures) if figure is not None],
+        "variables": variables,
+    }
+
+
+def _worker_main(connection, memory_limit_mb: Optional[int]):
+    _warm_up()
+
+    loaded = OrderedDict()
+    connection.send(os.getpid())
+
+    while True:
+        try:
+            code, paths, dependencies = connection.recv()
+        except EOFError:
+            return
+
+        try:
+            dataframes = {}
+            for name, path in paths.items():
+                if path not in loaded:
+                    loaded[path] = read_dataframe(path)
+                    if len(loaded) > WORKER_CACHED_DATAFRAMES:
+                        loaded.popitem(last=False)
+                loaded.move_to_end(path)
+                dataframes[name] = loaded[path]
+
+            # Only the memory allocated from here on counts towards the limit
+            _limit_memory(memory_limit_mb)
+            connection.send(("started", _status_kb("RssAnon")))
+
+            environment = build_environment(dependencies)
+            with protect_dataframes(code, dataframes) as protected:
+                environment.update(protected)
+                execution = execute(code, environment)
+            reply = ("ok", _pack(execution, protected, find_mutated_dataframes(code, dataframes.keys())))
+        except Exception as error:
+            reply = ("error", _picklable_error(error))
+        finally:
+            _limit_memory(None)
+
+        connection.send(reply)
+
+
+def _anonymous_rss_kb(pid: int) -> Optional[int]:
+    """
+    Resident anonymous memory of a process in kB, without the pages of memory-mapped
+    files like the dataframes of the store. None where /proc is not available
+    """
+    try:
+        with open(f"/proc/{pid}/status") as status:
+            for line in status:
+                if line.startswith("RssAnon:"):
+                    return int(line.split()[1])
+    except (OSError, ValueError, IndexError):
+        pass
+    return None
+
+
+class _Worker:
+    def __init__(self, context, memory_limit_mb: Optional[int]):
+        self.connection, child = context.Pipe()
+        self.process = context.Process(target=_worker_main, args=(child, memory_limit_mb), daemon=True)
+        self.process.start()
+        child.close()
+        self.ready = False
+
+    def wait_ready(self):
+        """Wait for the imports to finish, so they don't count towards the timeout"""
+        if not self.ready:
+            self.connection.recv()
+            self.ready = True
+
+    def kill(self):
+        self.process.kill()
+        self.process.join()
+        self.connection.close()
+
+
+class WorkerPool:
+    """
+    Worker processes executing generated code, shared by every session.
+
+    Args:
+        processes (int): Number of worker processes. Default to 2
+        timeout (float): Seconds a run may take before its worker is killed. Default
+        to 30, None for no limit
+        memory_limit_mb (int): Memory a run may allocate, in MB, on top of the
+        dataframes it was given, before its worker is killed. Its allocations fail
+        past the limit, and the growth of its resident anonymous memory is checked
+        on Linux. Default to None for no limit
+        store (DatasetStore): Store the workers read the dataframes from. Default to
+        None, a store in a new temporary directory
+    """
+
+    def __init__(
+        self,
+        processes: int = 2,
+        timeout: Optional[float] = 30,
+        memory_limit_mb: Optional[int] = None,
+        store: Optional[DatasetStore] = None,
+    ):
+        # Workers started from the fork server are forked from a process that already
+        # imported this module, so replacing a killed worker is cheap
+        if "forkserver" in multiprocessing.get_all_start_methods():
+            self._context = multiprocessing.get_context("forkserver")
+            self._context.set_forkserver_preload([__name__])
+        else:
+            self._context = multiprocessing.get_context("spawn")
+
+        self._timeout = timeout
+        self._memory_limit_mb = memory_limit_mb
+        self._store = store or DatasetStore(tempfile.mkdtemp(prefix="datasets_"))
+        self._idle = queue.Queue()
+        for _ in range(processes):
+            self._idle.put(_Worker(self._context, memory_limit_mb))
+
+    def execute(
+        self,
+        code: str,
+        dataframes: Dict[str, pd.DataFrame],
+        dependencies: Iterable[dict] = (),
+        cancel: Optional[threading.Event] = None,
+    ) -> ExecutionResult:
+        """
+        Execute the code once in a worker and capture its output, like `execute`.
+
+        Args:
+            code (str): A python code to execute
+            dataframes (dict): Mapping of environment name (`df`, `df1`, ...) to dataframe
+            dependencies (Iterable[dict]): The imports allowed by `_clean_code`
+            cancel (threading.Event): Set to kill the worker and stop waiting for the
+            result. Default to None
+
+        Raises:
+            ExecutionTimeoutError: The code ran longer than the timeout
+            ExecutionMemoryError: The code used more memory than the limit
+            ExecutionCancelledError: `cancel` was set before the code finished
+            SandboxLimitError: The worker died
+
+        Returns (ExecutionResult): The captured output, last value, figures and
+        environment
+        """
+
+        paths = {name: self._store.path(dataframe) for name, dataframe in dataframes.items()}
+
+        worker = self._idle.get()
+        try:
+            worker.wait_ready()
+            worker.connection.send((code, paths, list(dependencies)))
+            status, reply = self._wait(worker, cancel)
+        except BaseException as error:
+            # The worker may still be running the code, it can't be reused
+            worker.kill()
+            exitcode = worker.process.exitcode
+            worker = _Worker(self._context, self._memory_limit_mb)
+            if isinstance(error, (EOFError, OSError)):
+                raise SandboxLimitError(f"The process executing the code died with exit code {exitcode}") from error
+            raise
+        finally:
+            self._idle.put(worker)
+
+        if status == "error":
+            if isinstance(reply, MemoryError):
+                raise ExecutionMemoryError(f"The code used more than {self._memory_limit_mb} MB of memory") from reply
+            raise reply
+
+        environment = {name: pickle.loads(value) for name, value in reply["variables"].items()}
+
+        return ExecutionResult(
+            code=code,
+            output=reply["output"],
+            result=pickle.loads(reply["result"]),
+            has_result=reply["has_result"],
+            printed_result=reply["printed_result"],
+            figures=[pickle.loads(figure) for figure in reply["figures"]],
+            environment=environment,
+        )
+
+    def _wait(self, worker: _Worker, cancel: Optional[threading.Event] = None):
+        deadline = time.monotonic() + self._timeout if self._timeout else None
+        # Anonymous memory of the worker once the dataframes are loaded
+        baseline = None
+        while True:
+            if worker.connection.poll(POLL_INTERVAL):
+                status, reply = worker.connection.recv()
+                if status != "started":
+                    return status, reply
+                baseline = reply
+                continue
+            if not worker.process.is_alive():
+                raise EOFError
+            if cancel is not None and cancel.is_set():
+                raise ExecutionCancelledError("The execution was cancelled")
+            if deadline is not None and time.monotonic() > deadline:
+                raise ExecutionTimeoutError(f"The code did not finish within {self._timeout} seconds")
+            if self._memory_limit_mb and baseline is not None:
+                rss = _anonymous_rss_kb(worker.process.pid)
+                if rss is not None and rss - baseline > self._memory_limit_mb * 1024:
+                    raise ExecutionMemoryError(f"The code used more than {self._memory_limit_mb} MB of memory")
+
+    def close(self):
+        """Stop the idle workers"""
+        while True:
+            try:
+                worker = self._idle.get_nowait()
+            except queue.Empty:
+                return
+            worker.kill()
@@ -0,0 +1,162 @@
+import ast
+
+import numpy as np
+import pandas as pd
+import pytest
+
+from src.code_analysis import analyze_code, frame_names
+from src.profile import DatasetProfile
+
+
+def make_dataframes():
+    rng = np.random.default_rng(0)
+    rows = 2_000
+    df = pd.DataFrame({
+        "a": rng.integers(0, 100, rows),
+        "b": rng.random(rows),
+        "s": rng.choice(["apple", "Banana", None], rows),
+        "k": rng.choice(list("xyz"), rows),
+    })
+    df.loc[5, "b"] = np.nan
+    df1 = pd.DataFrame({"k": rng.choice(list("xyz"), rows), "w": 1.0})
+    return {"df": df, "df1": df1}
+
+
+def run(code: str, dataframes: dict):
+    """Execute the code on copies of the dataframes, return the value of its last line"""
+    environment = {"pd": pd, **{name: dataframe.copy() for name, dataframe in dataframes.items()}}
+    *body, last = code.strip().split("\n")
+    exec("\n".join(body), environment)
+    return eval(last, environment)
+
+
+def assert_same(expected, actual):
+    if isinstance(expected, pd.Series):
+        pd.testing.assert_series_equal(expected, actual, check_dtype=False, check_names=False)
+    elif isinstance(expected, pd.DataFrame):
+        pd.testing.assert_frame_equal(expected, actual, check_dtype=False)
+    elif isinstance(expected, dict):
+        assert list(expected) == list(actual)
+        for key in expected:
+            assert_same(expected[key], actual[key])
+    elif pd.isna(expected):
+        assert pd.isna(actual)
+    else:
+        assert expected == pytest.approx(actual)
+
+
+def analyze(code: str, dataframes: dict):
+    profiles = {name: DatasetProfile.from_dataframe(dataframe) for name, dataframe in dataframes.items()}
+    return analyze_code(code, profiles)
+
+
+REWRITTEN = [
+    "df['c'] = df.apply(lambda row: 'high' if row['a'] > 50 and row['b'] < 0.5 else 'low', axis=1)\ndf['c']",
+    "df.apply(lambda r: r.a * 2 + r['b'], axis=1)",
+    "df['a'].apply(lambda x: x * 2 if x not in [1, 2] else -x)",
+    "df['k'].map(lambda x: x.upper().startswith('X'))",
+    "df['k'].apply(lambda x: len(x) + 1)",
+    "subset = df[df['a'] > 10]\nsubset['k'].apply(lambda x: x.upper())",
+    "total = 0\nfor i, row in df.iterrows():\n    if row['a'] > 10:\n        total += row['b']\ntotal",
+    "count = 0\nfor _, row in df.iterrows():\n    if row['k'] == 'x' or row['a'] < 3:\n        count += 1\ncount",
+    "totals = {}\nfor _, row in df.iterrows():\n    totals[row['k']] = totals.get(row['k'], 0) + row['b']\ntotals",
+    "counts = {}\nfor _, row in df.iterrows():\n    counts[row['k']] = counts.get(row['k'], 0) + 1\ncounts",
+    "res = pd.DataFrame()\nfor key in ['x', 'y']:\n    part = df[df['k'] == key].head(2)\n"
+    "    res = pd.concat([res, part], ignore_index=True)\nres",
+    "res = df.head(0)\nfor key in []:\n    res = pd.concat([res, df.head(1)], ignore_index=True)\nres",
+]
+
+
+@pytest.mark.parametrize("code", REWRITTEN)
+def test_rewrite_gives_the_same_result(code):
+    dataframes = make_dataframes()
+    analysis = analyze(code, dataframes)
+
+    assert analysis.rewrites
+    assert analysis.code != code
+    assert_same(run(code, dataframes), run(analysis.code, dataframes))
+
+
+UNCHANGED = [
+    # apply and map on a groupby run once per group, not once per value
+    "g = df.groupby('k')\ng['b'].apply(lambda x: len(x))",
+    "g = df.groupby('k')\ng['b'].apply(lambda x: x * 2)",
+    "df.groupby('k')['b'].apply(lambda x: x.max() - x.min())",
+    # Names that aren't always a dataframe
+    "x = df\nx = df.groupby('k')\nx['b'].apply(lambda v: v * 2)",
+    "for frame in [df, df1]:\n    frame['k'].apply(lambda v: v.upper())\nframe['k'].apply(lambda v: v.upper())",
+    # Attributes of the row, not columns
+    "df.apply(lambda r: r.name, axis=1)",
+]
+
+
+@pytest.mark.parametrize("code", UNCHANGED)
+def test_other_objects_are_not_rewritten(code):
+    dataframes = make_dataframes()
+    analysis = analyze(code, dataframes)
+
+    assert analysis.rewrites == []
+    assert analysis.code == code
+    assert_same(run(code, dataframes), run(analysis.code, dataframes))
+
+
+def make_categorical_dataframes():
+    # Low-cardinality strings are ingested as categoricals, see src.ingestion
+    dataframes = make_dataframes()
+    df = dataframes["df"]
+    df["k"] = df["k"].astype("category")
+    df["s"] = df["s"].astype("category")
+    return dataframes
+
+
+CATEGORICAL = [
+    "df.apply(lambda r: r['k'] + ' role', axis=1)",
+    "df.apply(lambda r: r['k'] > 'x' and r['a'] > 10, axis=1)",
+    "df.apply(lambda r: r['k'] == 'x' or r['k'] in ['y'], axis=1)",
+    "df.apply(lambda r: r['k'].upper() + '-' + str(r['a']), axis=1)",
+    "df.apply(lambda r: 'high' if r['a'] > 50 else r['k'], axis=1)",
+    "df.apply(lambda r: r['k'] == r['s'], axis=1)",
+    "total = 0\nfor _, row in df.iterrows():\n    if row['k'] != 'x':\n        total += row['b']\ntotal",
+    "counts = {}\nfor _, row in df.iterrows():\n    counts[row['k']] = counts.get(row['k'], 0) + 1\ncounts",
+]
+
+
+@pytest.mark.parametrize("code", CATEGORICAL)
+def test_rewrite_of_categorical_columns_gives_the_same_result(code):
+    dataframes = make_categorical_dataframes()
+    analysis = analyze(code, dataframes)
+
+    assert analysis.rewrites
+    assert_same(run(code, dataframes), run(analysis.code, dataframes))
+
+
+@pytest.mark.parametrize("code", [
+    "df['k'].apply(lambda x: x + ' role')",
+    "df['k'].apply(lambda x: x > 'x')",
+    "df['s'].map(lambda x: x * 2)",
+    "df['s'].apply(lambda x: x.upper())",
+])
+def test_apply_on_categorical_columns_is_not_rewritten(code):
+    dataframes = make_categorical_dataframes()
+    analysis = analyze(code, dataframes)
+
+    assert analysis.rewrites == []
+    assert_same(run(code, dataframes), run(analysis.code, dataframes))
+
+
+def test_frame_names():
+    tree = ast.parse(
+        "a = df[df['x'] > 1]\nb = a.head()\nc = df.groupby('k')\nd = df\nd = c\n"
+        "e = df1[['x']]\nfor f in [df]:\n    pass\n"
+    )
+    assert frame_names(tree, ["df", "df1"]) == {"df", "df1", "a", "b", "e"}
+
+
+def test_expensive_patterns_are_reported():
+    dataframes = make_dataframes()
+    code = "out = []\nfor i, row in df.iterrows():\n    out.append(row['a'])\ndf.merge(df1, on='k')"
+    analysis = analyze_code(code, {name: DatasetProfile.from_dataframe(dataframe)
+                                   for name, dataframe in dataframes.items()}, min_seconds=0)
+
+    assert {issue.kind for issue in analysis.issues} == {"iterrows", "merge"}
+    assert all(issue.seconds > 0 for issue in analysis.issues)
@@ -0,0 +1,39 @@
+import gc
+import os
+
+import numpy as np
+import pandas as pd
+
+from src.dataset_store import DatasetStore
+
+
+def make_dataframe(value):
+    # About 800 kB on disk, with the index
+    return pd.DataFrame({"a": np.full(50_000, value, dtype="float64")})
+
+
+def test_least_recently_used_files_are_evicted(tmp_path):
+    for value in range(4):
+        DatasetStore(str(tmp_path)).put(f"k{value}", make_dataframe(value))
+        os.utime(tmp_path / f"k{value}.arrow", (value, value))
+    gc.collect()
+    store = DatasetStore(str(tmp_path), size_limit_mb=3)
+    loaded, _ = store.get("k0")
+    os.utime(tmp_path / "k0.arrow", (0, 0))
+    store.put("k4", make_dataframe(4))
+
+    # k0 is the least recently used but still loaded, k1 and k2 are next
+    assert sorted(os.listdir(tmp_path)) == ["k0.arrow", "k0.json", "k3.arrow", "k3.json", "k4.arrow", "k4.json"]
+    assert store.evictions == 2
+    assert store.get("k1") is None
+    pd.testing.assert_frame_equal(store.get("k0")[0], loaded)
+
+
+def test_get_marks_the_file_as_used(tmp_path):
+    store = DatasetStore(str(tmp_path))
+    store.put("k", make_dataframe(0))
+    os.utime(tmp_path / "k.arrow", (0, 0))
+
+    store.get("k")
+
+    assert os.path.getmtime(tmp_path / "k.arrow") > 0
@@ -0,0 +1,24 @@
+import io
+
+import pandas as pd
+import pytest
+
+from src.ingestion import ingest_csv
+
+CSV = "year,ratio,bonus,level\n" + "".join(
+    f"{2020 + i % 4},{(i % 3) * 50},{'' if i % 5 == 0 else i * 10},{'EN' if i % 2 else 'SE'}\n" for i in range(200)
+)
+
+
+@pytest.mark.parametrize("engine", ["pandas", "pyarrow"])
+def test_integer_arithmetic_does_not_overflow(engine):
+    # Several chunks, some without missing bonus
+    options = {"chunk_rows": 64} if engine == "pandas" else {}
+    df, _ = ingest_csv(io.BytesIO(CSV.encode()), engine=engine, **options)
+    expected = pd.read_csv(io.StringIO(CSV))
+
+    assert df["year"].dtype == "int64"
+    assert (df["year"] * 100).max() == (expected["year"] * 100).max() == 202300
+    assert (df["ratio"] * 1000).max() == 100_000
+    assert df["bonus"].dtype == "Int64"
+    assert (df["bonus"] ** 2).max() == expected["bonus"].max() ** 2
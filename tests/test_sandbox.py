@@ -0,0 +1,66 @@
+import numpy as np
+import pandas as pd
+import pytest
+
+from src.sandbox import find_mutated_dataframes, protect_dataframes
+
+# Writing through views is what the tests check
+pytestmark = pytest.mark.filterwarnings("ignore::pandas.errors.SettingWithCopyWarning")
+
+
+def make_dataframes():
+    return {
+        "df": pd.DataFrame({"a": [1.0, 2.0, 3.0], "k": ["x", "y", "z"]}),
+        "df1": pd.DataFrame({"b": [4.0, 5.0, 6.0]}),
+    }
+
+
+MUTATING = [
+    "df['c'] = 1",
+    "df.loc[0, 'a'] = 10",
+    "df.drop(columns=['k'], inplace=True)",
+    "s = df['a']\ns[0] = 10",
+    "df.values[0, 0] = 10",
+    "df['a'].to_numpy()[0] = 10",
+    "x = df['a'].values\nx[:] = 0",
+    "np.asarray(df['a'])[0] = 10",
+    "np.multiply(df['a'], 2, out=df['a'])",
+    "getattr(df, 'values')[0, 0] = 10",
+    "frames = [df]\nframes[0]['a'] = 10",
+    "for frame in [df]:\n    frame.loc[0, 'a'] = 10",
+    "def change(d):\n    d.loc[0, 'a'] = 10\nchange(df)",
+    "df.columns = ['x', 'y']",
+]
+
+
+@pytest.mark.parametrize("code", MUTATING)
+def test_mutations_do_not_reach_the_original(code):
+    dataframes = make_dataframes()
+    originals = {name: dataframe.copy() for name, dataframe in dataframes.items()}
+
+    assert find_mutated_dataframes(code, dataframes.keys()) == {"df"}
+    with protect_dataframes(code, dataframes) as protected:
+        exec(code, {"np": np, "pd": pd, **protected})
+
+    for name, dataframe in dataframes.items():
+        pd.testing.assert_frame_equal(dataframe, originals[name])
+
+
+READ_ONLY = [
+    "df['a'].sum()",
+    "values = [1, 2]\nvalues[0] = df['a'].max()\ndf1.describe()",
+    "total = 0\nfor _, row in df.iterrows():\n    total += row['a']",
+    "df[df['a'] > 1].groupby('k')['a'].mean()",
+]
+
+
+@pytest.mark.parametrize("code", READ_ONLY)
+def test_read_only_code_shares_the_data(code):
+    dataframes = make_dataframes()
+
+    assert find_mutated_dataframes(code, dataframes.keys()) == set()
+    with protect_dataframes(code, dataframes) as protected:
+        assert not pd.get_option("mode.copy_on_write")
+        for name, dataframe in protected.items():
+            assert np.shares_memory(dataframe["a" if name == "df" else "b"].to_numpy(),
+                                    dataframes[name]["a" if name == "df" else "b"].to_numpy())